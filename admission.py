@@ -0,0 +1,154 @@
+import threading
+import time
+
+from PIL import Image, ImageMode
+
+
+# Cost model per task, measured on 12MP images (decode + processing + result
+# encode): (bytes per decoded image byte, extra bytes per pixel, CPU ms per decoded MB)
+TASK_COSTS = {
+    'encode_message_lsb': (2.5, 0, 55),
+    'decode_message_lsb': (2, 0, 6),
+    'add_visible_watermark': (2.5, 4, 55),
+    'add_visible_watermark_image': (2.5, 8, 55),
+    'add_invisible_watermark': (2.5, 0, 55),
+    'extract_invisible_watermark': (2, 0, 8),
+    'compare_images': (2, 0, 25)
+}
+DEFAULT_COST = (3, 0, 60)
+DCT_COST = (0, 16, 10)  # method='dct': float32 luminance, block copies and pixel offsets
+
+REJECT_REASONS = ('pixels', 'memory', 'cpu', 'budget', 'decompression_bomb', 'archive')
+
+
+class AdmissionRejected(Exception):
+    # status 413: the request alone exceeds a per-request limit (retrying won't help);
+    # status 503: the global budget stayed full for the whole wait (retry later)
+    def __init__(self, message, status, reason, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _image_dimensions(arg):
+    # (pixels, bands) from the header of a lazy image or a SharedImage handle
+    if isinstance(arg, Image.Image):
+        return arg.size[0] * arg.size[1], len(arg.getbands())
+    size, mode = getattr(arg, 'size', None), getattr(arg, 'mode', None)
+    if isinstance(size, tuple) and isinstance(mode, str):
+        return size[0] * size[1], len(ImageMode.getmode(mode).bands)
+    return None
+
+
+def estimate_cost(name, args, kwargs):
+    # Memory (bytes) and CPU (seconds) a task is expected to need, from image
+    # dimensions and mode only - nothing is decoded
+    per_value, per_pixel, ms_per_mb = TASK_COSTS.get(name, DEFAULT_COST)
+    if kwargs.get('method') == 'dct':
+        per_value, per_pixel, ms_per_mb = (per_value + DCT_COST[0], per_pixel + DCT_COST[1],
+                                           ms_per_mb + DCT_COST[2])
+
+    pixels, memory, cpu = 0, 0, 0.0
+    for arg in args:
+        dimensions = _image_dimensions(arg)
+        if dimensions is None:
+            continue
+        image_pixels, bands = dimensions
+        values = image_pixels * bands
+        pixels = max(pixels, image_pixels)
+        memory += values * per_value + image_pixels * per_pixel
+        cpu += values / (1024 * 1024) * ms_per_mb / 1000
+    return {'pixels': pixels, 'memory': int(memory), 'cpu': round(cpu, 3)}
+
+
+def _megabytes(value):
+    return f'{value / (1024 * 1024):,.0f} MB'
+
+
+class AdmissionController:
+    # Per-request limits plus global budgets for the work in flight; requests
+    # that don't fit the global budget wait (bounded) for running jobs to finish
+
+    def __init__(self, max_pixels, request_memory, request_cpu, memory_budget, cpu_budget,
+                 wait=5, retry_after=2):
+        self.max_pixels = max_pixels
+        self.request_memory = request_memory
+        self.request_cpu = request_cpu
+        self.memory_budget = memory_budget
+        self.cpu_budget = cpu_budget
+        self.wait = wait
+        self.retry_after = retry_after
+        self._condition = threading.Condition()
+        self._memory = 0
+        self._cpu = 0.0
+        self._running = 0
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = dict.fromkeys(REJECT_REASONS, 0)
+
+    def _reject(self, message, status, reason):
+        with self._condition:
+            self._rejected[reason] += 1
+        raise AdmissionRejected(message, status, reason,
+                                retry_after=self.retry_after if status == 503 else None)
+
+    def record_rejection(self, reason):
+        # Rejections detected outside admit() (e.g. Pillow's decompression bomb check)
+        with self._condition:
+            self._rejected[reason] += 1
+
+    def _fits(self, cost):
+        return (self._memory + cost['memory'] <= self.memory_budget and
+                self._cpu + cost['cpu'] <= self.cpu_budget)
+
+    def admit(self, name, args, kwargs, timeout=None):
+        cost = estimate_cost(name, args, kwargs)
+
+        if cost['pixels'] > self.max_pixels:
+            self._reject(f"Image too large: {cost['pixels']:,} pixels exceeds the {self.max_pixels:,} pixel limit",
+                         413, 'pixels')
+        if cost['memory'] > min(self.request_memory, self.memory_budget):
+            self._reject(f"Request too large: estimated memory {_megabytes(cost['memory'])} exceeds the "
+                         f"{_megabytes(min(self.request_memory, self.memory_budget))} budget", 413, 'memory')
+        if cost['cpu'] > min(self.request_cpu, self.cpu_budget):
+            self._reject(f"Request too large: estimated CPU time {cost['cpu']:.1f}s exceeds the "
+                         f"{min(self.request_cpu, self.cpu_budget):.1f}s budget", 413, 'cpu')
+
+        wait = self.wait if timeout is None else timeout
+        with self._condition:
+            if not self._fits(cost):
+                self._queued += 1
+                deadline = time.monotonic() + wait
+                while not self._fits(cost):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected['budget'] += 1
+                        raise AdmissionRejected('Server busy: memory/CPU budget is full, please retry later',
+                                                503, 'budget', retry_after=self.retry_after)
+                    self._condition.wait(remaining)
+            self._memory += cost['memory']
+            self._cpu += cost['cpu']
+            self._running += 1
+            self._admitted += 1
+        return cost
+
+    def release(self, cost):
+        with self._condition:
+            self._memory -= cost['memory']
+            self._cpu -= cost['cpu']
+            self._running -= 1
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'rejected': dict(self._rejected),
+                'running': self._running,
+                'memory_in_flight': self._memory,
+                'memory_budget': self.memory_budget,
+                'cpu_in_flight': round(self._cpu, 3),
+                'cpu_budget': self.cpu_budget
+            }
@@ -1,27 +1,270 @@
-from flask import Flask, render_template, request, send_file, jsonify
-from PIL import Image
+from flask import Flask, Response, render_template, request, send_file, jsonify
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.http import parse_options_header
+from PIL import Image, ImageMode
+from collections import OrderedDict
 import io
+import json
 import os
+import threading
+import uuid
 
 # Import modul steganografi dan watermarking yang sudah dipisahkan
-from steganography import encode_message_lsb, decode_message_lsb, get_max_message_size
-from watermarking import (
-    add_visible_watermark,
-    add_visible_watermark_image,
-    add_invisible_watermark,
-    extract_invisible_watermark,
-    compare_images
+from steganography import (
+    get_max_message_size,
+    get_capacity,
+    prepare_message_bits,
+    prepare_payload
 )
+from watermarking import INVISIBLE_METHODS
+from tracing import TRACE_LEVELS, TRACE_FULL, TRACE_OFF
+from batch import read_batch_inputs, output_name, process_batch, stream_zip, BatchTooLarge
+from workers import WorkerPool, PoolBusy, JobTimeout, SharedImage
+from admission import AdmissionController, AdmissionRejected
+from jobs import JobStore, JobQueueFull, FINISHED_STATES
+from result_cache import ResultCache
+from output import OUTPUT_PROFILES, LOSSLESS_PROFILES, DEFAULT_PROFILE
+import telemetry
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
+app.config['BATCH_WORKERS'] = os.cpu_count() or 4  # parallel images per batch request
+# Checked before archive members are decompressed, so a small zip/tar can't bypass MAX_CONTENT_LENGTH
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 1000))  # files / archive entries
+app.config['BATCH_MAX_BYTES'] = int(os.environ.get('BATCH_MAX_BYTES', 256)) * 1024 * 1024  # MB uncompressed
+
+# Worker pool for the CPU-heavy steganography/watermarking calls
+app.config['WORKER_BACKEND'] = os.environ.get('WORKER_BACKEND', 'process')  # process / thread / inline
+app.config['WORKER_COUNT'] = int(os.environ.get('WORKER_COUNT', os.cpu_count() or 2))
+app.config['WORKER_QUEUE_SIZE'] = int(os.environ.get('WORKER_QUEUE_SIZE', 16))  # waiting jobs before 503
+app.config['JOB_TIMEOUT'] = int(os.environ.get('JOB_TIMEOUT', 60))  # seconds
+app.config['RETRY_AFTER'] = 2  # seconds, sent with 503 responses
+app.config['OUTPUT_PROFILE'] = os.environ.get('OUTPUT_PROFILE', DEFAULT_PROFILE)  # default result encoding
+app.config['RESULT_STEPS_LIMIT'] = 256  # traces kept for binary responses (oldest dropped first)
+
+# Admission control: estimated cost from the image header, checked before decoding
+app.config['MAX_IMAGE_PIXELS'] = int(os.environ.get('MAX_IMAGE_PIXELS', 100_000_000))  # per image
+app.config['REQUEST_MEMORY_BUDGET'] = int(os.environ.get('REQUEST_MEMORY_BUDGET', 1024)) * 1024 * 1024  # MB
+app.config['REQUEST_CPU_BUDGET'] = float(os.environ.get('REQUEST_CPU_BUDGET', app.config['JOB_TIMEOUT']))  # s
+app.config['MEMORY_BUDGET'] = int(os.environ.get('MEMORY_BUDGET', 2048)) * 1024 * 1024  # MB, all jobs in flight
+app.config['CPU_BUDGET'] = float(os.environ.get('CPU_BUDGET',
+                                                app.config['WORKER_COUNT'] * app.config['JOB_TIMEOUT']))  # s
+app.config['ADMISSION_WAIT'] = float(os.environ.get('ADMISSION_WAIT', 5))  # s queued for budget before 503
+
+# Background jobs (/jobs/...): results kept in OUTPUT_FOLDER until TTL or size eviction
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', app.config['WORKER_COUNT']))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 256))  # pending jobs before 503
+app.config['JOB_RESULT_TTL'] = int(os.environ.get('JOB_RESULT_TTL', 3600))  # seconds after finishing
+app.config['JOB_RESULTS_MAX_BYTES'] = int(os.environ.get('JOB_RESULTS_MAX_BYTES', 1024)) * 1024 * 1024  # MB
+app.config['JOB_RETRY_TIMEOUT'] = int(os.environ.get('JOB_RETRY_TIMEOUT', 600))  # s retrying a busy pool
+
+# Result cache keyed by input bytes + normalized parameters (0 MB disables a tier)
+app.config['RESULT_CACHE_FOLDER'] = os.environ.get('RESULT_CACHE_FOLDER', 'cache')
+app.config['RESULT_CACHE_MEMORY'] = int(os.environ.get('RESULT_CACHE_MEMORY', 128)) * 1024 * 1024  # MB
+app.config['RESULT_CACHE_DISK'] = int(os.environ.get('RESULT_CACHE_DISK', 1024)) * 1024 * 1024  # MB
+
+# Logging of the processing modules: level plus the fraction of info/debug records kept
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+app.config['LOG_SAMPLE_RATE'] = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+telemetry.configure_logging(('steganography', 'watermarking'), app.config['LOG_LEVEL'],
+                            app.config['LOG_SAMPLE_RATE'])
+
+# Pillow's own decompression bomb check follows the same pixel limit
+Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
+
+RESPONSE_MODES = ('json', 'binary')
 
 # Create folders if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+admission = AdmissionController(
+    max_pixels=app.config['MAX_IMAGE_PIXELS'],
+    request_memory=app.config['REQUEST_MEMORY_BUDGET'],
+    request_cpu=app.config['REQUEST_CPU_BUDGET'],
+    memory_budget=app.config['MEMORY_BUDGET'],
+    cpu_budget=app.config['CPU_BUDGET'],
+    wait=app.config['ADMISSION_WAIT'],
+    retry_after=app.config['RETRY_AFTER']
+)
+
+job_store = JobStore(
+    app.config['OUTPUT_FOLDER'],
+    ttl=app.config['JOB_RESULT_TTL'],
+    max_bytes=app.config['JOB_RESULTS_MAX_BYTES'],
+    workers=app.config['JOB_WORKERS'],
+    max_pending=app.config['JOB_QUEUE_SIZE'],
+    retry_timeout=app.config['JOB_RETRY_TIMEOUT'],
+    retry_after=app.config['RETRY_AFTER']
+)
+
+result_cache = None
+if app.config['RESULT_CACHE_MEMORY'] > 0 or app.config['RESULT_CACHE_DISK'] > 0:
+    result_cache = ResultCache(
+        app.config['RESULT_CACHE_FOLDER'],
+        memory_bytes=app.config['RESULT_CACHE_MEMORY'],
+        disk_bytes=app.config['RESULT_CACHE_DISK']
+    )
+
+worker_pool = WorkerPool(
+    backend=app.config['WORKER_BACKEND'],
+    workers=app.config['WORKER_COUNT'],
+    queue_size=app.config['WORKER_QUEUE_SIZE'],
+    job_timeout=app.config['JOB_TIMEOUT'],
+    retry_after=app.config['RETRY_AFTER'],
+    admission=admission,
+    cache=result_cache
+)
+
+@app.before_request
+def start_request_timer():
+    # Per-stage request timings (decode / queue / process / encode / serialize) for /metrics
+    telemetry.start_request(request.endpoint or 'not_found')
+
+@app.after_request
+def finish_request_timer(response):
+    telemetry.finish_request(response.status_code)
+    return response
+
+def error_response(e):
+    # Queue full / budget full -> 503 with Retry-After, over a per-request
+    # limit -> 413, job too slow -> 504, anything else -> 500
+    if isinstance(e, (PoolBusy, JobQueueFull)):
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    if isinstance(e, AdmissionRejected):
+        response = jsonify({'error': str(e), 'reason': e.reason})
+        if e.retry_after is not None:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
+    if isinstance(e, BatchTooLarge):
+        admission.record_rejection('archive')
+        return jsonify({'error': str(e), 'reason': 'archive'}), 413
+    if isinstance(e, Image.DecompressionBombError):
+        admission.record_rejection('decompression_bomb')
+        return jsonify({'error': str(e), 'reason': 'decompression_bomb'}), 413
+    if isinstance(e, JobTimeout):
+        return jsonify({'error': str(e)}), 504
+    return jsonify({'error': str(e)}), 500
+
+def get_trace_level(default=TRACE_FULL):
+    # Trace level from the form: off / summary / full (None if invalid)
+    trace_level = request.form.get('trace', default)
+    return trace_level if trace_level in TRACE_LEVELS else None
+
+def get_response_mode():
+    # json: base64 image inside JSON (default), binary: raw image/png + result id (None if invalid)
+    response_mode = request.form.get('response', 'json')
+    return response_mode if response_mode in RESPONSE_MODES else None
+
+def get_output_profile(lossless_only=False):
+    # Output profile from the form, falling back to the server default.
+    # LSB routes only accept lossless profiles (None if invalid)
+    profile = request.form.get('profile')
+    if profile is None:
+        profile = app.config['OUTPUT_PROFILE']
+        if lossless_only and profile not in LOSSLESS_PROFILES:
+            profile = DEFAULT_PROFILE
+    allowed = LOSSLESS_PROFILES if lossless_only else OUTPUT_PROFILES
+    return profile if profile in allowed else None
+
+def get_stego_message():
+    # Text from 'message' or a binary file from 'payload' (None if neither)
+    if 'payload' in request.files:
+        return request.files['payload'].read()
+    return request.form.get('message')
+
+def get_compress():
+    # Payload compression (deflate, only kept when smaller); on unless compress=0
+    return request.form.get('compress', '1').lower() not in ('0', 'false', 'no')
+
+def get_dimensions():
+    # (width, height) from the form, both positive integers (None if missing or invalid)
+    try:
+        size = (int(request.form['width']), int(request.form['height']))
+    except (KeyError, ValueError):
+        return None
+    return size if size[0] > 0 and size[1] > 0 else None
+
+def get_invisible_method(default='lsb', allowed=INVISIBLE_METHODS):
+    # 'lsb' (exact pixels, lossless output only) or 'dct' (survives JPEG); None if invalid
+    method = request.form.get('method', default)
+    return method if method in allowed else None
+
+def profile_error(lossless_only=False):
+    allowed = LOSSLESS_PROFILES if lossless_only else OUTPUT_PROFILES
+    return jsonify({'error': f"Profile must be one of: {', '.join(allowed)}"}), 400
+
+def output_headers(response, output):
+    # Encode cost of the result, for file responses
+    response.headers['X-Output-Profile'] = output.profile
+    response.headers['X-Output-Size'] = str(output.size)
+    response.headers['X-Encode-Time-Ms'] = str(output.encode_ms)
+    response.headers['X-Cache'] = 'hit' if output.cached else 'miss'
+    response.headers['Access-Control-Expose-Headers'] = \
+        'X-Result-Id, X-Output-Profile, X-Output-Size, X-Encode-Time-Ms, X-Cache'
+    return response
+
+# Traces of binary responses, fetched afterwards via /results/<id>/steps
+result_steps = OrderedDict()
+result_steps_lock = threading.Lock()
+
+def image_response(output, steps, download_name):
+    # Send the encoded image as-is; the (small) trace is kept under a result id
+    result_id = uuid.uuid4().hex
+    with result_steps_lock:
+        result_steps[result_id] = steps
+        while len(result_steps) > app.config['RESULT_STEPS_LIMIT']:
+            result_steps.popitem(last=False)
+
+    response = send_file(io.BytesIO(output.data), mimetype=output.mimetype, as_attachment=True,
+                         download_name=download_name + output.extension)
+    response.headers['X-Result-Id'] = result_id
+    return output_headers(response, output)
+
+def get_tile_options(stamp_text=None):
+    # Spacing/rotation for position=tiled (ignored by the other positions).
+    # None if invalid: spacing must be an integer >= 0 and a tiled text stamp non-empty
+    spacing = request.form.get('spacing')
+    try:
+        spacing = int(spacing) if spacing else None
+        rotation = float(request.form.get('rotation', 30))
+    except ValueError:
+        return None
+    if spacing is not None and spacing < 0:
+        return None
+    if stamp_text is not None and request.form.get('position') == 'tiled' and not stamp_text.strip():
+        return None
+    return {'spacing': spacing, 'rotation': rotation}
+
+def tile_options_error():
+    return jsonify({'error': 'Spacing must be an integer >= 0, rotation a number and tiled text non-empty'}), 400
+
+def get_batch_items():
+    # Images from the 'images' field and/or zip/tar files from 'archive'
+    return read_batch_inputs(request.files.getlist('images') + request.files.getlist('archive'),
+                             max_files=app.config['BATCH_MAX_FILES'], max_bytes=app.config['BATCH_MAX_BYTES'])
+
+def batch_response(items, process, download_name, shared_images=()):
+    results = process_batch(items, process, max_workers=app.config['BATCH_WORKERS'])
+
+    def generate():
+        try:
+            yield from stream_zip(results)
+        finally:
+            # Shared inputs (e.g. the logo) live until the whole batch is done
+            for shared in shared_images:
+                shared.unlink()
+
+    return Response(
+        generate(),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={download_name}'}
+    )
+
 # Routes
 @app.route("/")
 def home():
@@ -38,35 +281,156 @@ def watermarking_page():
 @app.route("/steganography/encode", methods=['POST'])
 def stego_encode():
     try:
-        if 'image' not in request.files or 'message' not in request.form:
-            return jsonify({'error': 'Image and message required'}), 400
+        message = get_stego_message()
+        if 'image' not in request.files or message is None:
+            return jsonify({'error': 'Image and message (or payload file) required'}), 400
 
         file = request.files['image']
-        message = request.form['message']
+        bits_per_channel = int(request.form.get('bits_per_channel', 1))
+        channels = request.form.get('channels', 'all')
+        key = request.form.get('key') or None  # scatters the payload over the image
+        trace_level = get_trace_level()
+        if trace_level is None:
+            return jsonify({'error': 'Trace level must be one of: off, summary, full'}), 400
+        response_mode = get_response_mode()
+        if response_mode is None:
+            return jsonify({'error': 'Response must be one of: json, binary'}), 400
+        profile = get_output_profile(lossless_only=True)
+        if profile is None:
+            return profile_error(lossless_only=True)
 
         # Open image
         image = Image.open(file.stream)
 
-        # Encode message with steps
-        stego_image, steps = encode_message_lsb(image, message, return_steps=True)
+        # Encode message with steps (the worker returns the encoded image)
+        output, steps = worker_pool.run('encode_message_lsb', image, message, return_steps=True, profile=profile,
+                                        bits_per_channel=bits_per_channel, channels=channels,
+                                        trace_level=trace_level, key=key, compress=get_compress())
 
-        # Save to bytes
-        img_io = io.BytesIO()
-        stego_image.save(img_io, 'PNG')
-        img_io.seek(0)
+        if response_mode == 'binary':
+            return image_response(output, steps, 'stego_image')
 
         # Convert to base64 for JSON response
         import base64
-        img_base64 = base64.b64encode(img_io.getvalue()).decode('utf-8')
+        img_base64 = base64.b64encode(output.data).decode('utf-8')
 
         return jsonify({
             'success': True,
             'image': img_base64,
+            'output': output.info(),
             'steps': steps
         })
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+@app.route("/steganography/capacity", methods=['POST'])
+def stego_capacity():
+    try:
+        # Optional message / payload file: reports whether it fits each mode
+        message = get_stego_message()
+        payload_length = None
+        if message is not None:
+            payload_length = len(prepare_payload(message, compress=get_compress()).data)
+
+        if 'image' in request.files:
+            # Image.open only parses the header (pixels are never decoded); where
+            # the header ends depends on the format (a TIFF directory may sit at
+            # the end of the file), so the whole upload is passed
+            image = Image.open(request.files['image'].stream)
+            capacity = get_max_message_size(image, payload_length)
+        elif 'width' in request.form or 'height' in request.form:
+            size = get_dimensions()
+            if size is None:
+                return jsonify({'error': 'Width and height must be positive integers'}), 400
+            mode = request.form.get('mode', 'RGB')
+            try:
+                ImageMode.getmode(mode)
+            except KeyError:
+                return jsonify({'error': f"Unknown image mode '{mode}'"}), 400
+            capacity = get_capacity(size, mode, payload_length)
+        else:
+            return jsonify({'error': 'Image (or width and height) required'}), 400
+
+        return jsonify({
+            'success': True,
+            'capacity': capacity,
+            'payload_length': payload_length
+        })
+
+    except Exception as e:
+        return error_response(e)
+
+@app.route("/stats")
+def stats():
+    # Admission counters and cache usage
+    return jsonify({
+        'admission': admission.stats(),
+        'logo_cache': worker_pool.logo_cache_stats(),
+        'jobs': job_store.stats(),
+        'result_cache': result_cache.stats() if result_cache is not None else None
+    })
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format: timing histograms plus admission and cache counters
+    stats = admission.stats()
+    cache = worker_pool.logo_cache_stats()
+    lines = []
+    lines += telemetry.metric_lines('citra_admission_admitted_total', 'Jobs admitted', 'counter',
+                                    [({}, stats['admitted'])])
+    lines += telemetry.metric_lines('citra_admission_queued_total', 'Jobs that waited for budget', 'counter',
+                                    [({}, stats['queued'])])
+    lines += telemetry.metric_lines('citra_admission_rejected_total', 'Jobs rejected by admission control',
+                                    'counter', [({'reason': reason}, count)
+                                                for reason, count in stats['rejected'].items()])
+    lines += telemetry.metric_lines('citra_admission_running', 'Admitted jobs in flight', 'gauge',
+                                    [({}, stats['running'])])
+    lines += telemetry.metric_lines('citra_admission_memory_bytes', 'Estimated memory of jobs in flight', 'gauge',
+                                    [({}, stats['memory_in_flight'])])
+    lines += telemetry.metric_lines('citra_admission_cpu_seconds', 'Estimated CPU time of jobs in flight', 'gauge',
+                                    [({}, stats['cpu_in_flight'])])
+    lines += telemetry.metric_lines('citra_logo_cache_hits_total', 'Prepared logo cache hits', 'counter',
+                                    [({}, cache['hits'])])
+    lines += telemetry.metric_lines('citra_logo_cache_misses_total', 'Prepared logo cache misses', 'counter',
+                                    [({}, cache['misses'])])
+    lines += telemetry.metric_lines('citra_logo_cache_bytes', 'Prepared logo cache size', 'gauge',
+                                    [({}, cache['bytes'])])
+    jobs = job_store.stats()
+    lines += telemetry.metric_lines('citra_jobs', 'Background jobs by status', 'gauge',
+                                    [({'status': status}, count) for status, count in jobs['jobs'].items()])
+    lines += telemetry.metric_lines('citra_job_result_bytes', 'Stored job results', 'gauge',
+                                    [({}, jobs['result_bytes'])])
+    lines += telemetry.metric_lines('citra_job_evicted_total', 'Job results evicted (TTL or size)', 'counter',
+                                    [({}, jobs['evicted'])])
+    if result_cache is not None:
+        cache = result_cache.stats()
+        lines += telemetry.metric_lines('citra_result_cache_hits_total', 'Result cache hits', 'counter',
+                                        [({'tier': 'memory'}, cache['memory_hits']),
+                                         ({'tier': 'disk'}, cache['disk_hits'])])
+        lines += telemetry.metric_lines('citra_result_cache_misses_total', 'Result cache misses', 'counter',
+                                        [({}, cache['misses'])])
+        lines += telemetry.metric_lines('citra_result_cache_hit_ratio', 'Result cache hits / lookups', 'gauge',
+                                        [({}, round(cache['hit_rate'], 4))])
+        lines += telemetry.metric_lines('citra_result_cache_saved_bytes_total', 'Result bytes served from cache',
+                                        'counter', [({}, cache['bytes_saved'])])
+        lines += telemetry.metric_lines('citra_result_cache_saved_seconds_total',
+                                        'Processing time saved by cache hits', 'counter',
+                                        [({}, cache['seconds_saved'])])
+        lines += telemetry.metric_lines('citra_result_cache_bytes', 'Result cache size', 'gauge',
+                                        [({'tier': 'memory'}, cache['memory_bytes']),
+                                         ({'tier': 'disk'}, cache['disk_bytes'])])
+        lines += telemetry.metric_lines('citra_result_cache_evictions_total', 'Result cache evictions', 'counter',
+                                        [({}, cache['evictions'])])
+    return Response(telemetry.render(lines), mimetype='text/plain; version=0.0.4')
+
+@app.route("/results/<result_id>/steps")
+def result_steps_get(result_id):
+    with result_steps_lock:
+        steps = result_steps.get(result_id)
+    if steps is None:
+        return jsonify({'error': 'Result not found'}), 404
+    return jsonify({'success': True, 'steps': steps})
 
 @app.route("/steganography/decode", methods=['POST'])
 def stego_decode():
@@ -75,19 +439,38 @@ def stego_decode():
             return jsonify({'error': 'Image required'}), 400
 
         file = request.files['image']
+        key = request.form.get('key') or None
+        trace_level = get_trace_level()
+        if trace_level is None:
+            return jsonify({'error': 'Trace level must be one of: off, summary, full'}), 400
+
         image = Image.open(file.stream)
 
         # Decode message with steps
-        message, steps = decode_message_lsb(image, return_steps=True)
+        message, steps = worker_pool.run('decode_message_lsb', image, return_steps=True, trace_level=trace_level,
+                                         key=key)
+
+        if isinstance(message, bytes):
+            # Binary payload: returned base64-encoded
+            import base64
+            return jsonify({
+                'success': True,
+                'message': None,
+                'payload': base64.b64encode(message).decode('utf-8'),
+                'payload_size': len(message),
+                'cached': worker_pool.cache_hit(),
+                'steps': steps
+            })
 
         return jsonify({
             'success': True,
             'message': message,
+            'cached': worker_pool.cache_hit(),
             'steps': steps
         })
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route("/watermark/visible", methods=['POST'])
 def watermark_visible():
@@ -99,30 +482,43 @@ def watermark_visible():
         watermark_text = request.form['text']
         position = request.form.get('position', 'bottom-right')
         opacity = int(request.form.get('opacity', 128))
+        trace_level = get_trace_level()
+        if trace_level is None:
+            return jsonify({'error': 'Trace level must be one of: off, summary, full'}), 400
+        response_mode = get_response_mode()
+        if response_mode is None:
+            return jsonify({'error': 'Response must be one of: json, binary'}), 400
+        profile = get_output_profile()
+        if profile is None:
+            return profile_error()
+        tile_options = get_tile_options(watermark_text)
+        if tile_options is None:
+            return tile_options_error()
 
         # Open image
         image = Image.open(file.stream)
 
         # Add watermark with steps
-        watermarked_image, steps = add_visible_watermark(image, watermark_text, position, opacity, return_steps=True)
+        output, steps = worker_pool.run('add_visible_watermark', image, watermark_text, position, opacity,
+                                        return_steps=True, trace_level=trace_level, profile=profile,
+                                        **tile_options)
 
-        # Save to bytes
-        img_io = io.BytesIO()
-        watermarked_image.save(img_io, 'PNG')
-        img_io.seek(0)
+        if response_mode == 'binary':
+            return image_response(output, steps, 'watermarked_text')
 
         # Convert to base64
         import base64
-        img_base64 = base64.b64encode(img_io.getvalue()).decode('utf-8')
+        img_base64 = base64.b64encode(output.data).decode('utf-8')
 
         return jsonify({
             'success': True,
             'image': img_base64,
+            'output': output.info(),
             'steps': steps
         })
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route("/watermark/image", methods=['POST'])
 def watermark_image():
@@ -135,31 +531,44 @@ def watermark_image():
         position = request.form.get('position', 'bottom-right')
         opacity = int(request.form.get('opacity', 128))
         scale = float(request.form.get('scale', 0.2))
+        trace_level = get_trace_level()
+        if trace_level is None:
+            return jsonify({'error': 'Trace level must be one of: off, summary, full'}), 400
+        response_mode = get_response_mode()
+        if response_mode is None:
+            return jsonify({'error': 'Response must be one of: json, binary'}), 400
+        profile = get_output_profile()
+        if profile is None:
+            return profile_error()
+        tile_options = get_tile_options()
+        if tile_options is None:
+            return tile_options_error()
 
         # Open images
         base_image = Image.open(base_file.stream)
         logo_image = Image.open(logo_file.stream)
 
         # Add watermark with steps
-        watermarked_image, steps = add_visible_watermark_image(base_image, logo_image, position, opacity, scale, return_steps=True)
+        output, steps = worker_pool.run('add_visible_watermark_image', base_image, logo_image, position, opacity,
+                                        scale, return_steps=True, trace_level=trace_level, profile=profile,
+                                        **tile_options)
 
-        # Save to bytes
-        img_io = io.BytesIO()
-        watermarked_image.save(img_io, 'PNG')
-        img_io.seek(0)
+        if response_mode == 'binary':
+            return image_response(output, steps, 'watermarked_logo')
 
         # Convert to base64
         import base64
-        img_base64 = base64.b64encode(img_io.getvalue()).decode('utf-8')
+        img_base64 = base64.b64encode(output.data).decode('utf-8')
 
         return jsonify({
             'success': True,
             'image': img_base64,
+            'output': output.info(),
             'steps': steps
         })
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route("/watermark/invisible/add", methods=['POST'])
 def watermark_invisible_add():
@@ -169,22 +578,28 @@ def watermark_invisible_add():
 
         file = request.files['image']
         watermark_text = request.form['text']
+        method = get_invisible_method()
+        if method is None:
+            return jsonify({'error': f"Method must be one of: {', '.join(INVISIBLE_METHODS)}"}), 400
+        # DCT watermarks survive lossy encoding, so any profile is allowed for them
+        lossless_only = method == 'lsb'
+        profile = get_output_profile(lossless_only=lossless_only)
+        if profile is None:
+            return profile_error(lossless_only=lossless_only)
 
         # Open image
         image = Image.open(file.stream)
 
-        # Add invisible watermark
-        watermarked_image = add_invisible_watermark(image, watermark_text)
+        # Add invisible watermark (file response, so no trace is built)
+        output = worker_pool.run('add_invisible_watermark', image, watermark_text, trace_level=TRACE_OFF,
+                                 profile=profile, method=method)
 
-        # Save to bytes
-        img_io = io.BytesIO()
-        watermarked_image.save(img_io, 'PNG')
-        img_io.seek(0)
-
-        return send_file(img_io, mimetype='image/png', as_attachment=True, download_name='watermarked_invisible.png')
+        response = send_file(io.BytesIO(output.data), mimetype=output.mimetype, as_attachment=True,
+                             download_name='watermarked_invisible' + output.extension)
+        return output_headers(response, output)
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route("/watermark/invisible/extract", methods=['POST'])
 def watermark_invisible_extract():
@@ -193,15 +608,315 @@ def watermark_invisible_extract():
             return jsonify({'error': 'Image required'}), 400
 
         file = request.files['image']
+        trace_level = get_trace_level(default=TRACE_OFF)
+        if trace_level is None:
+            return jsonify({'error': 'Trace level must be one of: off, summary, full'}), 400
+        methods = ('auto',) + INVISIBLE_METHODS
+        method = get_invisible_method(default='auto', allowed=methods)
+        if method is None:
+            return jsonify({'error': f"Method must be one of: {', '.join(methods)}"}), 400
+
         image = Image.open(file.stream)
 
         # Extract watermark
-        watermark = extract_invisible_watermark(image)
+        watermark, steps = worker_pool.run('extract_invisible_watermark', image, return_steps=True,
+                                           trace_level=trace_level, method=method)
+
+        if trace_level == TRACE_OFF:
+            return jsonify({'watermark': watermark, 'cached': worker_pool.cache_hit()})
+        return jsonify({'watermark': watermark, 'cached': worker_pool.cache_hit(), 'steps': steps})
+
+    except Exception as e:
+        return error_response(e)
+
+def json_metrics(result):
+    # PSNR is infinite for identical images; JSON has no Infinity, use null
+    def finite(value):
+        return None if isinstance(value, float) and value == float('inf') else value
+    result = {key: finite(value) for key, value in result.items()}
+    result['channels'] = [{key: finite(value) for key, value in channel.items()} for channel in result['channels']]
+    return result
+
+@app.route("/compare", methods=['POST'])
+def compare():
+    try:
+        if 'original' not in request.files or 'watermarked' not in request.files:
+            return jsonify({'error': 'Original and watermarked images required'}), 400
+
+        # Optional quality gate
+        min_psnr = request.form.get('min_psnr')
+        min_ssim = request.form.get('min_ssim')
+
+        original = Image.open(request.files['original'].stream)
+        watermarked = Image.open(request.files['watermarked'].stream)
+
+        # Strip-by-strip metrics (bounded memory), run on the worker pool
+        result = worker_pool.run('compare_images', original, watermarked)
 
-        return jsonify({'watermark': watermark})
+        passed = True
+        if min_psnr is not None:
+            passed = passed and result['psnr'] >= float(min_psnr)
+        if min_ssim is not None:
+            passed = passed and result['ssim'] >= float(min_ssim)
+
+        return jsonify({
+            'success': True,
+            'metrics': json_metrics(result),
+            'passed': passed,
+            'cached': worker_pool.cache_hit()
+        })
+
+    except Exception as e:
+        return error_response(e)
+
+# Batch routes: one set of parameters for many images, streamed zip response
+@app.route("/steganography/encode/batch", methods=['POST'])
+def stego_encode_batch():
+    try:
+        items = get_batch_items()
+        message = get_stego_message()
+        if not items or message is None:
+            return jsonify({'error': 'Images (or archive) and message (or payload file) required'}), 400
+
+        bits_per_channel = int(request.form.get('bits_per_channel', 1))
+        channels = request.form.get('channels', 'all')
+        key = request.form.get('key') or None
+        profile = get_output_profile(lossless_only=True)
+        if profile is None:
+            return profile_error(lossless_only=True)
+
+        # Payload (compressed once) is the same for every image
+        message_bits = prepare_message_bits(message, compress=get_compress())
+
+        def process(name, data):
+            output = worker_pool.run('encode_message_lsb', Image.open(io.BytesIO(data)), message, block=True,
+                                     profile=profile, bits_per_channel=bits_per_channel, channels=channels,
+                                     message_bits=message_bits, key=key)
+            return output_name(name, output.extension), output.data, output.info()
+
+        return batch_response(items, process, 'stego_images.zip')
+
+    except Exception as e:
+        return error_response(e)
+
+@app.route("/watermark/visible/batch", methods=['POST'])
+def watermark_visible_batch():
+    try:
+        items = get_batch_items()
+        if not items or 'text' not in request.form:
+            return jsonify({'error': 'Images (or archive) and text required'}), 400
+
+        watermark_text = request.form['text']
+        position = request.form.get('position', 'bottom-right')
+        opacity = int(request.form.get('opacity', 128))
+        tile_options = get_tile_options(watermark_text)
+        if tile_options is None:
+            return tile_options_error()
+        profile = get_output_profile()
+        if profile is None:
+            return profile_error()
+
+        # Font and text layout are cached per font size inside add_visible_watermark
+        def process(name, data):
+            output = worker_pool.run('add_visible_watermark', Image.open(io.BytesIO(data)), watermark_text,
+                                     position, opacity, block=True, profile=profile, **tile_options)
+            return output_name(name, output.extension), output.data, output.info()
+
+        return batch_response(items, process, 'watermarked_images.zip')
+
+    except Exception as e:
+        return error_response(e)
+
+@app.route("/watermark/image/batch", methods=['POST'])
+def watermark_image_batch():
+    try:
+        items = get_batch_items()
+        if not items or 'logo' not in request.files:
+            return jsonify({'error': 'Images (or archive) and logo required'}), 400
+
+        position = request.form.get('position', 'bottom-right')
+        opacity = int(request.form.get('opacity', 128))
+        scale = float(request.form.get('scale', 0.2))
+        tile_options = get_tile_options()
+        if tile_options is None:
+            return tile_options_error()
+        profile = get_output_profile()
+        if profile is None:
+            return profile_error()
+
+        # Decode the logo once (and share its pixels once with process workers);
+        # prepared (resized) logos are reused via each worker's logo cache
+        logo_image = Image.open(request.files['logo'].stream)
+        logo_image.load()
+        shared_images = []
+        if worker_pool.backend == 'process':
+            logo_image = SharedImage.from_image(logo_image)
+            shared_images.append(logo_image)
+
+        def process(name, data):
+            output = worker_pool.run('add_visible_watermark_image', Image.open(io.BytesIO(data)), logo_image,
+                                     position, opacity, scale, block=True, profile=profile, **tile_options)
+            return output_name(name, output.extension), output.data, output.info()
+
+        return batch_response(items, process, 'watermarked_logo_images.zip', shared_images)
+
+    except Exception as e:
+        return error_response(e)
+
+@app.route("/watermark/invisible/add/batch", methods=['POST'])
+def watermark_invisible_add_batch():
+    try:
+        items = get_batch_items()
+        if not items or 'text' not in request.form:
+            return jsonify({'error': 'Images (or archive) and text required'}), 400
+
+        watermark_text = request.form['text']
+        method = get_invisible_method()
+        if method is None:
+            return jsonify({'error': f"Method must be one of: {', '.join(INVISIBLE_METHODS)}"}), 400
+        lossless_only = method == 'lsb'
+        profile = get_output_profile(lossless_only=lossless_only)
+        if profile is None:
+            return profile_error(lossless_only=lossless_only)
+        message_bits = prepare_message_bits(watermark_text) if method == 'lsb' else None
+
+        def process(name, data):
+            output = worker_pool.run('add_invisible_watermark', Image.open(io.BytesIO(data)), watermark_text,
+                                     block=True, profile=profile, message_bits=message_bits, method=method)
+            return output_name(name, output.extension), output.data, output.info()
+
+        return batch_response(items, process, 'watermarked_invisible_images.zip')
+
+    except Exception as e:
+        return error_response(e)
+
+# Asynchronous jobs: the same operations and form fields as the routes above,
+# run later on the job executor by replaying the request against its route
+JOB_OPERATIONS = (
+    'steganography/encode',
+    'steganography/decode',
+    'watermark/visible',
+    'watermark/image',
+    'watermark/invisible/add',
+    'watermark/invisible/extract',
+    'compare',
+    'steganography/encode/batch',
+    'watermark/visible/batch',
+    'watermark/image/batch',
+    'watermark/invisible/add/batch'
+)
+
+def run_job(operation, form, uploads, output):
+    # Replays the request against the synchronous route and writes its response
+    # to output (image, JSON or zip, streamed in chunks)
+    files = [(field, FileStorage(open(path, 'rb'), filename=filename, content_type=content_type))
+             for field, path, filename, content_type in uploads]
+    data = MultiDict([(key, value) for key, values in form.items() for value in values] + files)
+    try:
+        with app.test_request_context('/' + operation, method='POST', data=data):
+            response = app.full_dispatch_request()
+            for chunk in response.iter_encoded():
+                output.write(chunk)
+            response.close()
+    finally:
+        for _field, storage in files:
+            storage.close()
+
+    _disposition, options = parse_options_header(response.headers.get('Content-Disposition', ''))
+    retry_after = response.headers.get('Retry-After')
+    return {
+        'status_code': response.status_code,
+        'mimetype': response.mimetype,
+        'download_name': options.get('filename'),
+        'headers': {key: value for key, value in response.headers.items()
+                    if key.startswith('X-') or key == 'Access-Control-Expose-Headers'},
+        'retry_after': int(retry_after) if retry_after else None
+    }
+
+def job_links(job):
+    return {
+        'status': f'/jobs/{job.id}',
+        'events': f'/jobs/{job.id}/events',
+        'result': f'/jobs/{job.id}/result'
+    }
+
+@app.route("/jobs/<path:operation>", methods=['POST'])
+def job_submit(operation):
+    try:
+        if operation not in JOB_OPERATIONS:
+            return jsonify({'error': f"Operation must be one of: {', '.join(JOB_OPERATIONS)}"}), 404
+
+        # Uploads are kept in UPLOAD_FOLDER (not memory) while the job waits
+        form = request.form.to_dict(flat=False)
+        upload_id = uuid.uuid4().hex
+        uploads = []
+        for index, (field, storage) in enumerate(request.files.items(multi=True)):
+            path = os.path.join(app.config['UPLOAD_FOLDER'], f'{upload_id}-{index}')
+            storage.save(path)
+            uploads.append((field, path, storage.filename, storage.content_type))
+
+        try:
+            job = job_store.submit(operation, lambda output: run_job(operation, form, uploads, output),
+                                   cleanup=[path for _field, path, _filename, _type in uploads])
+        except JobQueueFull:
+            for _field, path, _filename, _type in uploads:
+                os.remove(path)
+            raise
+
+        return jsonify({'success': True, 'job': job_store.info(job), 'links': job_links(job)}), 202
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found (or expired)'}), 404
+    return jsonify({'success': True, 'job': job_store.info(job), 'links': job_links(job)})
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    # Server-sent events: one event per status change, keep-alive comments
+    # while nothing changes; the stream ends when the job has finished
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found (or expired)'}), 404
+
+    def generate():
+        version = None
+        while True:
+            job = job_store.wait(job_id, version, timeout=15)
+            if job is None:
+                yield 'event: expired\ndata: {}\n\n'
+                return
+            if job.version == version:
+                yield ': keep-alive\n\n'
+                continue
+            version = job.version
+            yield f'event: {job.status}\ndata: {json.dumps(job_store.info(job))}\n\n'
+            if job.status in FINISHED_STATES:
+                return
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found (or expired)'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error, 'status_code': job.status_code}), job.status_code or 500
+    if job.status != 'done':
+        return jsonify({'error': f'Job is {job.status}', 'job': job_store.info(job)}), 409
+
+    response = send_file(job_store.result_path(job), mimetype=job.mimetype,
+                         as_attachment=job.download_name is not None,
+                         download_name=job.download_name or f'{job.id}.json')
+    for key, value in job.headers.items():
+        response.headers[key] = value
+    return response
 
 if __name__ == "__main__":
     app.run(debug=True)
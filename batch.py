@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp', '.ppm', '.pgm')
+
+
+class BatchTooLarge(Exception):
+    # Too many files or too many uncompressed bytes in one batch; the route answers 413
+    pass
+
+
+def _is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class _Limits:
+    # Running totals of one request, checked against the sizes declared in the
+    # archive headers *before* a member is decompressed (archive bombs)
+
+    def __init__(self, max_files, max_bytes):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, size):
+        self.files += 1
+        self.bytes += size
+        if self.max_files is not None and self.files > self.max_files:
+            raise BatchTooLarge(f'Batch has more than {self.max_files} files')
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            raise BatchTooLarge(f'Batch is larger than {self.max_bytes} bytes uncompressed')
+
+
+def read_batch_inputs(files, max_files=None, max_bytes=None):
+    # Collect (name, bytes) pairs from uploaded images and zip/tar archives.
+    # Every archive member (images or not) counts towards max_files and every
+    # image towards max_bytes; BatchTooLarge is raised before reading past them.
+    # A zip member never inflates beyond its declared size (zipfile stops there),
+    # and tar member sizes are the bytes actually stored in the stream.
+    limits = _Limits(max_files, max_bytes)
+    items = []
+    for upload in files:
+        data = upload.read()
+        buffer = io.BytesIO(data)
+
+        if zipfile.is_zipfile(buffer):
+            with zipfile.ZipFile(buffer) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and _is_image_name(info.filename):
+                        limits.add(info.file_size)
+                        items.append((info.filename, archive.read(info)))
+                    else:
+                        limits.add(0)
+            continue
+
+        buffer.seek(0)
+        try:
+            with tarfile.open(fileobj=buffer, mode='r:*') as archive:
+                # Iterated lazily, so a huge member list stops at the limit
+                for member in archive:
+                    if member.isfile() and _is_image_name(member.name):
+                        limits.add(member.size)
+                        items.append((member.name, archive.extractfile(member).read()))
+                    else:
+                        limits.add(0)
+            continue
+        except tarfile.TarError:
+            pass
+
+        limits.add(len(data))
+        items.append((upload.filename or f'image_{len(items)}', data))
+    return _unique_names(items)
+
+
+def _unique_names(items):
+    # Output names keep only the stem (a.png and a.jpg both give a.<ext>), so
+    # clashing stems get the original extension in the name (a_jpg.png), and
+    # remaining duplicates (same path in two archives) a counter (a_2.png)
+    extensions = {}
+    for name, _data in items:
+        stem, extension = os.path.splitext(name)
+        extensions.setdefault(stem, set()).add(extension.lower())
+
+    used = set()
+    unique = []
+    for name, data in items:
+        stem, extension = os.path.splitext(name)
+        if len(extensions[stem]) > 1 and extension:
+            stem = f'{stem}_{extension[1:].lower()}'
+        candidate, counter = stem, 1
+        while candidate in used:
+            counter += 1
+            candidate = f'{stem}_{counter}'
+        used.add(candidate)
+        unique.append((candidate + extension, data))
+    return unique
+
+
+def output_name(name, extension='.png'):
+    return os.path.splitext(name)[0] + extension
+
+
+class _StreamBuffer(io.RawIOBase):
+    # Unseekable sink: zipfile writes data descriptors, we hand out the bytes
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(results):
+    # results: iterable of (name, bytes or None, error or None, info dict).
+    # Yields the zip archive piece by piece, with a manifest.json at the end.
+    buffer = _StreamBuffer()
+    manifest = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data, error, info in results:
+            if error is None:
+                archive.writestr(name, data)
+                manifest.append({'name': name, 'status': 'ok', 'size': len(data), **info})
+            else:
+                manifest.append({'name': name, 'status': 'error', 'error': error})
+            yield buffer.drain()
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    yield buffer.drain()
+
+
+def process_batch(items, process, max_workers=4):
+    # Run process(name, data) -> (output_name, bytes[, info]) in parallel, keeping
+    # input order; failures are reported per item instead of aborting the batch
+    def run(item):
+        name, data = item
+        try:
+            out_name, out_data, *info = process(name, data)
+            return out_name, out_data, None, (info[0] if info else {})
+        except Exception as e:
+            return name, None, str(e), {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(run, items)
@@ -0,0 +1,378 @@
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import io
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from metrics import compare_images
+from steganography import encode_message_lsb, decode_message_lsb
+from tracing import TRACE_LEVELS, TRACE_OFF
+from watermarking import (
+    add_visible_watermark,
+    add_visible_watermark_image,
+    add_invisible_watermark,
+    extract_invisible_watermark
+)
+
+
+# Offline micro-benchmarks: every case runs in its own forked process, so peak RSS
+# and allocations of one case don't leak into the next.
+#   python benchmark.py --quick                      # small matrix, a few seconds
+#   python benchmark.py --save-baseline              # store results as the baseline
+#   python benchmark.py --baseline benchmark_baseline.json --threshold 0.2
+SIZES = (0.1, 1, 12, 50)  # megapixels
+MODES = ('L', 'RGB', 'RGBA', 'P')
+MESSAGE_LENGTHS = (16, 4096)  # bytes
+QUICK = {'sizes': (0.1, 1), 'modes': ('RGB', 'RGBA'), 'messages': (16,), 'traces': (TRACE_OFF,)}
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# Differences below these are noise, whatever the relative change
+TIME_FLOOR_MS = 2.0
+MEMORY_FLOOR_MB = 2.0
+
+
+def make_image(megapixels, mode, seed=0):
+    # Deterministic 4:3 photo-like frame: smooth gradients plus noise
+    width = max(8, int(round((megapixels * 1e6 * 4 / 3) ** 0.5)))
+    height = max(8, int(round(megapixels * 1e6 / width)))
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    for channel, (fx, fy) in enumerate(((0.7, 0.3), (0.2, 0.8), (0.5, 0.5))):
+        pixels[..., channel] = np.clip(fx * x + fy * y + rng.normal(0, 12, (height, width)), 0, 255)
+    image = Image.fromarray(pixels, 'RGB')
+
+    if mode == 'P':
+        return image.quantize(256, method=Image.Quantize.FASTOCTREE)
+    if mode == 'RGBA':
+        alpha = Image.fromarray(np.full((height, width), 255, dtype=np.uint8), 'L')
+        image.putalpha(alpha)
+        return image
+    return image.convert(mode)
+
+
+def make_message(length, seed=0):
+    # Metadata-like text: repeated keys with varying values (compresses like real JSON)
+    rng = np.random.default_rng(seed)
+    parts = []
+    while sum(len(part) for part in parts) < length:
+        parts.append(f'{{"id":{rng.integers(1e6)},"tag":"{rng.choice(["scan", "photo", "logo"])}"}}')
+    return ''.join(parts)[:length]
+
+
+def make_logo(size=(400, 160)):
+    logo = Image.new('RGBA', size, (0, 0, 0, 0))
+    logo.paste((200, 30, 30, 220), (10, 10, size[0] - 10, size[1] - 10))
+    return logo
+
+
+def _png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def _traced(function, *args, trace_level=TRACE_OFF, **kwargs):
+    # Run with steps and build them all, like a route returning the trace
+    result, steps = function(*args, return_steps=True, trace_level=trace_level, **kwargs)
+    steps.to_list()
+    return result
+
+
+# name -> (uses message, uses trace level, setup(image, message, trace_level) -> callable)
+def _setup_encode(image, message, trace_level):
+    return lambda: _traced(encode_message_lsb, image, message, trace_level=trace_level)
+
+
+def _setup_decode(image, message, trace_level):
+    data = _png_bytes(encode_message_lsb(image, message))
+    return lambda: _traced(decode_message_lsb, Image.open(io.BytesIO(data)), trace_level=trace_level)
+
+
+def _setup_visible(image, message, trace_level):
+    return lambda: _traced(add_visible_watermark, image, '© Benchmark Studio', trace_level=trace_level)
+
+
+def _setup_visible_tiled(image, message, trace_level):
+    return lambda: _traced(add_visible_watermark, image, '© Benchmark Studio', position='tiled',
+                           trace_level=trace_level)
+
+
+def _setup_visible_image(image, message, trace_level):
+    logo = make_logo()
+    return lambda: _traced(add_visible_watermark_image, image, logo, trace_level=trace_level)
+
+
+def _setup_invisible(image, message, trace_level):
+    return lambda: _traced(add_invisible_watermark, image, message, trace_level=trace_level)
+
+
+def _setup_invisible_dct(image, message, trace_level):
+    return lambda: _traced(add_invisible_watermark, image, message[:64], method='dct', trace_level=trace_level)
+
+
+def _setup_extract(image, message, trace_level):
+    data = _png_bytes(add_invisible_watermark(image, message))
+    return lambda: _traced(extract_invisible_watermark, Image.open(io.BytesIO(data)), trace_level=trace_level)
+
+
+def _setup_compare(image, message, trace_level):
+    watermarked = add_visible_watermark(image, '© Benchmark Studio', position='tiled')
+    return lambda: compare_images(image, watermarked)
+
+
+BENCHMARKS = {
+    'encode_message_lsb': (True, True, _setup_encode),
+    'decode_message_lsb': (True, True, _setup_decode),
+    'add_visible_watermark': (False, True, _setup_visible),
+    'add_visible_watermark[tiled]': (False, True, _setup_visible_tiled),
+    'add_visible_watermark_image': (False, True, _setup_visible_image),
+    'add_invisible_watermark': (True, True, _setup_invisible),
+    'add_invisible_watermark[dct]': (True, True, _setup_invisible_dct),
+    'extract_invisible_watermark': (True, True, _setup_extract),
+    'compare_images': (False, False, _setup_compare)
+}
+
+
+def build_cases(functions, sizes, modes, messages, traces):
+    cases = []
+    for name in functions:
+        uses_message, uses_trace, _setup = BENCHMARKS[name]
+        for size in sizes:
+            for mode in modes:
+                for length in (messages if uses_message else (None,)):
+                    for trace_level in (traces if uses_trace else (None,)):
+                        cases.append({'function': name, 'megapixels': size, 'mode': mode,
+                                      'message_length': length, 'trace_level': trace_level})
+    return cases
+
+
+def case_id(case):
+    parts = [f"{case['megapixels']:g}MP", case['mode']]
+    if case['message_length'] is not None:
+        parts.append(f"msg{case['message_length']}")
+    if case['trace_level'] is not None:
+        parts.append(case['trace_level'])
+    return f"{case['function']}|{'-'.join(parts)}"
+
+
+def _current_rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def _release_free_memory():
+    # Return freed heap pages to the OS (glibc only), so the RSS child starts clean
+    libc_name = ctypes.util.find_library('c')
+    if libc_name:
+        libc = ctypes.CDLL(libc_name)
+        if hasattr(libc, 'malloc_trim'):
+            libc.malloc_trim(0)
+
+
+def _peak_rss_child(run, connection):
+    # A forked process starts with its RSS high-water mark at the current RSS,
+    # so maxrss afterwards minus RSS now is the peak of this single run
+    start = _current_rss()
+    run()
+    connection.send(max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - start))
+    connection.close()
+
+
+def _run_case(case, repeat, connection):
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            image = make_image(case['megapixels'], case['mode'])
+            message = make_message(case['message_length'] or 16)
+            _uses_message, _uses_trace, setup = BENCHMARKS[case['function']]
+            run = setup(image, message, case['trace_level'] or TRACE_OFF)
+
+            # Peak RSS of one run, in a fresh child - first, before earlier runs leave
+            # freed (but still resident) heap behind for it to reuse
+            _release_free_memory()
+            context = multiprocessing.get_context('fork')
+            receiver, sender = context.Pipe(duplex=False)
+            child = context.Process(target=_peak_rss_child, args=(run, sender))
+            child.start()
+            sender.close()
+            peak_rss = receiver.recv()
+            child.join()
+
+            # Wall time (no tracing overhead): warm-up, then repeat
+            run()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - start) * 1000)
+
+            # Python/NumPy allocations of one run (tracemalloc slows it down, so separately)
+            tracemalloc.start()
+            run()
+            _current, alloc_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        connection.send({
+            'status': 'ok',
+            'image_size': image.size,
+            'time_ms': round(statistics.median(timings), 3),
+            'time_min_ms': round(min(timings), 3),
+            'peak_rss_mb': round(peak_rss / (1024 * 1024), 2),
+            'alloc_peak_mb': round(alloc_peak / (1024 * 1024), 2)
+        })
+    except Exception as e:
+        connection.send({'status': 'error', 'error': f'{type(e).__name__}: {e}'})
+    connection.close()
+
+
+def run_case(case, repeat=3):
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case, args=(case, repeat, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'status': 'error', 'error': f'benchmark process died (exit code {process.exitcode})'}
+    process.join()
+    return result
+
+
+def find_regressions(results, baseline, threshold):
+    # A metric regresses if it is worse than baseline * (1 + threshold) and the
+    # absolute difference is above the noise floor
+    regressions = []
+    for identifier, result in results.items():
+        reference = baseline.get(identifier)
+        if result.get('status') != 'ok' or not reference or reference.get('status') != 'ok':
+            continue
+        for metric, floor in (('time_ms', TIME_FLOOR_MS), ('peak_rss_mb', MEMORY_FLOOR_MB),
+                              ('alloc_peak_mb', MEMORY_FLOOR_MB)):
+            old, new = reference[metric], result[metric]
+            if new > old * (1 + threshold) and new - old > floor:
+                regressions.append((identifier, metric, old, new))
+    return regressions
+
+
+def _in_selection(case, functions, sizes, modes, messages, traces):
+    # Whether a baseline case belongs to the matrix of this run; cases of a
+    # function removed from BENCHMARKS belong to a run over all functions
+    known = case['function'] in BENCHMARKS
+    return ((case['function'] in functions or (not known and set(functions) == set(BENCHMARKS)))
+            and case['megapixels'] in sizes and case['mode'] in modes
+            and case['message_length'] in messages + (None,) and case['trace_level'] in traces + (None,))
+
+
+def find_failures(results, baseline, selection):
+    # Cases the gate can't compare count as failures, not as passes: a case that
+    # was ok and now errors, a case without a baseline entry, and a baseline case
+    # of the selected matrix that this run no longer produces
+    failures = []
+    for identifier, result in results.items():
+        reference = baseline.get(identifier)
+        if reference is None:
+            failures.append((identifier, 'baseline case missing (run with --save-baseline)'))
+        elif reference.get('status') == 'ok' and result.get('status') != 'ok':
+            failures.append((identifier, f"was ok, now error: {result.get('error')}"))
+    for identifier, reference in baseline.items():
+        if identifier not in results and _in_selection(reference, *selection):
+            failures.append((identifier, 'case missing from this run'))
+    return failures
+
+
+def _parse_list(value, cast=str):
+    return tuple(cast(item) for item in value.split(',') if item)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the steganography/watermarking functions')
+    parser.add_argument('--functions', type=_parse_list, default=tuple(BENCHMARKS),
+                        help=f"comma separated, from: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--sizes', type=lambda value: _parse_list(value, float), default=SIZES,
+                        help='image sizes in megapixels (default: 0.1,1,12,50)')
+    parser.add_argument('--modes', type=_parse_list, default=MODES, help='image modes (default: L,RGB,RGBA,P)')
+    parser.add_argument('--messages', type=lambda value: _parse_list(value, int), default=MESSAGE_LENGTHS,
+                        help='message lengths in bytes (default: 16,4096)')
+    parser.add_argument('--traces', type=_parse_list, default=TRACE_LEVELS, help='trace levels (default: all)')
+    parser.add_argument('--quick', action='store_true', help='small matrix for a fast check')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case (median is reported)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown (default 0.2)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.functions if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown functions: {', '.join(unknown)}")
+    if args.quick:
+        args.sizes, args.modes, args.messages, args.traces = (QUICK['sizes'], QUICK['modes'],
+                                                              QUICK['messages'], QUICK['traces'])
+
+    cases = build_cases(args.functions, args.sizes, args.modes, args.messages, args.traces)
+    results = {}
+    print(f"{'case':70s} {'time ms':>10s} {'min ms':>10s} {'rss MB':>8s} {'alloc MB':>9s}")
+    for case in cases:
+        identifier = case_id(case)
+        result = run_case(case, args.repeat)
+        results[identifier] = {**case, **result}
+        if result['status'] == 'ok':
+            print(f"{identifier:70s} {result['time_ms']:10.2f} {result['time_min_ms']:10.2f} "
+                  f"{result['peak_rss_mb']:8.1f} {result['alloc_peak_mb']:9.1f}")
+        else:
+            print(f"{identifier:70s} {result['error']}")
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline} ({len(results)} cases)')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --save-baseline to create one')
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    failures = find_failures(results, baseline, (args.functions, args.sizes, args.modes, args.messages, args.traces))
+    compared = sum(1 for identifier in results if identifier in baseline)
+    if failures:
+        print(f'\n{len(failures)} case(s) failing against the baseline:')
+        for identifier, reason in failures:
+            print(f'  {identifier}: {reason}')
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%} (of {compared} cases compared):')
+        for identifier, metric, old, new in regressions:
+            print(f'  {identifier} {metric}: {old} -> {new} ({(new / old - 1) if old else float("inf"):+.0%})')
+    if failures or regressions:
+        return 1
+    print(f'\nNo regressions beyond {args.threshold:.0%} ({compared} cases compared with {args.baseline})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,416 @@
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import hashlib
+import json
+import os
+import sys
+import time
+
+from PIL import Image
+
+from batch import IMAGE_EXTENSIONS
+from output import OUTPUT_PROFILES, LOSSLESS_PROFILES, DEFAULT_PROFILE, encode_image
+from steganography import (
+    encode_message_lsb,
+    encode_message_file,
+    decode_message_lsb,
+    prepare_message_bits,
+    supports_memmap,
+    WATERMARK_MAGIC
+)
+from watermarking import (
+    add_visible_watermark,
+    add_visible_watermark_image,
+    add_invisible_watermark,
+    extract_invisible_watermark,
+    INVISIBLE_METHODS
+)
+
+
+# Command-line batch processing of a directory tree, without the HTTP layer:
+#   python cli.py encode photos/ stego/ --message "secret"
+#   python cli.py watermark photos/ marked/ --text "© Studio" --position tiled --profile jpeg
+#   python cli.py decode stego/ messages/
+# Files are processed on a process pool (all cores by default) and written to the
+# same relative paths under the output directory; inputs sharing a stem (a.png and
+# a.jpg) keep their extension in the name (a_png.png, a_jpg.png). Every finished
+# file is appended to a manifest (output/manifest.jsonl), so an interrupted run
+# continues where it stopped: files already done (same size and mtime, output
+# present) are skipped.
+OPERATIONS = ('encode', 'decode', 'watermark', 'logo', 'invisible-add', 'invisible-extract')
+MANIFEST_NAME = 'manifest.jsonl'
+IN_FLIGHT_PER_WORKER = 4  # submitted files per worker, so huge trees aren't queued at once
+
+_worker = {}
+
+
+def find_images(root, exclude=None):
+    # Relative paths of all images under root (sorted, stable across runs)
+    found = []
+    for directory, subdirectories, files in os.walk(root):
+        if exclude is not None:
+            subdirectories[:] = [name for name in subdirectories
+                                 if os.path.abspath(os.path.join(directory, name)) != exclude]
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(directory, name), root))
+    return found
+
+
+def output_bases(files):
+    # Output path (without extension) of each input. The result extension is
+    # added later, so inputs sharing a stem (a.png, a.jpg) would write the same
+    # file: those keep their source extension in the name (a_png, a_jpg).
+    # Returns (bases, clashes); clashes lists inputs that still share a target.
+    extensions = {}
+    for relative in files:
+        stem, extension = os.path.splitext(relative)
+        extensions.setdefault(stem, set()).add(extension.lower())
+
+    bases, owners = {}, {}
+    for relative in files:
+        stem, extension = os.path.splitext(relative)
+        if len(extensions[stem]) > 1:
+            stem = f'{stem}_{extension[1:].lower()}'
+        bases[relative] = stem
+        owners.setdefault(stem, []).append(relative)
+    clashes = [names for names in owners.values() if len(names) > 1]
+    return bases, clashes
+
+
+def _write_atomic(path, data):
+    # Written next to the target and renamed, so an interruption never leaves a
+    # partial output that looks complete
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(data)
+    os.replace(temporary, path)
+
+
+def _init_worker(operation, options):
+    # Runs once per pool process: options (payload, logo) are sent once, not per file
+    _worker['operation'] = operation
+    _worker['options'] = options
+    if operation == 'logo':
+        logo = Image.open(options['logo'])
+        logo.load()
+        _worker['logo'] = logo
+
+
+def _encode_raw(source, target, options):
+    # Raw PPM/TIFF covers: embedded in a copy of the file (memmap), format kept
+    temporary = target + '.tmp'
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    magic = {'magic': WATERMARK_MAGIC} if _worker['operation'] == 'invisible-add' else {}
+    encode_message_file(source, options['message'], temporary, message_bits=options['message_bits'],
+                        key=options.get('key'), bits_per_channel=options.get('bits_per_channel', 1),
+                        channels=options.get('channels', 'all'), **magic)
+    os.replace(temporary, target)
+    return target
+
+
+def process_file(source, target_base):
+    # Runs in the pool: one input file -> one output file (target_base plus the
+    # extension of the result). Returns the output path, its size and the time taken.
+    operation = _worker['operation']
+    options = _worker['options']
+    start = time.perf_counter()
+
+    if operation in ('encode', 'invisible-add') and options.get('keep_raw') and \
+            options.get('method', 'lsb') == 'lsb' and supports_memmap(source):
+        target = target_base + os.path.splitext(source)[1]
+        _encode_raw(source, target, options)
+        return {'output': target, 'size': os.path.getsize(target),
+                'ms': round((time.perf_counter() - start) * 1000, 2)}
+
+    with Image.open(source) as image:
+        if operation == 'encode':
+            result = encode_message_lsb(image, options['message'], message_bits=options['message_bits'],
+                                        key=options.get('key'), bits_per_channel=options['bits_per_channel'],
+                                        channels=options['channels'])
+        elif operation == 'watermark':
+            result = add_visible_watermark(image, options['text'], options['position'], options['opacity'],
+                                           spacing=options['spacing'], rotation=options['rotation'])
+        elif operation == 'logo':
+            result = add_visible_watermark_image(image, _worker['logo'], options['position'], options['opacity'],
+                                                 options['scale'], spacing=options['spacing'],
+                                                 rotation=options['rotation'])
+        elif operation == 'invisible-add':
+            result = add_invisible_watermark(image, options['text'], message_bits=options['message_bits'],
+                                             method=options['method'])
+        elif operation == 'decode':
+            result = decode_message_lsb(image, key=options.get('key'))
+        else:
+            result = extract_invisible_watermark(image, method=options['method'])
+
+    if isinstance(result, Image.Image):
+        encoded = encode_image(result, options['profile'])
+        target = target_base + encoded.extension
+        data = encoded.data
+    elif isinstance(result, bytes):
+        target, data = target_base + '.bin', result
+    else:
+        target, data = target_base + '.txt', result.encode('utf-8')
+    _write_atomic(target, data)
+    return {'output': target, 'size': len(data), 'ms': round((time.perf_counter() - start) * 1000, 2)}
+
+
+class Manifest:
+    # Append-only JSON lines: a header with the operation and a fingerprint of the
+    # options, then one line per processed file. A torn last line (killed while
+    # writing) is ignored; the latest line for a file wins.
+
+    def __init__(self, path, header, restart=False):
+        self.path = path
+        self.entries = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+
+        if os.path.exists(path):
+            with open(path) as manifest:
+                lines = manifest.read().splitlines()
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+            if records and records[0].get('type') == 'run':
+                stored = {key: records[0].get(key) for key in ('operation', 'options')}
+                if stored != {key: header[key] for key in ('operation', 'options')}:
+                    raise ValueError(f'{path} was written by a run with other options; '
+                                     f'use --restart to discard it (or another output directory)')
+            for record in records:
+                if record.get('type') == 'file':
+                    self.entries[record['input']] = record
+            self._file = open(path, 'a')
+            if lines and not self._ends_with_newline(path):
+                self._file.write('\n')  # start after a torn line, don't extend it
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._file = open(path, 'a')
+            self._append(header)
+
+    @staticmethod
+    def _ends_with_newline(path):
+        with open(path, 'rb') as manifest:
+            manifest.seek(-1, os.SEEK_END)
+            return manifest.read(1) == b'\n'
+
+    def _append(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def is_done(self, relative, stat, output_root, base):
+        # base: the output path this run would write; an entry pointing at another
+        # output (e.g. one shared with a clashing input) is redone
+        entry = self.entries.get(relative)
+        return (entry is not None and entry['status'] == 'done' and entry['input_size'] == stat.st_size and
+                entry['input_mtime'] == stat.st_mtime_ns and os.path.splitext(entry['output'])[0] == base and
+                os.path.exists(os.path.join(output_root, entry['output'])))
+
+    def record(self, relative, stat, status, output=None, size=None, ms=None, error=None):
+        record = {'type': 'file', 'input': relative, 'status': status, 'input_size': stat.st_size,
+                  'input_mtime': stat.st_mtime_ns, 'output': output, 'size': size, 'ms': ms, 'error': error}
+        self.entries[relative] = record
+        self._append(record)
+
+    def close(self):
+        self._file.close()
+
+
+def _fingerprint(options):
+    # Options as stored in the manifest: secrets and payloads only as hashes
+    stored = {}
+    for key, value in sorted(options.items()):
+        if key == 'message_bits':
+            continue
+        if key in ('message', 'key') and value is not None:
+            data = value if isinstance(value, bytes) else str(value).encode('utf-8')
+            value = 'blake2b:' + hashlib.blake2b(data, digest_size=16).hexdigest()
+        stored[key] = value
+    return stored
+
+
+def build_options(args):
+    options = {'profile': args.profile}
+    if args.operation in ('encode', 'decode'):
+        options['key'] = args.key
+    if args.operation == 'encode':
+        if args.message_file:
+            with open(args.message_file, 'rb') as payload:
+                options['message'] = payload.read()
+        else:
+            options['message'] = args.message
+        options['bits_per_channel'] = args.bits_per_channel
+        options['channels'] = args.channels
+        options['keep_raw'] = args.keep_raw
+        # Payload (compressed once) is the same for every image
+        options['message_bits'] = prepare_message_bits(options['message'], compress=not args.no_compress)
+    if args.operation in ('watermark', 'invisible-add'):
+        options['text'] = args.text
+    if args.operation in ('watermark', 'logo'):
+        options.update(position=args.position, opacity=args.opacity, spacing=args.spacing, rotation=args.rotation)
+    if args.operation == 'logo':
+        options['logo'] = os.path.abspath(args.logo)
+        options['scale'] = args.scale
+    if args.operation in ('invisible-add', 'invisible-extract'):
+        options['method'] = args.method
+    if args.operation == 'invisible-add':
+        options['keep_raw'] = args.keep_raw
+        options['message'] = args.text
+        options['message_bits'] = prepare_message_bits(args.text) if args.method == 'lsb' else None
+    return options
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Batch steganography / watermarking over a directory tree')
+    parser.add_argument('operation', choices=OPERATIONS)
+    parser.add_argument('input', help='input directory (walked recursively)')
+    parser.add_argument('output', help='output directory (same relative paths)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes (default: all cores)')
+    parser.add_argument('--manifest', help=f'progress manifest (default: <output>/{MANIFEST_NAME})')
+    parser.add_argument('--restart', action='store_true', help='discard the manifest and process everything')
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, choices=tuple(OUTPUT_PROFILES),
+                        help='output encoding (LSB operations: lossless profiles only)')
+    parser.add_argument('--quiet', action='store_true', help='no progress lines')
+
+    parser.add_argument('--message', help='encode: text to hide')
+    parser.add_argument('--message-file', help='encode: file whose bytes are hidden (binary payload)')
+    parser.add_argument('--key', help='encode/decode: key that scatters the payload')
+    parser.add_argument('--bits-per-channel', type=int, default=1)
+    parser.add_argument('--channels', default='all')
+    parser.add_argument('--no-compress', action='store_true', help='encode: never deflate the payload')
+    parser.add_argument('--keep-raw', action='store_true',
+                        help='encode/invisible-add: embed raw PPM/TIFF inputs in place, keeping their format')
+
+    parser.add_argument('--text', help='watermark / invisible-add: watermark text')
+    parser.add_argument('--logo', help='logo: logo image')
+    parser.add_argument('--position', default='bottom-right')
+    parser.add_argument('--opacity', type=int, default=128)
+    parser.add_argument('--scale', type=float, default=0.2)
+    parser.add_argument('--spacing', type=int)
+    parser.add_argument('--rotation', type=float, default=30)
+    parser.add_argument('--method', help=f"invisible-add: {'/'.join(INVISIBLE_METHODS)} (default lsb); "
+                                         f"invisible-extract: auto/{'/'.join(INVISIBLE_METHODS)} (default auto)")
+    args = parser.parse_args(argv)
+
+    if args.operation == 'encode' and (args.message is None) == (args.message_file is None):
+        parser.error('encode needs --message or --message-file')
+    if args.operation in ('watermark', 'invisible-add') and args.text is None:
+        parser.error(f'{args.operation} needs --text')
+    if args.operation == 'logo' and args.logo is None:
+        parser.error('logo needs --logo')
+    if args.operation == 'invisible-add':
+        args.method = args.method or 'lsb'
+        if args.method not in INVISIBLE_METHODS:
+            parser.error(f"--method must be one of: {', '.join(INVISIBLE_METHODS)}")
+    if args.operation == 'invisible-extract':
+        args.method = args.method or 'auto'
+        if args.method not in ('auto',) + INVISIBLE_METHODS:
+            parser.error(f"--method must be one of: auto, {', '.join(INVISIBLE_METHODS)}")
+    # Results carrying LSB data must not go through a lossy encoder
+    lossless_only = args.operation == 'encode' or (args.operation == 'invisible-add' and args.method == 'lsb')
+    if lossless_only and args.profile not in LOSSLESS_PROFILES:
+        parser.error(f"{args.operation} needs a lossless profile: {', '.join(LOSSLESS_PROFILES)}")
+    return args
+
+
+def run(args):
+    input_root = os.path.abspath(args.input)
+    output_root = os.path.abspath(args.output)
+    options = build_options(args)
+    manifest_path = args.manifest or os.path.join(output_root, MANIFEST_NAME)
+    header = {'type': 'run', 'operation': args.operation, 'options': _fingerprint(options),
+              'started': time.time()}
+    # Output inside the input tree (e.g. in-place backfills) is not walked again
+    files = find_images(input_root, exclude=output_root)
+    # All targets are fixed before anything is submitted: two inputs writing the
+    # same output would race, and both would be marked done in the manifest
+    bases, clashes = output_bases(files)
+    if clashes:
+        for names in clashes:
+            print(f"error: {', '.join(names)} would write the same output", file=sys.stderr)
+        return 2
+
+    try:
+        manifest = Manifest(manifest_path, header, restart=args.restart)
+    except ValueError as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 2
+
+    pending, skipped = [], 0
+    for relative in files:
+        stat = os.stat(os.path.join(input_root, relative))
+        if manifest.is_done(relative, stat, output_root, bases[relative]):
+            skipped += 1
+        else:
+            pending.append((relative, stat))
+
+    counts = {'done': 0, 'failed': 0}
+    started = last_report = time.monotonic()
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.monotonic()
+        if args.quiet or (not force and now - last_report < 2):
+            return
+        last_report = now
+        processed = counts['done'] + counts['failed']
+        rate = processed / (now - started) if now > started else 0.0
+        print(f"{processed}/{len(pending)} processed ({counts['failed']} failed, {skipped} already done), "
+              f"{rate:.1f} files/s", file=sys.stderr)
+
+    def finished(future, relative, stat):
+        try:
+            result = future.result()
+        except Exception as e:
+            counts['failed'] += 1
+            manifest.record(relative, stat, 'failed', error=f'{type(e).__name__}: {e}')
+            print(f'failed: {relative}: {e}', file=sys.stderr)
+        else:
+            counts['done'] += 1
+            manifest.record(relative, stat, 'done', os.path.relpath(result['output'], output_root),
+                            result['size'], result['ms'])
+        report()
+
+    executor = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                   initargs=(args.operation, options))
+    in_flight = {}
+    try:
+        for relative, stat in pending:
+            if len(in_flight) >= args.workers * IN_FLIGHT_PER_WORKER:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(future, *in_flight.pop(future))
+            target_base = os.path.join(output_root, bases[relative])
+            future = executor.submit(process_file, os.path.join(input_root, relative), target_base)
+            in_flight[future] = (relative, stat)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished(future, *in_flight.pop(future))
+    except KeyboardInterrupt:
+        # Finished files are already in the manifest; the next run resumes from there
+        executor.shutdown(wait=False, cancel_futures=True)
+        manifest.close()
+        print(f"\ninterrupted: {counts['done']} done this run, rerun to resume", file=sys.stderr)
+        return 130
+    executor.shutdown()
+    manifest.close()
+
+    report(force=True)
+    elapsed = time.monotonic() - started
+    print(f"{counts['done']} done, {counts['failed']} failed, {skipped} skipped (already done) "
+          f"in {elapsed:.1f}s; manifest: {manifest_path}")
+    return 1 if counts['failed'] else 0
+
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+
+# Background jobs whose results are stored as files: <id>.result plus an <id>.json
+# sidecar with the metadata, so finished jobs survive a restart until evicted
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+FINISHED_STATES = ('done', 'failed')
+_JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class JobQueueFull(Exception):
+    # Too many jobs waiting; the route answers 503 + Retry-After
+    def __init__(self, retry_after):
+        super().__init__('Too many jobs queued, please retry later')
+        self.retry_after = retry_after
+
+
+class Job:
+
+    def __init__(self, job_id, operation, status='queued', created=None, started=None, finished=None,
+                 attempts=0, error=None, status_code=None, mimetype=None, download_name=None, size=0,
+                 headers=None):
+        self.id = job_id
+        self.operation = operation
+        self.status = status
+        self.created = created if created is not None else time.time()
+        self.started = started
+        self.finished = finished
+        self.attempts = attempts
+        self.error = error
+        self.status_code = status_code
+        self.mimetype = mimetype
+        self.download_name = download_name
+        self.size = size
+        self.headers = headers or {}
+        self.version = 0  # bumped on every change, for event streams
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'operation': self.operation,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'attempts': self.attempts,
+            'error': self.error,
+            'status_code': self.status_code,
+            'mimetype': self.mimetype,
+            'download_name': self.download_name,
+            'size': self.size,
+            'headers': self.headers
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['id'], data['operation'], data['status'], data['created'], data['started'],
+                   data['finished'], data['attempts'], data['error'], data['status_code'], data['mimetype'],
+                   data['download_name'], data['size'], data['headers'])
+
+
+class JobStore:
+    # run(output) executes a job and writes its result to the open file `output`,
+    # returning {'status_code', 'mimetype', 'download_name', 'headers', 'retry_after'}.
+    # Responses with a retry status (queue/budget full) are retried until retry_timeout.
+
+    def __init__(self, folder, ttl=3600, max_bytes=1024 * 1024 * 1024, workers=4, max_pending=256,
+                 retry_timeout=600, retry_after=2, retry_statuses=(503,), evict_interval=10, grace=60):
+        self.folder = os.path.abspath(folder)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_timeout = retry_timeout
+        self.retry_after = retry_after
+        self.retry_statuses = retry_statuses
+        self.evict_interval = evict_interval
+        self.grace = grace
+        self._jobs = {}
+        self._condition = threading.Condition()
+        self._executor = None
+        self._last_evict = 0.0
+        self._evicted = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self._load()
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.folder, job_id + suffix)
+
+    def result_path(self, job):
+        return self._path(job.id, '.result')
+
+    def _load(self):
+        # Finished jobs of a previous run; unfinished ones can't be resumed
+        for name in os.listdir(self.folder):
+            job_id, suffix = os.path.splitext(name)
+            if not _JOB_ID.fullmatch(job_id):
+                continue
+            if suffix == '.json':
+                try:
+                    with open(self._path(job_id, '.json')) as sidecar:
+                        job = Job.from_dict(json.load(sidecar))
+                except (OSError, ValueError, KeyError):
+                    self._remove_files(job_id)
+                    continue
+                self._jobs[job.id] = job
+            elif suffix == '.tmp':
+                os.remove(os.path.join(self.folder, name))
+        for name in os.listdir(self.folder):
+            job_id, suffix = os.path.splitext(name)
+            if suffix == '.result' and job_id not in self._jobs:
+                os.remove(os.path.join(self.folder, name))
+        self.evict(force=True)
+
+    def _get_executor(self):
+        # Created lazily, like the worker pool
+        with self._condition:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+            return self._executor
+
+    def _changed(self, job):
+        # Caller holds the condition
+        job.version += 1
+        self._condition.notify_all()
+
+    def submit(self, operation, run, cleanup=()):
+        # cleanup: input files removed once the job has finished
+        self.evict()
+        with self._condition:
+            pending = sum(1 for job in self._jobs.values() if job.status not in FINISHED_STATES)
+            if pending >= self.max_pending:
+                raise JobQueueFull(self.retry_after)
+            job = Job(uuid.uuid4().hex, operation)
+            self._jobs[job.id] = job
+        self._get_executor().submit(self._run, job, run, cleanup)
+        return job
+
+    def _run(self, job, run, cleanup):
+        temporary = self._path(job.id, '.tmp')
+        try:
+            outcome = self._attempt(job, run, temporary)
+        except Exception as e:
+            outcome, error = None, str(e)
+        finally:
+            for path in cleanup:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        if outcome is None:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            self._finish(job, 'failed', {}, error=error)
+        elif outcome['status_code'] >= 400:
+            error = self._error_message(temporary, outcome)
+            os.remove(temporary)
+            self._finish(job, 'failed', outcome, error=error)
+        else:
+            os.replace(temporary, self.result_path(job))
+            self._finish(job, 'done', outcome, size=os.path.getsize(self.result_path(job)))
+        self.evict(force=True)
+
+    def _attempt(self, job, run, temporary):
+        deadline = time.monotonic() + self.retry_timeout
+        while True:
+            with self._condition:
+                job.status = 'running'
+                job.started = job.started or time.time()
+                job.attempts += 1
+                self._changed(job)
+            with open(temporary, 'wb') as output:
+                outcome = run(output)
+            retry_after = outcome.get('retry_after') or self.retry_after
+            if outcome['status_code'] not in self.retry_statuses or time.monotonic() + retry_after > deadline:
+                return outcome
+            # Pool or budget full: back in the queue, try again later
+            with self._condition:
+                job.status = 'queued'
+                self._changed(job)
+            time.sleep(retry_after)
+
+    def _error_message(self, path, outcome):
+        # The error of a failed operation is its JSON {'error': ...} body
+        try:
+            with open(path) as body:
+                return json.load(body).get('error')
+        except (OSError, ValueError, AttributeError):
+            return f"Operation failed with status {outcome['status_code']}"
+
+    def _finish(self, job, status, outcome, error=None, size=0):
+        with self._condition:
+            job.status = status
+            job.finished = time.time()
+            job.error = error
+            job.size = size
+            job.status_code = outcome.get('status_code')
+            job.mimetype = outcome.get('mimetype')
+            job.download_name = outcome.get('download_name')
+            job.headers = outcome.get('headers') or {}
+            data = job.to_dict()
+        with open(self._path(job.id, '.json'), 'w') as sidecar:
+            json.dump(data, sidecar)
+        with self._condition:
+            self._changed(job)
+
+    def get(self, job_id):
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        self.evict()
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, version, timeout):
+        # Block until the job changes past `version` (or timeout); None if it is gone
+        with self._condition:
+            self._condition.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id].version != version, timeout)
+            return self._jobs.get(job_id)
+
+    def info(self, job):
+        with self._condition:
+            data = job.to_dict()
+            data.pop('headers')
+            if job.status == 'queued':
+                data['position'] = sum(1 for other in self._jobs.values()
+                                       if other.status == 'queued' and other.created < job.created)
+            return data
+
+    def _remove_files(self, job_id):
+        for suffix in ('.result', '.json', '.tmp'):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, force=False):
+        # Finished jobs past the TTL go first, then the oldest results until
+        # the folder fits max_bytes; results younger than `grace` are kept so
+        # they can still be downloaded. Runs at most every evict_interval
+        # seconds unless forced (after a job finishes).
+        now = time.time()
+        with self._condition:
+            if not force and now - self._last_evict < self.evict_interval:
+                return
+            self._last_evict = now
+            finished = sorted((job for job in self._jobs.values() if job.status in FINISHED_STATES),
+                              key=lambda job: job.finished)
+            total = sum(job.size for job in finished)
+            evicted = []
+            for job in finished:
+                if job.finished + self.ttl <= now or (total > self.max_bytes and job.finished + self.grace <= now):
+                    total -= job.size
+                    evicted.append(job)
+                    del self._jobs[job.id]
+                    self._changed(job)
+            self._evicted += len(evicted)
+        for job in evicted:
+            self._remove_files(job.id)
+
+    def stats(self):
+        with self._condition:
+            counts = dict.fromkeys(JOB_STATES, 0)
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {
+                'jobs': counts,
+                'result_bytes': sum(job.size for job in self._jobs.values() if job.status == 'done'),
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'evicted': self._evicted
+            }
+
+    def shutdown(self):
+        with self._condition:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
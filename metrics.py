@@ -0,0 +1,140 @@
+from PIL import ImageMode
+import numpy as np
+
+from telemetry import timed
+
+
+# Metrik kualitas dihitung per strip baris dengan akumulator integer, jadi
+# memori tambahan hanya sebesar satu strip (bukan salinan float64 seluruh gambar).
+STRIP_VALUES = 1024 * 1024       # target jumlah nilai pixel per strip
+SSIM_BLOCK = 8                   # ukuran blok SSIM (non-overlapping)
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+
+def _common_mode(original, watermarked):
+    # Mode yang sama untuk kedua gambar; jika berbeda (mis. L vs RGB) atau bukan
+    # mode 8-bit biasa (P, 1, CMYK, ...) dibandingkan dalam RGB/RGBA
+    if original.mode == watermarked.mode and original.mode in ('L', 'LA', 'RGB', 'RGBA'):
+        return original.mode
+    has_alpha = 'A' in original.getbands() or 'A' in watermarked.getbands()
+    return 'RGBA' if has_alpha else 'RGB'
+
+
+def _strip(image, mode, box):
+    strip = image.crop(box)
+    if strip.mode != mode:
+        strip = strip.convert(mode)
+    array = np.asarray(strip)
+    return array.reshape(array.shape[0], array.shape[1], -1)
+
+
+def _psnr(squared_sum, count):
+    if squared_sum == 0:
+        return float('inf')
+    mse = squared_sum / count
+    return float(20 * np.log10(255.0 / np.sqrt(mse)))
+
+
+def _block_sums(values, block):
+    # Jumlah per blok block x block per channel: jumlahkan baris dalam blok dulu
+    # (penjumlahan baris utuh, cepat), baru kolom dalam blok pada array yang 8x lebih kecil
+    rows, cols, channels = values.shape
+    sums = values.reshape(rows // block, block, cols * channels).sum(axis=1, dtype=np.int32)
+    return sums.reshape(rows // block, cols // block, block, channels).sum(axis=2, dtype=np.int32)
+
+
+def _block_ssim(a, b, block):
+    # SSIM per blok block x block per channel dari jumlah integer (x, y, x², y², xy)
+    rows = a.shape[0] // block * block
+    cols = a.shape[1] // block * block
+    if rows == 0 or cols == 0:
+        return np.zeros(a.shape[2]), 0
+    x = a[:rows, :cols].astype(np.int32)
+    y = b[:rows, :cols].astype(np.int32)
+
+    n = block * block
+    mean_x = _block_sums(x, block) / n
+    mean_y = _block_sums(y, block) / n
+    var_x = _block_sums(x * x, block) / n - mean_x ** 2
+    var_y = _block_sums(y * y, block) / n - mean_y ** 2
+    cov_xy = _block_sums(x * y, block) / n - mean_x * mean_y
+
+    ssim = ((2 * mean_x * mean_y + _SSIM_C1) * (2 * cov_xy + _SSIM_C2)) / \
+           ((mean_x ** 2 + mean_y ** 2 + _SSIM_C1) * (var_x + var_y + _SSIM_C2))
+    ssim = ssim.reshape(-1, a.shape[2])
+    return ssim.sum(axis=0), len(ssim)
+
+
+@timed
+def compare_images(original, watermarked, strip_values=STRIP_VALUES):
+    if original.size != watermarked.size:
+        raise ValueError(
+            f"Ukuran gambar berbeda! Original: {original.size}, watermarked: {watermarked.size}"
+        )
+
+    width, height = original.size
+    mode = _common_mode(original, watermarked)
+    bands = ImageMode.getmode(mode).bands
+    channel_count = len(bands)
+
+    # Tinggi strip: kelipatan blok SSIM, sekitar strip_values nilai per strip
+    block = max(1, min(SSIM_BLOCK, width, height))
+    strip_rows = max(block, strip_values // max(width * channel_count, 1) // block * block)
+
+    squared = np.zeros(channel_count, dtype=np.int64)
+    diff_values = np.zeros(channel_count, dtype=np.int64)
+    ssim_sum = np.zeros(channel_count)
+    ssim_blocks = 0
+    changed_pixels = 0
+    max_abs_diff = 0
+
+    for top in range(0, height, strip_rows):
+        box = (0, top, width, min(top + strip_rows, height))
+        a = _strip(original, mode, box)
+        b = _strip(watermarked, mode, box)
+
+        # Reduksi baris dulu (axis 0) lalu kolom, supaya penjumlahan tetap berurutan di memori
+        diff = a.astype(np.int32) - b
+        squared += (diff * diff).sum(axis=0, dtype=np.int64).sum(axis=0)
+        nonzero = diff != 0
+        diff_values += nonzero.sum(axis=0, dtype=np.int64).sum(axis=0)
+        changed_pixels += int(np.count_nonzero(nonzero.any(axis=2)))
+        if diff.size:
+            max_abs_diff = max(max_abs_diff, int(np.abs(diff).max()))
+
+        block_sum, block_count = _block_ssim(a, b, block)
+        if block_count:
+            ssim_sum += block_sum
+            ssim_blocks += block_count
+
+    pixel_count = width * height
+    total_values = pixel_count * channel_count
+    squared_total = int(squared.sum())
+    mse = squared_total / total_values if total_values else 0.0
+    diff_pixels = int(diff_values.sum())
+    ssim_channels = ssim_sum / ssim_blocks if ssim_blocks else np.ones(channel_count)
+
+    return {
+        'mse': mse,
+        'psnr': _psnr(squared_total, total_values),
+        'diff_pixels': diff_pixels,
+        'total_pixels': total_values,
+        'diff_percentage': (diff_pixels / total_values) * 100 if total_values else 0.0,
+        'changed_pixels': changed_pixels,
+        'changed_percentage': (changed_pixels / pixel_count) * 100 if pixel_count else 0.0,
+        'max_abs_diff': max_abs_diff,
+        'ssim': float(ssim_channels.mean()),
+        'channels': [
+            {
+                'channel': band,
+                'mse': int(squared[i]) / pixel_count if pixel_count else 0.0,
+                'psnr': _psnr(int(squared[i]), pixel_count),
+                'diff_values': int(diff_values[i]),
+                'ssim': float(ssim_channels[i])
+            }
+            for i, band in enumerate(bands)
+        ],
+        'mode': mode,
+        'strip_rows': strip_rows
+    }
@@ -0,0 +1,75 @@
+import io
+import time
+
+
+# Output encoding profiles: Pillow save format + options.
+# Lossy profiles are only allowed where the pixels don't carry data (visible watermarks).
+OUTPUT_PROFILES = {
+    'png': {'format': 'PNG', 'mimetype': 'image/png', 'extension': '.png', 'lossless': True,
+            'options': {}},
+    'png-fast': {'format': 'PNG', 'mimetype': 'image/png', 'extension': '.png', 'lossless': True,
+                 'options': {'compress_level': 1}},
+    'png-max': {'format': 'PNG', 'mimetype': 'image/png', 'extension': '.png', 'lossless': True,
+                'options': {'compress_level': 9}},
+    'webp-lossless': {'format': 'WEBP', 'mimetype': 'image/webp', 'extension': '.webp', 'lossless': True,
+                      'options': {'lossless': True, 'exact': True}},
+    'jpeg': {'format': 'JPEG', 'mimetype': 'image/jpeg', 'extension': '.jpg', 'lossless': False,
+             'options': {'quality': 90}},
+    'webp': {'format': 'WEBP', 'mimetype': 'image/webp', 'extension': '.webp', 'lossless': False,
+             'options': {'quality': 90}},
+}
+DEFAULT_PROFILE = 'png'
+LOSSLESS_PROFILES = tuple(name for name, profile in OUTPUT_PROFILES.items() if profile['lossless'])
+
+
+class EncodedImage:
+    # Encoded result plus what it cost, so routes can report time and size
+
+    def __init__(self, data, profile, encode_ms):
+        self.data = data
+        self.profile = profile
+        self.encode_ms = encode_ms
+        self.cached = False  # served from the result cache: nothing was encoded
+
+    @property
+    def format(self):
+        return OUTPUT_PROFILES[self.profile]['format']
+
+    @property
+    def mimetype(self):
+        return OUTPUT_PROFILES[self.profile]['mimetype']
+
+    @property
+    def extension(self):
+        return OUTPUT_PROFILES[self.profile]['extension']
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def info(self):
+        return {
+            'profile': self.profile,
+            'format': self.format,
+            'size': self.size,
+            'encode_ms': self.encode_ms,
+            'cached': self.cached
+        }
+
+
+def encode_image(image, profile=DEFAULT_PROFILE):
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile '{profile}', choose one of: {', '.join(OUTPUT_PROFILES)}")
+    if profile == 'webp-lossless' and image.mode not in ('RGB', 'RGBA'):
+        # WebP only stores RGB(A); converting would move the embedded LSB bits
+        profile = DEFAULT_PROFILE
+    settings = OUTPUT_PROFILES[profile]
+
+    start = time.perf_counter()
+    if settings['format'] == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    img_io = io.BytesIO()
+    image.save(img_io, settings['format'], **settings['options'])
+    encode_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    return EncodedImage(img_io.getvalue(), profile, encode_ms)
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+import os
+import pickle
+import threading
+
+
+class ResultCache:
+    # Results of pure operations keyed by a content hash (input bytes + normalized
+    # parameters). Two tiers, both least-recently-used and capped by total bytes:
+    # pickled results in memory, and the same blobs as files in `folder`.
+    # Each entry also remembers how long computing it took, for the savings stats.
+    # Disk entries are unpickled when read: `folder` must not be writable by
+    # untrusted users.
+
+    def __init__(self, folder=None, memory_bytes=128 * 1024 * 1024, disk_bytes=1024 * 1024 * 1024):
+        self.folder = os.path.abspath(folder) if folder and disk_bytes > 0 else None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes if self.folder else 0
+        self._memory = OrderedDict()  # key -> blob
+        self._memory_used = 0
+        self._disk = OrderedDict()  # key -> size
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+        if self.folder:
+            os.makedirs(self.folder, exist_ok=True)
+            self._load()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + '.pkl')
+
+    def _load(self):
+        # Index of the files left by a previous run, oldest access first
+        entries = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            elif name.endswith('.pkl'):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _mtime, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_used += size
+        self._evict_disk()
+
+    def get(self, key):
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            elif key in self._disk:
+                self._disk.move_to_end(key)
+            else:
+                self.misses += 1
+                return None
+
+        if blob is None:
+            try:
+                with open(self._path(key), 'rb') as cached:
+                    blob = cached.read()
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                with self._lock:
+                    self._disk_used -= self._disk.pop(key, 0)
+                    self.misses += 1
+                return None
+            with self._lock:
+                self.disk_hits += 1
+            self._store_memory(key, blob)
+
+        seconds, value = pickle.loads(blob)
+        with self._lock:
+            self.bytes_saved += len(blob)
+            self.seconds_saved += seconds
+        return value
+
+    def put(self, key, value, seconds, persist=True):
+        # persist=False keeps the entry in memory only (e.g. results of keyed payloads)
+        blob = pickle.dumps((seconds, value), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self.stores += 1
+        self._store_memory(key, blob)
+        if persist and self.folder and len(blob) <= self.disk_bytes:
+            temporary = self._path(key) + '.tmp'
+            with open(temporary, 'wb') as cached:
+                cached.write(blob)
+            os.replace(temporary, self._path(key))
+            with self._lock:
+                self._disk_used += len(blob) - self._disk.pop(key, 0)
+                self._disk[key] = len(blob)
+            self._evict_disk()
+
+    def _store_memory(self, key, blob):
+        if len(blob) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= len(previous)
+            self._memory[key] = blob
+            self._memory_used += len(blob)
+            while self._memory_used > self.memory_bytes:
+                _key, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+                self.evictions += 1
+
+    def _evict_disk(self):
+        evicted = []
+        with self._lock:
+            while self._disk_used > self.disk_bytes:
+                key, size = self._disk.popitem(last=False)
+                self._disk_used -= size
+                self.evictions += 1
+                evicted.append(key)
+        for key in evicted:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._disk)
+            self._memory.clear()
+            self._memory_used = 0
+            self._disk.clear()
+            self._disk_used = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'bytes_saved': self.bytes_saved,
+                'seconds_saved': round(self.seconds_saved, 3),
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_used,
+                'memory_max_bytes': self.memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_used,
+                'disk_max_bytes': self.disk_bytes
+            }
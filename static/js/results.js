@@ -0,0 +1,52 @@
+// Shared by the steganografi and watermarking pages: image results are
+// requested as raw files (no base64) and their trace is fetched by result id
+
+async function fetchImageResult(url, formData) {
+    formData.append('response', 'binary');
+    const response = await fetch(url, {
+        method: 'POST',
+        body: formData
+    });
+
+    if (!response.ok) {
+        // Errors are JSON {error}; proxies or the upload limit may answer HTML
+        let error = response.status + ' ' + response.statusText;
+        try {
+            const data = await response.json();
+            error = data.error || error;
+        } catch (e) {}
+        return { success: false, error: error };
+    }
+
+    const blob = await response.blob();
+    return {
+        success: true,
+        imageUrl: URL.createObjectURL(blob),
+        steps: await fetchResultSteps(response.headers.get('X-Result-Id'))
+    };
+}
+
+// The steps are only extra detail: without a result id, or when they expired
+// or failed to load, the image is still shown with an empty step list
+async function fetchResultSteps(resultId) {
+    if (!resultId) {
+        return [];
+    }
+    try {
+        const stepsResponse = await fetch('/results/' + encodeURIComponent(resultId) + '/steps');
+        if (!stepsResponse.ok) {
+            return [];
+        }
+        const stepsData = await stepsResponse.json();
+        return stepsData.steps || [];
+    } catch (e) {
+        return [];
+    }
+}
+
+function downloadImage(imageUrl, filename) {
+    const link = document.createElement('a');
+    link.href = imageUrl;
+    link.download = filename;
+    link.click();
+}
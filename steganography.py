@@ -1,273 +1,913 @@
-from PIL import Image
+from PIL import Image, ImageFile, ImageMode
+import hashlib
 import numpy as np
+import os
+import shutil
+import struct
+import zlib
+
+from tracing import StepTrace, resolve_trace_level
+from telemetry import timed
+
+
+# Format container v2: header tetap 9 byte di awal stream
+#   magic (3 byte) | versi (1 byte) | flags (1 byte) | panjang payload (4 byte)
+# Decoder cukup membaca header lalu tepat sebanyak bit payload.
+STEGO_MAGIC = b'\x89SG'
+WATERMARK_MAGIC = b'\x89WM'
+FORMAT_VERSION = 2
+
+# Flags header v2
+FLAG_DEPTH_MASK = 0x03   # bit 0-1: jumlah bit per channel - 1
+FLAG_SKIP_ALPHA = 0x04   # bit 2: channel alpha tidak dipakai untuk payload
+FLAG_KEYED = 0x08        # bit 3: posisi payload diacak dengan kunci
+FLAG_UTF8 = 0x10         # bit 4: teks UTF-8 (tanpa flag: Latin-1)
+FLAG_COMPRESSED = 0x20   # bit 5: payload dikompresi (deflate tanpa header zlib)
+FLAG_BINARY = 0x40       # bit 6: payload berupa data biner, bukan teks
+
+# Mode embedding yang didukung
+BITS_PER_CHANNEL = (1, 2, 3, 4)
+CHANNEL_SELECTIONS = ('all', 'color')
+
+_KNOWN_MAGICS = (STEGO_MAGIC, WATERMARK_MAGIC)
+_KNOWN_FLAGS = FLAG_DEPTH_MASK | FLAG_SKIP_ALPHA | FLAG_KEYED | FLAG_UTF8 | FLAG_COMPRESSED | FLAG_BINARY
+_PAYLOAD_FLAGS = FLAG_UTF8 | FLAG_COMPRESSED | FLAG_BINARY
+_HEADER = struct.Struct('>3sBBI')
+_HEADER_BITS = _HEADER.size * 8
+
+# Format lama (legacy): penanda akhir pesan 1111111111111110
+_DELIMITER_BITS = np.array([1] * 15 + [0], dtype=np.uint8)
+
+# Jumlah nilai pixel yang dibaca per iterasi saat decode (kelipatan 8)
+_DECODE_CHUNK_SIZE = 64 * 1024
+
+# Mode berkunci: jumlah ronde jaringan Feistel untuk permutasi posisi payload
+_FEISTEL_ROUNDS = 6
+
+# Batas ukuran payload setelah dekompresi (melindungi dari "zip bomb")
+_MAX_DECOMPRESSED = 64 * 1024 * 1024
+
+
+def _message_to_bits(message):
+    # Konversi pesan ke array bit (0/1) dengan np.unpackbits
+    try:
+        data = message.encode('latin-1')
+    except UnicodeEncodeError:
+        # Karakter di atas U+00FF menghasilkan lebih dari 8 bit per karakter;
+        # perilaku lama dipertahankan agar hasil encode tetap identik
+        binary_message = ''.join(format(ord(char), '08b') for char in message)
+        return np.frombuffer(binary_message.encode('ascii'), dtype=np.uint8) - ord('0')
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+
+class Payload:
+    # Payload format v2 siap di-embed: byte (mungkin terkompresi) + flag payload
+
+    def __init__(self, data, flags, original_size):
+        self.data = data
+        self.flags = flags
+        self.original_size = original_size
+
+    @property
+    def bits(self):
+        return np.unpackbits(np.frombuffer(self.data, dtype=np.uint8))
+
+
+def prepare_payload(message, compress=True):
+    # Teks -> UTF-8 (ASCII murni tanpa flag, identik dengan Latin-1), bytes -> biner.
+    # Deflate hanya dipakai jika hasilnya lebih kecil.
+    if isinstance(message, (bytes, bytearray)):
+        data, flags = bytes(message), FLAG_BINARY
+    else:
+        data = message.encode('utf-8')
+        flags = FLAG_UTF8 if not data.isascii() else 0
+    original_size = len(data)
+
+    if compress and data:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            data, flags = compressed, flags | FLAG_COMPRESSED
+    return Payload(data, flags, original_size)
+
+
+def _describe_payload_flags(flags):
+    kind = 'biner' if flags & FLAG_BINARY else ('teks UTF-8' if flags & FLAG_UTF8 else 'teks Latin-1/ASCII')
+    return kind + (', terkompresi deflate' if flags & FLAG_COMPRESSED else '')
+
+
+def _decode_payload(data, flags):
+    # Kebalikan prepare_payload: dekompresi lalu bytes (biner) atau teks
+    if flags & FLAG_COMPRESSED:
+        decompressor = zlib.decompressobj(-15)
+        try:
+            data = decompressor.decompress(data, _MAX_DECOMPRESSED)
+        except zlib.error:
+            raise ValueError("Payload terkompresi rusak, tidak bisa didekompresi")
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"Payload setelah dekompresi melebihi {_MAX_DECOMPRESSED} byte")
+    if flags & FLAG_BINARY:
+        return data
+    if flags & FLAG_UTF8:
+        return data.decode('utf-8', errors='replace')
+    return data.decode('latin-1')
+
+
+def prepare_message_bits(message, container='v2', compress=True):
+    # Bitstream pesan tidak bergantung pada gambar, sehingga bisa dihitung
+    # sekali dan dipakai ulang untuk banyak gambar (batch).
+    # Format v2 menghasilkan Payload (bit + flag payload).
+    if container == 'legacy':
+        if not isinstance(message, str):
+            raise ValueError("Format lama hanya mendukung pesan teks")
+        return _message_to_bits(message)
+    return prepare_payload(message, compress)
+
+
+def _has_alpha(image):
+    bands = image.getbands()
+    return len(bands) > 1 and bands[-1] == 'A'
+
+
+def _describe_flags(flags):
+    depth = (flags & FLAG_DEPTH_MASK) + 1
+    channels = 'tanpa alpha' if flags & FLAG_SKIP_ALPHA else 'semua channel'
+    keyed = ', posisi acak berkunci' if flags & FLAG_KEYED else ''
+    return f'{flags} ({depth} bit per channel, {channels}{keyed}, {_describe_payload_flags(flags)})'
+
+
+def _build_header_bits(magic, flags, payload_length):
+    header = _HEADER.pack(magic, FORMAT_VERSION, flags, payload_length)
+    return np.unpackbits(np.frombuffer(header, dtype=np.uint8))
+
+
+def _payload_region(img_array, skip_alpha):
+    # Area payload sebagai view 2D (pixel, channel yang dipakai) setelah header.
+    # Header selalu 72 bit, habis dibagi 1-4 channel, jadi payload
+    # selalu dimulai di batas pixel.
+    channel_count = img_array.shape[2] if img_array.ndim == 3 else 1
+    pixels = img_array.reshape(-1, channel_count)
+    used_channels = channel_count - 1 if skip_alpha else channel_count
+    return pixels[_HEADER_BITS // channel_count:, :used_channels]
+
+
+def _parse_header(img_array, shape=None):
+    # Baca header v2 dari LSB nilai pertama; None jika bukan format v2.
+    # shape = dimensi gambar penuh jika img_array hanya berisi baris-baris awal.
+    shape = img_array.shape if shape is None else shape
+    img_flat = img_array.reshape(-1)
+    if len(img_flat) < _HEADER_BITS:
+        return None
+    raw = np.packbits((img_flat[:_HEADER_BITS] & 1).astype(np.uint8)).tobytes()
+    magic, version, flags, length = _HEADER.unpack(raw)
+    if magic not in _KNOWN_MAGICS or version != FORMAT_VERSION or flags & ~_KNOWN_FLAGS:
+        return None
+
+    skip_alpha = bool(flags & FLAG_SKIP_ALPHA)
+    if skip_alpha and (len(shape) != 3 or shape[2] not in (2, 4)):
+        return None
+    bits_per_channel = (flags & FLAG_DEPTH_MASK) + 1
+    channel_count = shape[2] if len(shape) == 3 else 1
+    used_channels = channel_count - 1 if skip_alpha else channel_count
+    capacity = (shape[0] * shape[1] - _HEADER_BITS // channel_count) * used_channels
+    if -(-length * 8 // bits_per_channel) > capacity:
+        return None
 
+    return {
+        'magic': magic,
+        'version': version,
+        'flags': flags,
+        'length': length,
+        'bits_per_channel': bits_per_channel,
+        'channels': 'color' if skip_alpha else 'all'
+    }
 
-def encode_message_lsb(image, message, return_steps=False):
-    steps = []
 
-    # LANGKAH 1: Konversi gambar ke array NumPy
-    img_array = np.array(image)
-    steps.append({
-        'step': 1,
-        'title': 'Konversi Gambar ke Array NumPy',
-        'description': f'Gambar dikonversi menjadi array berisi nilai pixel (0-255)',
-        'detail': f'Dimensi gambar: {img_array.shape} → Total {img_array.size} nilai pixel',
-        'status': 'success'
-    })
-
-    # LANGKAH 2: Konversi pesan ke binary
-    binary_message = ''.join([format(ord(char), '08b') for char in message])
-
-    # Contoh untuk 10 karakter pertama (atau semua jika kurang dari 10)
-    num_samples = min(10, len(message))
-    sample_chars = message[:num_samples]
-    sample_conversions = []
-    for char in sample_chars:
-        sample_conversions.append(f"'{char}' = ASCII {ord(char):3d} = {format(ord(char), '08b')}")
-
-    sample_text = '\n'.join(sample_conversions)
-    more_text = f"\n...dan {len(message) - num_samples} karakter lainnya" if len(message) > num_samples else ""
-
-    steps.append({
-        'step': 2,
-        'title': 'Konversi Pesan ke Binary',
-        'description': f'Setiap karakter dikonversi: ASCII → Binary 8-bit',
-        'detail': f'Panjang pesan: {len(message)} karakter\n\nKonversi karakter:\n{sample_text}{more_text}\n\nTotal bit: {len(binary_message)}',
-        'status': 'success'
-    })
-
-    # LANGKAH 3: Tambahkan delimiter
-    binary_message += '1111111111111110'
-    message_length = len(binary_message)
-
-    steps.append({
-        'step': 3,
-        'title': 'Tambahkan Delimiter',
-        'description': 'Menambahkan penanda akhir pesan (1111111111111110)',
-        'detail': f'Panjang total dengan delimiter: {message_length} bit (termasuk 16 bit delimiter)',
-        'status': 'success'
-    })
-
-    # LANGKAH 4: Flatten array
-    img_flat = img_array.flatten()
+def _partial_rows_supported(image):
+    # Hanya gambar lazy (Image.open, belum di-load) dengan satu tile yang
+    # didekode baris demi baris dari atas: PNG non-interlaced dan data raw
+    if not isinstance(image, ImageFile.ImageFile) or getattr(image, 'fp', None) is None:
+        return False
+    if len(image.tile) != 1:
+        return False
+    codec, extents, offset, args = image.tile[0]
+    if tuple(extents) != (0, 0) + image.size:
+        return False
+    if codec == 'zip':
+        return image.format == 'PNG' and not image.info.get('interlace')
+    if codec == 'raw':
+        args = args if isinstance(args, tuple) else (args,)
+        return len(args) < 3 or args[2] == 1
+    return False
+
+
+class _RowReader:
+    # Pixel gambar yang didekode bertahap dari atas: hanya baris yang dibutuhkan
+    # header/payload. Full load jika format tidak didukung atau payload
+    # mencapai bagian bawah gambar.
+
+    def __init__(self, image):
+        self.image = image
+        self.width, self.height = image.size
+        self.partial = _partial_rows_supported(image)
+        self.array = None
+        self.shape = None
+
+    @property
+    def rows_decoded(self):
+        return 0 if self.array is None else len(self.array)
+
+    @property
+    def complete(self):
+        return self.rows_decoded == self.height
+
+    def rows_for(self, value_count):
+        # Jumlah baris yang memuat value_count nilai pertama (flat)
+        channel_count = len(self.image.getbands())
+        return -(-value_count // (self.width * channel_count))
+
+    def _decode_rows(self, row_count):
+        # Buka ulang file dan batasi ukuran/tile: decoder berhenti setelah row_count baris
+        fp = self.image.fp
+        fp.seek(0)
+        partial = Image.open(fp)
+        codec, extents, offset, args = partial.tile[0]
+        partial._size = (self.width, row_count)
+        partial.tile = [(codec, (0, 0, self.width, row_count), offset, args)]
+        partial.load()
+        return np.asarray(partial)
+
+    def rows(self, row_count):
+        row_count = min(max(row_count, 1), self.height)
+        if row_count <= self.rows_decoded:
+            return self.array
+
+        array = None
+        if self.partial and row_count < self.height:
+            try:
+                array = self._decode_rows(row_count)
+            except Exception:
+                self.partial = False
+        if array is None:
+            array = np.array(self.image)
+
+        self.array = array
+        self.shape = (self.height,) + array.shape[1:]
+        return array
+
+
+def read_header(image):
+    reader = _RowReader(image)
+    return _parse_header(reader.rows(reader.rows_for(_HEADER_BITS)), reader.shape)
+
+
+def _embed_bits(carriers, bits, bits_per_channel=1):
+    # Kelompokkan bit menjadi simbol k-bit lalu tulis ke k bit terbawah setiap
+    # nilai dalam satu masked assignment; kembalikan nilai asli untuk statistik
+    padded = np.zeros(-(-len(bits) // bits_per_channel) * bits_per_channel, dtype=np.uint8)
+    padded[:len(bits)] = bits
+    symbols = np.packbits(padded.reshape(-1, bits_per_channel), axis=1)[:, 0] >> (8 - bits_per_channel)
+
+    low_mask = (1 << bits_per_channel) - 1
+    original_values = carriers[:len(symbols)].copy()
+    carriers[:len(symbols)] = (original_values & (0xFF ^ low_mask)) | symbols
+    return original_values
+
+
+def _extract_bits(carriers, bit_count, bits_per_channel=1):
+    low_mask = (1 << bits_per_channel) - 1
+    symbols = (carriers[:-(-bit_count // bits_per_channel)] & low_mask).astype(np.uint8)
+    bits = np.unpackbits(symbols[:, None], axis=1)[:, 8 - bits_per_channel:]
+    return bits.reshape(-1)[:bit_count]
+
+
+def _carrier_block(region, carrier_count):
+    # Baris pixel minimum yang memuat carrier_count nilai carrier
+    return region[:-(-carrier_count // region.shape[1])]
+
+
+def _round_keys(key):
+    # Kunci ronde Feistel (uint64) diturunkan dari kunci pengguna
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8 * _FEISTEL_ROUNDS, person=b'stego-keyed').digest()
+    return np.frombuffer(digest, dtype='<u8').astype(np.uint64)
+
+
+def _feistel(values, round_keys, half_bits):
+    # Permutasi bijektif pada [0, 4^half_bits): jaringan Feistel seimbang dengan
+    # fungsi ronde mix64 (splitmix/murmur finalizer), vektor untuk semua nilai
+    mask = np.uint64((1 << half_bits) - 1)
+    shift = np.uint64(half_bits)
+    left, right = values >> shift, values & mask
+    for round_key in round_keys:
+        mixed = right ^ round_key
+        mixed ^= mixed >> np.uint64(33)
+        mixed *= np.uint64(0xFF51AFD7ED558CCD)
+        mixed ^= mixed >> np.uint64(33)
+        mixed *= np.uint64(0xC4CEB9FE1A85EC53)
+        mixed ^= mixed >> np.uint64(33)
+        left, right = right, left ^ (mixed & mask)
+    return (left << shift) | right
+
+
+def _keyed_positions(key, domain_size, count):
+    # Posisi ke-0..count-1 dari permutasi berkunci atas [0, domain_size), tanpa
+    # membangun permutasi penuh: Feistel pada domain 4^h >= domain_size lalu
+    # cycle-walking (ulangi permutasi) untuk hasil yang jatuh di luar domain
+    half_bits = max(1, -(-max(domain_size - 1, 1).bit_length() // 2))
+    round_keys = _round_keys(key)
+    positions = _feistel(np.arange(count, dtype=np.uint64), round_keys, half_bits)
+    outside = np.flatnonzero(positions >= domain_size)
+    while len(outside):
+        positions[outside] = _feistel(positions[outside], round_keys, half_bits)
+        outside = outside[positions[outside] >= domain_size]
+    return positions.astype(np.int64)
+
+
+def _keyed_carriers(region, key, carrier_count):
+    # Indeks (pixel, channel) dalam region untuk carrier_count carrier berkunci
+    positions = _keyed_positions(key, region.size, carrier_count)
+    return positions // region.shape[1], positions % region.shape[1]
+
+
+def _check_embed_options(container, bits_per_channel, channels, key):
+    if bits_per_channel not in BITS_PER_CHANNEL:
+        raise ValueError(f"Jumlah bit per channel harus salah satu dari {BITS_PER_CHANNEL}")
+    if channels not in CHANNEL_SELECTIONS:
+        raise ValueError(f"Pilihan channel harus salah satu dari {CHANNEL_SELECTIONS}")
+    if container == 'legacy' and (bits_per_channel != 1 or channels != 'all'):
+        raise ValueError("Format lama hanya mendukung 1 bit per channel pada semua channel")
+    if container == 'legacy' and key:
+        raise ValueError("Format lama tidak mendukung kunci")
+
+
+def _embed_message(img_array, has_alpha, message, steps, container, magic, bits_per_channel, channels,
+                   message_bits, key, compress):
+    # Langkah 2-5 encode, langsung pada img_array (salinan np.array atau memmap):
+    # hanya nilai header dan carrier payload yang ditulis
+    # LANGKAH 2: Konversi pesan ke binary (kecuali sudah disiapkan pemanggil).
+    # Format v2: Payload (UTF-8 / biner, dikompresi jika lebih kecil) + flag payload
+    if message_bits is None:
+        message_bits = prepare_message_bits(message, container, compress)
+    payload = message_bits if isinstance(message_bits, Payload) else None
+    if payload is not None:
+        message_bits = payload.bits
+
+    def message_detail():
+        if isinstance(message, (bytes, bytearray)):
+            sample_text = ' '.join(format(byte, '08b') for byte in message[:10])
+            more_text = f" ...dan {len(message) - 10} byte lainnya" if len(message) > 10 else ""
+            message_text = f'Payload biner: {len(message)} byte\n\nByte awal:\n{sample_text}{more_text}'
+        else:
+            # Contoh untuk 10 karakter pertama (atau semua jika kurang dari 10)
+            num_samples = min(10, len(message))
+            sample_conversions = []
+            for char in message[:num_samples]:
+                sample_conversions.append(f"'{char}' = Unicode {ord(char):3d} = {' '.join(format(byte, '08b') for byte in char.encode('utf-8'))}")
+
+            sample_text = '\n'.join(sample_conversions)
+            more_text = f"\n...dan {len(message) - num_samples} karakter lainnya" if len(message) > num_samples else ""
+            message_text = f'Panjang pesan: {len(message)} karakter\n\nKonversi karakter:\n{sample_text}{more_text}'
+        if payload is not None:
+            message_text += f'\n\nPayload: {_describe_payload_flags(payload.flags)}\nUkuran: {payload.original_size} → {len(payload.data)} byte'
+        return f'{message_text}\n\nTotal bit: {len(message_bits)}'
+
+    steps.add(
+        2, 'Konversi Pesan ke Binary',
+        'Setiap karakter dikonversi: ASCII → Binary 8-bit' if payload is None else
+        'Pesan dikonversi ke byte UTF-8 (dikompresi jika lebih kecil) lalu ke binary',
+        message_detail
+    )
+
+    # LANGKAH 4: Flatten array (view: img_array selalu C-contiguous, baik salinan
+    # np.array maupun memmap, jadi penulisan lewat img_flat mengubah img_array)
+    img_flat = img_array.reshape(-1)
+
+    if container == 'legacy':
+        # LANGKAH 3: Tambahkan delimiter
+        stream_bits = np.concatenate([message_bits, _DELIMITER_BITS])
+        message_length = len(stream_bits)
+        values_needed = message_length
+        capacity = len(img_flat)
+
+        steps.add(
+            3, 'Tambahkan Delimiter',
+            'Menambahkan penanda akhir pesan (1111111111111110)',
+            lambda: f'Panjang total dengan delimiter: {message_length} bit (termasuk 16 bit delimiter)'
+        )
+    else:
+        # LANGKAH 3: Tambahkan header (magic, versi, flags, panjang payload)
+        skip_alpha = channels == 'color' and has_alpha
+        flags = (bits_per_channel - 1) | (FLAG_SKIP_ALPHA if skip_alpha else 0) | (FLAG_KEYED if key else 0)
+        if payload is not None:
+            flags |= payload.flags
+        payload_length = len(message_bits) // 8
+        header_bits = _build_header_bits(magic, flags, payload_length)
+        stream_bits = np.concatenate([header_bits, message_bits])
+        message_length = len(stream_bits)
+
+        region = _payload_region(img_array, skip_alpha)
+        payload_values = -(-len(message_bits) // bits_per_channel)
+        values_needed = _HEADER_BITS + payload_values
+        capacity = _HEADER_BITS + region.size * bits_per_channel if region.size else 0
+
+        steps.add(
+            3, 'Tambahkan Header',
+            'Menambahkan header v2 (magic, versi, flags, panjang payload) di depan pesan',
+            lambda: f'Magic: {magic!r}\nVersi: {FORMAT_VERSION}\nFlags: {_describe_flags(flags)}\nPanjang payload: {payload_length} byte\n\nPanjang total dengan header: {message_length} bit (termasuk {_HEADER_BITS} bit header)'
+        )
 
     # LANGKAH 5: Validasi kapasitas
-    if message_length > len(img_flat):
-        steps.append({
-            'step': 4,
-            'title': 'Validasi Kapasitas',
-            'description': 'Memeriksa apakah gambar cukup untuk menyimpan pesan',
-            'detail': f'GAGAL! Pesan memerlukan {message_length} bit, tapi hanya tersedia {len(img_flat)} bit',
-            'status': 'error'
-        })
+    if message_length > capacity:
+        steps.add(
+            4, 'Validasi Kapasitas',
+            'Memeriksa apakah gambar cukup untuk menyimpan pesan',
+            lambda: f'GAGAL! Pesan memerlukan {message_length} bit, tapi hanya tersedia {capacity} bit',
+            status='error'
+        )
         raise ValueError(
-            f"Pesan terlalu panjang! Maksimal {len(img_flat)} bit, "
+            f"Pesan terlalu panjang! Maksimal {capacity} bit, "
             f"pesan memerlukan {message_length} bit"
         )
 
-    capacity_percent = (message_length / len(img_flat)) * 100
-    steps.append({
-        'step': 4,
-        'title': 'Validasi Kapasitas',
-        'description': 'Memeriksa apakah gambar cukup untuk menyimpan pesan',
-        'detail': f'Kapasitas tersedia: {len(img_flat)} bit\nDibutuhkan: {message_length} bit\nPenggunaan: {capacity_percent:.2f}%',
-        'status': 'success'
-    })
-
-    # LANGKAH 6: Embed pesan ke LSB
-    modified_count = 0
-    sample_modifications = []
-    num_samples = min(15, message_length)  # Tampilkan 15 contoh
-
-    for i in range(message_length):
-        original_value = img_flat[i]
-        img_flat[i] = (img_flat[i] & 0xFE) | int(binary_message[i])
-
-        if img_flat[i] != original_value:
-            modified_count += 1
-
-        # Simpan 15 contoh modifikasi pertama
-        if len(sample_modifications) < num_samples:
-            change_marker = "✓ CHANGED" if img_flat[i] != original_value else "  (same)"
+    steps.add(
+        4, 'Validasi Kapasitas',
+        'Memeriksa apakah gambar cukup untuk menyimpan pesan',
+        lambda: f'Kapasitas tersedia: {capacity} bit\nDibutuhkan: {message_length} bit\nPenggunaan: {(message_length / capacity) * 100:.2f}%'
+    )
+
+    # LANGKAH 6: Embed pesan ke LSB (satu operasi array per bagian stream)
+    if container == 'legacy':
+        original_values = _embed_bits(img_flat, stream_bits)
+        new_values = img_flat[:values_needed]
+    else:
+        header_original = _embed_bits(img_flat, header_bits)
+        if key:
+            # Posisi carrier dari permutasi berkunci, hanya sebanyak yang dipakai
+            carrier_index = _keyed_carriers(region, key, payload_values)
+            carriers = region[carrier_index]
+            payload_original = _embed_bits(carriers, message_bits, bits_per_channel)
+            region[carrier_index] = carriers
+        else:
+            block = _carrier_block(region, payload_values)
+            carriers = block.reshape(-1)  # view jika block kontigu, salinan jika tidak
+            payload_original = _embed_bits(carriers, message_bits, bits_per_channel)
+            block[...] = carriers.reshape(block.shape)
+
+        if steps.full:
+            original_values = np.concatenate([header_original, payload_original])
+            new_values = np.concatenate([img_flat[:_HEADER_BITS], carriers[:payload_values]])
+
+    if steps.full:
+        # Statistik dan contoh hanya dihitung jika trace penuh diminta
+        num_samples = min(15, values_needed)  # Tampilkan 15 contoh
+        changed = new_values != original_values
+        modified_count = int(np.count_nonzero(changed))
+        samples = (original_values[:num_samples].copy(), new_values[:num_samples].copy(),
+                   stream_bits[:num_samples], changed[:num_samples])
+
+    def embed_detail():
+        sample_modifications = []
+        for i, (original_value, new_value, bit, is_changed) in enumerate(zip(*samples)):
+            change_marker = "✓ CHANGED" if is_changed else "  (same)"
             sample_modifications.append(
                 f"Pixel {i:4d}: {original_value:3d} ({format(original_value, '08b')}) → "
-                f"{img_flat[i]:3d} ({format(img_flat[i], '08b')}) [bit={binary_message[i]}] {change_marker}"
+                f"{new_value:3d} ({format(new_value, '08b')}) [bit={bit}] {change_marker}"
             )
 
-    modification_percent = (modified_count / message_length) * 100
-    sample_text = '\n'.join(sample_modifications)
-    more_text = f"\n...dan {message_length - num_samples} pixel lainnya" if message_length > num_samples else ""
+        modification_percent = (modified_count / values_needed) * 100
+        sample_text = '\n'.join(sample_modifications)
+        more_text = f"\n...dan {values_needed - num_samples} pixel lainnya" if values_needed > num_samples else ""
+        return f'Total pixel diproses: {values_needed}\nPixel yang berubah: {modified_count} ({modification_percent:.1f}%)\nPixel yang sama: {values_needed - modified_count} ({100 - modification_percent:.1f}%)\n\nContoh modifikasi ({num_samples} pixel pertama):\n{sample_text}{more_text}'
+
+    steps.add(
+        5, 'Modifikasi LSB Pixel',
+        ('Menyisipkan bit pesan ke bit terakhir (LSB) setiap pixel' if bits_per_channel == 1 else
+         f'Menyisipkan {bits_per_channel} bit pesan ke {bits_per_channel} bit terbawah setiap pixel') +
+        (' pada posisi acak yang ditentukan kunci' if key else ''),
+        embed_detail
+    )
 
-    steps.append({
-        'step': 5,
-        'title': 'Modifikasi LSB Pixel',
-        'description': 'Menyisipkan bit pesan ke bit terakhir (LSB) setiap pixel',
-        'detail': f'Total pixel diproses: {message_length}\nPixel yang berubah: {modified_count} ({modification_percent:.1f}%)\nPixel yang sama: {message_length - modified_count} ({100 - modification_percent:.1f}%)\n\nContoh modifikasi ({num_samples} pixel pertama):\n{sample_text}{more_text}',
-        'status': 'success'
-    })
+
+@timed
+def encode_message_lsb(image, message, return_steps=False, container='v2', magic=STEGO_MAGIC,
+                       bits_per_channel=1, channels='all', message_bits=None, trace_level=None, key=None,
+                       compress=True):
+    steps = StepTrace(resolve_trace_level(trace_level, return_steps))
+    _check_embed_options(container, bits_per_channel, channels, key)
+
+    # LANGKAH 1: Konversi gambar ke array NumPy
+    img_array = np.array(image)
+    steps.add(
+        1, 'Konversi Gambar ke Array NumPy',
+        'Gambar dikonversi menjadi array berisi nilai pixel (0-255)',
+        lambda: f'Dimensi gambar: {img_array.shape} → Total {img_array.size} nilai pixel'
+    )
+
+    # LANGKAH 2-5: Pesan, header, validasi kapasitas dan embed LSB (in-place)
+    _embed_message(img_array, _has_alpha(image), message, steps, container, magic, bits_per_channel,
+                   channels, message_bits, key, compress)
 
     # LANGKAH 7: Reshape array
-    stego_array = img_flat.reshape(img_array.shape)
-    steps.append({
-        'step': 6,
-        'title': 'Reshape Array ke Bentuk Gambar',
-        'description': 'Mengembalikan array yang sudah dimodifikasi ke bentuk gambar asli',
-        'detail': f'Array flat → Gambar {img_array.shape}',
-        'status': 'success'
-    })
+    stego_array = img_array
+    steps.add(
+        6, 'Reshape Array ke Bentuk Gambar',
+        'Mengembalikan array yang sudah dimodifikasi ke bentuk gambar asli',
+        lambda: f'Array flat → Gambar {stego_array.shape}'
+    )
 
     # LANGKAH 8: Konversi ke PIL Image
-    stego_image = Image.fromarray(stego_array.astype('uint8'))
-    steps.append({
-        'step': 7,
-        'title': 'Konversi ke Format Gambar',
-        'description': 'Array NumPy dikonversi kembali ke format PIL Image',
-        'detail': f'Gambar stego siap disimpan (format: {stego_image.mode}, size: {stego_image.size})',
-        'status': 'success'
-    })
+    stego_image = Image.fromarray(stego_array if stego_array.dtype == np.uint8 else stego_array.astype('uint8'))
+    steps.add(
+        7, 'Konversi ke Format Gambar',
+        'Array NumPy dikonversi kembali ke format PIL Image',
+        lambda: f'Gambar stego siap disimpan (format: {stego_image.mode}, size: {stego_image.size})'
+    )
 
     if return_steps:
         return stego_image, steps
     return stego_image
 
 
-def decode_message_lsb(image, return_steps=False):
-    steps = []
+def _memmap_layout(image):
+    # (offset, shape) data pixel mentah yang tersimpan kontigu dari atas ke bawah
+    # tanpa padding (PPM/PGM, TIFF tanpa kompresi, 8-bit L/RGB/RGBA); None jika tidak
+    if not isinstance(image, ImageFile.ImageFile) or image.mode not in ('L', 'RGB', 'RGBA') or not image.tile:
+        return None
+    width, height = image.size
+    channel_count = len(image.getbands())
+    row_bytes = width * channel_count
+
+    # TIFF bisa terdiri dari beberapa strip: harus berurutan tanpa celah
+    tiles = sorted(image.tile, key=lambda tile: tile[1][1])
+    start = tiles[0][2]
+    rows = 0
+    for codec, extents, offset, args in tiles:
+        args = args if isinstance(args, tuple) else (args,)
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        if codec != 'raw' or args[0] != image.mode or stride not in (0, row_bytes) or orientation != 1:
+            return None
+        if (extents[0], extents[2]) != (0, width) or extents[1] != rows or offset != start + rows * row_bytes:
+            return None
+        rows = extents[3]
+    if rows != height:
+        return None
+    return start, (height, width, channel_count) if channel_count > 1 else (height, width)
+
+
+def supports_memmap(path):
+    # True jika file bisa disisipi langsung lewat encode_message_file (pixel mentah
+    # kontigu: PPM/PGM, TIFF tanpa kompresi, 8-bit L/RGB/RGBA); hanya header dibaca
+    try:
+        with Image.open(path) as image:
+            return _memmap_layout(image) is not None
+    except (OSError, Image.DecompressionBombError):
+        return False
+
+
+def _clone_file(source, target):
+    # Salin file lewat kernel (copy_file_range): pada filesystem copy-on-write
+    # (btrfs, XFS reflink, ...) extent dibagi, jadi salinan tidak memakan ruang
+    # tambahan kecuali halaman yang nanti diubah
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except (AttributeError, OSError):
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+
+
+@timed
+def encode_message_file(path, message, output_path=None, return_steps=False, container='v2', magic=STEGO_MAGIC,
+                        bits_per_channel=1, channels='all', message_bits=None, trace_level=None, key=None,
+                        compress=True):
+    # Encode langsung ke file gambar tanpa kompresi lewat np.memmap: hanya halaman
+    # yang memuat header dan carrier payload yang dibaca dan ditulis, header file
+    # tidak berubah. Tanpa output_path file diubah in-place.
+    steps = StepTrace(resolve_trace_level(trace_level, return_steps))
+    _check_embed_options(container, bits_per_channel, channels, key)
+
+    with Image.open(path) as image:
+        layout = _memmap_layout(image)
+        has_alpha = _has_alpha(image)
+        image_format = image.format
+    if layout is None:
+        raise ValueError(
+            "Format file tidak didukung untuk encode memmap! "
+            "Hanya PPM/PGM dan TIFF tanpa kompresi (8-bit L/RGB/RGBA)"
+        )
+    offset, shape = layout
+
+    cloned = output_path is not None and os.path.abspath(output_path) != os.path.abspath(path)
+    img_array = None
+    try:
+        if cloned:
+            _clone_file(path, output_path)
+            path = output_path
+
+        # LANGKAH 1: Petakan data pixel file ke array (tanpa membaca isinya)
+        img_array = np.memmap(path, dtype=np.uint8, mode='r+', offset=offset, shape=shape)
+        value_count = img_array.size
+        steps.add(
+            1, 'Petakan File ke Memori',
+            'Data pixel file dipetakan dengan np.memmap, hanya halaman yang diakses yang dibaca',
+            lambda: f'Format: {image_format}\nOffset data pixel: {offset} byte\nDimensi gambar: {shape} → Total {value_count} nilai pixel'
+        )
 
-    # LANGKAH 1: Konversi gambar ke array NumPy
-    img_array = np.array(image)
-    steps.append({
-        'step': 1,
-        'title': 'Baca Gambar Stego',
-        'description': 'Gambar yang berisi pesan tersembunyi dikonversi ke array NumPy',
-        'detail': f'Dimensi gambar: {img_array.shape}\nTotal pixel values: {img_array.size}',
-        'status': 'success'
-    })
-
-    # LANGKAH 2: Flatten array
-    img_flat = img_array.flatten()
-    steps.append({
-        'step': 2,
-        'title': 'Flatten Array',
-        'description': 'Array gambar diratakan untuk memudahkan ekstraksi LSB',
-        'detail': f'Array {img_array.shape} → Array 1D dengan {len(img_flat)} elemen',
-        'status': 'success'
-    })
-
-    # LANGKAH 3: Ekstrak LSB dari setiap pixel
-    binary_message = ''
-    sample_extractions = []
-    num_samples = 15  # Tampilkan 15 contoh
-
-    for i, pixel in enumerate(img_flat):
-        lsb = pixel & 1
-        binary_message += str(lsb)
-
-        # Simpan 15 contoh ekstraksi pertama
-        if len(sample_extractions) < num_samples:
+        # LANGKAH 2-5: Sama dengan encode_message_lsb, langsung pada memmap
+        _embed_message(img_array, has_alpha, message, steps, container, magic, bits_per_channel,
+                       channels, message_bits, key, compress)
+
+        # LANGKAH 6: Tulis halaman yang berubah ke file
+        img_array.flush()
+        steps.add(
+            6, 'Tulis Perubahan ke File',
+            'Hanya halaman memori yang berubah ditulis kembali ke file',
+            lambda: f'File hasil: {path}'
+        )
+    except BaseException:
+        # Salinan yang baru sebagian disisipi tidak boleh tertinggal
+        img_array = None
+        if cloned:
+            try:
+                os.remove(output_path)
+            except FileNotFoundError:
+                pass
+        raise
+    finally:
+        # np.memmap melepas pemetaan file saat referensi terakhirnya hilang
+        del img_array
+
+    if return_steps:
+        return path, steps
+    return path
+
+
+def _extract_until_delimiter(img_flat, chunk_size=_DECODE_CHUNK_SIZE):
+    # Baca LSB per chunk dan simpan dalam bentuk packed (8 bit per byte).
+    # Delimiter berakhir pada bit 0 yang didahului minimal 15 bit 1, jadi cukup
+    # membawa posisi bit 0 terakhir antar chunk. Berhenti begitu delimiter ketemu.
+    packed_chunks = []
+    last_zero = -1
+    for start in range(0, len(img_flat), chunk_size):
+        bits = (img_flat[start:start + chunk_size] & 1).astype(np.uint8)
+        packed_chunks.append(np.packbits(bits))
+
+        zeros = np.flatnonzero(bits == 0) + start
+        if len(zeros) == 0:
+            continue
+        hits = np.flatnonzero(np.diff(zeros, prepend=last_zero) >= len(_DELIMITER_BITS))
+        if len(hits):
+            delimiter_end = int(zeros[hits[0]])
+            bits_read = delimiter_end + 1
+            return np.concatenate(packed_chunks), bits_read - len(_DELIMITER_BITS), bits_read
+        last_zero = zeros[-1]
+
+    packed = np.concatenate(packed_chunks) if packed_chunks else np.zeros(0, dtype=np.uint8)
+    return packed, -1, len(img_flat)
+
+
+@timed
+def decode_message_lsb(image, return_steps=False, trace_level=None, key=None):
+    steps = StepTrace(resolve_trace_level(trace_level, return_steps))
+
+    # LANGKAH 1: Konversi gambar ke array NumPy. Untuk gambar lazy hanya baris
+    # awal yang didekode; baris berikutnya dibaca jika payload membutuhkannya.
+    reader = _RowReader(image)
+    img_array = reader.rows(reader.rows_for(_DECODE_CHUNK_SIZE))
+    steps.add(
+        1, 'Baca Gambar Stego',
+        'Gambar yang berisi pesan tersembunyi dikonversi ke array NumPy',
+        lambda: f'Dimensi gambar: {reader.shape}\nTotal pixel values: {int(np.prod(reader.shape))}\nBaris didekode: {reader.rows_decoded} dari {reader.height}'
+    )
+
+    # LANGKAH 2: Flatten array (view, tanpa menyalin data gambar)
+    img_flat = img_array.reshape(-1)
+    steps.add(
+        2, 'Flatten Array',
+        'Array gambar diratakan untuk memudahkan ekstraksi LSB',
+        lambda: f'Array {img_array.shape} → Array 1D dengan {len(img_flat)} elemen'
+    )
+
+    def extraction_samples(positions, values, total_values, bits_per_channel=1):
+        low_mask = (1 << bits_per_channel) - 1
+        sample_extractions = []
+        num_samples = min(15, total_values)  # Tampilkan 15 contoh
+        for position, pixel in zip(positions[:num_samples], values[:num_samples]):
             sample_extractions.append(
-                f"Pixel {i:4d}: nilai={pixel:3d} ({format(pixel, '08b')}) → LSB = {lsb}"
+                f"Pixel {position:4d}: nilai={pixel:3d} ({format(pixel, '08b')}) → LSB = {format(pixel & low_mask, f'0{bits_per_channel}b')}"
             )
 
-    sample_text = '\n'.join(sample_extractions)
-    more_text = f"\n...dan {len(img_flat) - num_samples} pixel lainnya"
-
-    steps.append({
-        'step': 3,
-        'title': 'Ekstrak LSB dari Setiap Pixel',
-        'description': 'Mengambil bit terakhir (LSB) dari setiap nilai pixel',
-        'detail': f'Total bit diekstrak: {len(binary_message):,}\n\nContoh ekstraksi ({num_samples} pixel pertama):\n{sample_text}{more_text}',
-        'status': 'success'
-    })
-
-    # LANGKAH 4: Cari delimiter
-    delimiter = '1111111111111110'
-    delimiter_index = binary_message.find(delimiter)
-
-    if delimiter_index == -1:
-        steps.append({
-            'step': 4,
-            'title': 'Cari Delimiter',
-            'description': 'Mencari pola delimiter (1111111111111110)',
-            'detail': 'Delimiter tidak ditemukan - Gambar tidak berisi pesan tersembunyi',
-            'status': 'error'
-        })
-        if return_steps:
-            return "No hidden message found", steps
-        return "No hidden message found"
-
-    steps.append({
-        'step': 4,
-        'title': 'Cari Delimiter',
-        'description': 'Mencari pola delimiter (1111111111111110)',
-        'detail': f'Delimiter ditemukan pada posisi bit ke-{delimiter_index}\nPanjang pesan (tanpa delimiter): {delimiter_index} bit',
-        'status': 'success'
-    })
-
-    # LANGKAH 5: Ambil bagian pesan
-    binary_message = binary_message[:delimiter_index]
-    num_chars = delimiter_index // 8
-
-    steps.append({
-        'step': 5,
-        'title': 'Isolasi Pesan Binary',
-        'description': 'Mengambil bit sebelum delimiter sebagai pesan',
-        'detail': f'Panjang pesan binary: {delimiter_index} bit\nJumlah karakter: {num_chars} karakter (setiap karakter = 8 bit)',
-        'status': 'success'
-    })
-
-    # LANGKAH 6: Konversi binary ke text
-    message = ''
-    sample_conversions = []
-    num_samples = min(10, len(binary_message) // 8)  # Tampilkan 10 karakter
-
-    for i in range(0, len(binary_message), 8):
-        byte = binary_message[i:i+8]
-        if len(byte) == 8:
-            char_code = int(byte, 2)
-            char = chr(char_code)
-            message += char
+        sample_text = '\n'.join(sample_extractions)
+        more_text = f"\n...dan {total_values - num_samples} pixel lainnya" if total_values > num_samples else ""
+        return num_samples, f'{sample_text}{more_text}'
+
+    # LANGKAH 3: Baca header v2; jika tidak ada, gunakan format lama (delimiter)
+    header = _parse_header(img_array, reader.shape)
+    if header is not None:
+        payload_bits = header['length'] * 8
+        bits_per_channel = header['bits_per_channel']
+        payload_values = -(-payload_bits // bits_per_channel)
+        steps.add(
+            3, 'Baca Header',
+            f'Membaca {_HEADER_BITS} bit pertama sebagai header format v2',
+            lambda: f"Magic: {header['magic']!r}\nVersi: {header['version']}\nFlags: {_describe_flags(header['flags'])}\nPanjang payload: {header['length']} byte ({payload_bits} bit)"
+        )
 
-            # Simpan 10 contoh konversi pertama
-            if len(sample_conversions) < num_samples:
-                display_char = char if char.isprintable() else f'[{char_code}]'
-                sample_conversions.append(
-                    f"{byte} → ASCII {char_code:3d} → '{display_char}'"
-                )
+        # LANGKAH 4: Ekstrak tepat sebanyak bit payload (decode baris tambahan jika perlu)
+        keyed = bool(header['flags'] & FLAG_KEYED)
+        if keyed and not key:
+            raise ValueError("Pesan disisipkan dengan kunci! Masukkan kunci untuk membaca pesan")
+        skip_alpha = header['channels'] == 'color'
+        channel_count = reader.shape[2] if len(reader.shape) == 3 else 1
+        used_channels = channel_count - 1 if skip_alpha else channel_count
+        if keyed:
+            # Payload tersebar ke seluruh gambar: semua baris dibutuhkan
+            img_array = reader.rows(reader.height)
+            region = _payload_region(img_array, skip_alpha)
+            carrier_pixels, carrier_channels = _keyed_carriers(region, key, payload_values)
+            carriers = region[carrier_pixels, carrier_channels]
+        else:
+            payload_pixels = _HEADER_BITS // channel_count + -(-payload_values // used_channels)
+            img_array = reader.rows(-(-payload_pixels // reader.width))
+            region = _payload_region(img_array, skip_alpha)
+            carriers = _carrier_block(region, payload_values).reshape(-1)
+            # Posisi berurutan; cukup untuk contoh di trace
+            carrier_pixels = np.arange(min(15, payload_values)) // used_channels
+            carrier_channels = np.arange(min(15, payload_values)) % used_channels
+        img_flat = img_array.reshape(-1)
+        message_bytes = np.packbits(_extract_bits(carriers, payload_bits, bits_per_channel))
+
+        def payload_detail():
+            # Posisi carrier dalam array flat (melewati alpha jika tidak dipakai)
+            positions = [(_HEADER_BITS // channel_count + int(pixel)) * channel_count + int(channel)
+                         for pixel, channel in zip(carrier_pixels[:15], carrier_channels[:15])]
+            num_samples, sample_text = extraction_samples(positions, carriers, payload_values, bits_per_channel)
+            return f'Total bit diekstrak: {_HEADER_BITS + payload_bits:,} dari {int(np.prod(reader.shape)):,}\n\nContoh ekstraksi ({num_samples} pixel pertama payload):\n{sample_text}'
+
+        steps.add(
+            4, 'Ekstrak LSB Payload',
+            'Mengambil LSB sebanyak panjang payload yang tercatat di header',
+            payload_detail
+        )
+        next_step = 5
+    else:
+        # LANGKAH 3: Ekstrak LSB per chunk sampai delimiter ditemukan;
+        # jika tidak ada di baris awal, decode seluruh gambar
+        packed_message, delimiter_index, bits_read = _extract_until_delimiter(img_flat)
+        if delimiter_index == -1 and not reader.complete:
+            img_array = reader.rows(reader.height)
+            img_flat = img_array.reshape(-1)
+            packed_message, delimiter_index, bits_read = _extract_until_delimiter(img_flat)
+
+        def extraction_detail():
+            num_samples, sample_text = extraction_samples(range(bits_read), img_flat, bits_read)
+            return f'Total bit diekstrak: {bits_read:,} dari {int(np.prod(reader.shape)):,}\n\nContoh ekstraksi ({num_samples} pixel pertama):\n{sample_text}'
+
+        steps.add(
+            3, 'Ekstrak LSB dari Setiap Pixel',
+            'Header v2 tidak ditemukan, membaca format lama: mengambil bit terakhir (LSB) dari setiap nilai pixel',
+            extraction_detail
+        )
 
-    sample_conv_text = '\n'.join(sample_conversions)
-    more_text = f"\n...dan {len(message) - num_samples} karakter lainnya" if len(message) > num_samples else ""
+        # LANGKAH 4: Cari delimiter
+        if delimiter_index == -1:
+            steps.add(
+                4, 'Cari Delimiter',
+                'Mencari pola delimiter (1111111111111110)',
+                'Delimiter tidak ditemukan - Gambar tidak berisi pesan tersembunyi',
+                status='error'
+            )
+            if return_steps:
+                return "No hidden message found", steps
+            return "No hidden message found"
+
+        steps.add(
+            4, 'Cari Delimiter',
+            'Mencari pola delimiter (1111111111111110)',
+            lambda: f'Delimiter ditemukan pada posisi bit ke-{delimiter_index}\nPanjang pesan (tanpa delimiter): {delimiter_index} bit'
+        )
 
-    # Tampilkan pesan (batasi jika terlalu panjang)
-    message_preview = message if len(message) <= 100 else message[:100] + "..."
+        # LANGKAH 5: Ambil bagian pesan
+        num_chars = delimiter_index // 8
+        message_bytes = packed_message[:num_chars]
 
-    steps.append({
-        'step': 6,
-        'title': 'Konversi Binary ke Text',
-        'description': 'Mengkonversi setiap 8 bit binary ke karakter ASCII',
-        'detail': f'Berhasil mendekode: {len(message)} karakter\n\nContoh konversi ({num_samples} karakter pertama):\n{sample_conv_text}{more_text}\n\nPesan: "{message_preview}"',
-        'status': 'success'
-    })
+        steps.add(
+            5, 'Isolasi Pesan Binary',
+            'Mengambil bit sebelum delimiter sebagai pesan',
+            lambda: f'Panjang pesan binary: {delimiter_index} bit\nJumlah karakter: {num_chars} karakter (setiap karakter = 8 bit)'
+        )
+        next_step = 6
+
+    # LANGKAH 6: Konversi binary ke text (format v2: sesuai flag payload)
+    payload_flags = header['flags'] & _PAYLOAD_FLAGS if header is not None else 0
+    try:
+        message = _decode_payload(message_bytes.tobytes(), payload_flags)
+    except ValueError:
+        if header['flags'] & FLAG_KEYED:
+            raise ValueError("Kunci salah! Payload tidak bisa didekompresi")
+        raise
+
+    def conversion_detail():
+        if payload_flags:
+            if isinstance(message, bytes):
+                result_text = f'Payload biner: {len(message)} byte'
+            else:
+                message_preview = message if len(message) <= 100 else message[:100] + "..."
+                result_text = f'Berhasil mendekode: {len(message)} karakter\n\nPesan: "{message_preview}"'
+            return f'Payload: {_describe_payload_flags(payload_flags)}\nUkuran: {len(message_bytes)} byte tersimpan\n\n{result_text}'
+
+        sample_conversions = []
+        num_samples = min(10, len(message_bytes))  # Tampilkan 10 karakter
+        for char_code in message_bytes[:num_samples]:
+            char = chr(char_code)
+            display_char = char if char.isprintable() else f'[{char_code}]'
+            sample_conversions.append(
+                f"{format(char_code, '08b')} → ASCII {char_code:3d} → '{display_char}'"
+            )
+
+        sample_conv_text = '\n'.join(sample_conversions)
+        more_text = f"\n...dan {len(message) - num_samples} karakter lainnya" if len(message) > num_samples else ""
+
+        # Tampilkan pesan (batasi jika terlalu panjang)
+        message_preview = message if len(message) <= 100 else message[:100] + "..."
+        return f'Berhasil mendekode: {len(message)} karakter\n\nContoh konversi ({num_samples} karakter pertama):\n{sample_conv_text}{more_text}\n\nPesan: "{message_preview}"'
+
+    steps.add(
+        next_step, 'Konversi Binary ke Text',
+        'Mengkonversi setiap 8 bit binary ke karakter ASCII' if not payload_flags else
+        'Mendekompresi payload (jika perlu) lalu mengkonversi byte ke teks UTF-8 / data biner',
+        conversion_detail
+    )
 
     if return_steps:
         return message, steps
     return message
 
 
-def get_max_message_size(image):
-    img_array = np.array(image)
-    total_pixels = img_array.size
+@timed
+def get_max_message_size(image, payload_length=None):
+    # Dihitung dari header gambar saja (Image.open lazy), pixel tidak didekode
+    return get_capacity(image.size, image.mode, payload_length)
+
+
+@timed
+def get_capacity(size, mode, payload_length=None):
+    # Kapasitas dari dimensi dan mode gambar (tanpa pixel sama sekali)
+    try:
+        bands = ImageMode.getmode(mode).bands
+    except KeyError:
+        raise ValueError(f"Mode gambar '{mode}' tidak dikenal!")
+    width, height = size
+    if width <= 0 or height <= 0:
+        raise ValueError("Dimensi gambar harus lebih dari 0")
+    has_alpha = len(bands) > 1 and bands[-1] == 'A'
+    channel_count = len(bands)
+    pixel_count = width * height
+    total_pixels = pixel_count * channel_count
 
     # Setiap pixel bisa menyimpan 1 bit
-    # Dikurangi 16 bit untuk delimiter
-    max_bits = total_pixels - 16
+    # Dikurangi bit header format v2
+    max_bits = max(total_pixels - _HEADER_BITS, 0)
     max_bytes = max_bits // 8
     max_chars = max_bytes
 
+    # Kapasitas untuk setiap kombinasi bit per channel dan pilihan channel
+    payload_pixels = max(pixel_count - _HEADER_BITS // channel_count, 0)
+    modes = []
+    for channels in CHANNEL_SELECTIONS:
+        if channels == 'color' and not has_alpha:
+            continue
+        used_channels = channel_count - 1 if channels == 'color' else channel_count
+        carrier_count = payload_pixels * used_channels
+
+        for bits_per_channel in BITS_PER_CHANNEL:
+            mode = {
+                'bits_per_channel': bits_per_channel,
+                'channels': channels,
+                'max_bits': carrier_count * bits_per_channel,
+                'max_bytes': carrier_count * bits_per_channel // 8
+            }
+            if payload_length is not None:
+                # Jumlah nilai dan pixel yang diubah untuk payload tertentu
+                values_needed = -(-payload_length * 8 // bits_per_channel)
+                mode['fits'] = values_needed <= carrier_count
+                mode['values_touched'] = _HEADER_BITS + values_needed
+                mode['pixels_touched'] = _HEADER_BITS // channel_count + -(-values_needed // used_channels)
+            modes.append(mode)
+
     return {
         'max_bits': max_bits,
         'max_bytes': max_bytes,
         'max_chars': max_chars,
-        'image_dimensions': img_array.shape,
-        'total_pixels': total_pixels
+        'image_dimensions': (height, width, channel_count) if channel_count > 1 else (height, width),
+        'total_pixels': total_pixels,
+        'modes': modes
     }
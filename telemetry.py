@@ -0,0 +1,213 @@
+from bisect import bisect_left
+import functools
+import logging
+import os
+import random
+import threading
+import time
+
+
+# Timing histograms (Prometheus text format on /metrics). Stage timings come
+# from StepTrace: the time between two steps.add() calls is the stage that
+# just finished, so the existing step list doubles as the stage boundaries.
+ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REQUEST_STAGES = ('decode', 'cache', 'queue', 'process', 'encode', 'serialize')  # cache: result cache hits
+
+_local = threading.local()
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labels, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (cumulated when rendered), sum, count
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, [list(counts), total, count])
+                            for labels, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}' if labels else f'{self.name}_sum {total:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}' if labels else f'{self.name}_count {count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+STAGE_SECONDS = Histogram('citra_stage_seconds', 'Time per processing stage (step) of each function',
+                          ('function', 'step', 'stage'))
+FUNCTION_SECONDS = Histogram('citra_function_seconds', 'Total time per steganography/watermarking call',
+                             ('function',))
+REQUEST_STAGE_SECONDS = Histogram('citra_request_stage_seconds',
+                                  'Request time split into decode / cache / queue / process / encode / serialize',
+                                  ('endpoint', 'stage'))
+REQUEST_SECONDS = Histogram('citra_request_seconds', 'Total request time', ('endpoint', 'status'))
+HISTOGRAMS = {histogram.name: histogram for histogram in
+              (STAGE_SECONDS, FUNCTION_SECONDS, REQUEST_STAGE_SECONDS, REQUEST_SECONDS)}
+
+
+def observe(histogram, value, *label_values):
+    # Inside a worker job (capture active) observations are collected and sent
+    # back with the result, so they end up in the parent's histograms
+    captured = getattr(_local, 'captured', None)
+    if captured is not None:
+        captured.append((histogram.name, value, label_values))
+    else:
+        histogram.observe(value, *label_values)
+
+
+def record(samples):
+    for name, value, label_values in samples:
+        HISTOGRAMS[name].observe(value, *label_values)
+
+
+class capture:
+    # with capture() as samples: ... - collects this thread's observations
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'captured', None)
+        _local.captured = []
+        return _local.captured
+
+    def __exit__(self, *exc_info):
+        _local.captured = self._previous
+        return False
+
+
+def current_function():
+    return getattr(_local, 'function', None)
+
+
+def timed(function):
+    # Stage timings of nested calls (e.g. add_invisible_watermark -> encode_message_lsb)
+    # are attributed to the outermost timed function; only its total is recorded
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not ENABLED or current_function() is not None:
+            return function(*args, **kwargs)
+        _local.function = name
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.function = None
+            observe(FUNCTION_SECONDS, time.perf_counter() - start, name)
+
+    return wrapper
+
+
+class RequestTimer:
+    # Splits one request into stages; WorkerPool.run reports the job stages
+    # of the request running on this thread
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = self.mark = time.perf_counter()
+        self.stages = dict.fromkeys(REQUEST_STAGES, 0.0)
+
+    def lap(self, stage):
+        # Time since the previous mark belongs to stage
+        now = time.perf_counter()
+        self.stages[stage] += now - self.mark
+        self.mark = now
+
+    def job_done(self, decode, process, encode):
+        # Job wall time minus the time spent in the worker is queueing/transfer
+        now = time.perf_counter()
+        self.stages['decode'] += decode
+        self.stages['process'] += process
+        self.stages['encode'] += encode
+        self.stages['queue'] += max(0.0, now - self.mark - decode - process - encode)
+        self.mark = now
+
+    def finish(self, status):
+        self.lap('serialize')
+        for stage, seconds in self.stages.items():
+            REQUEST_STAGE_SECONDS.observe(seconds, self.endpoint, stage)
+        REQUEST_SECONDS.observe(self.mark - self.start, self.endpoint, str(status))
+
+
+def start_request(endpoint):
+    _local.request = RequestTimer(endpoint) if ENABLED else None
+    return _local.request
+
+
+def current_request():
+    return getattr(_local, 'request', None)
+
+
+def finish_request(status):
+    timer = current_request()
+    _local.request = None
+    if timer is not None:
+        timer.finish(status)
+
+
+def metric_lines(name, help_text, metric_type, samples):
+    # Plain counters/gauges: samples is a list of (labels dict, value)
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+    return lines
+
+
+def render(extra_lines=()):
+    lines = []
+    for histogram in HISTOGRAMS.values():
+        lines.extend(histogram.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+class SampledFilter(logging.Filter):
+    # Keeps a fraction of the records below WARNING; warnings and errors always pass
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(names, level='WARNING', sample_rate=1.0):
+    # Below the level, logger.info(...) returns before formatting anything
+    for name in names:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.filters = [f for f in logger.filters if not isinstance(f, SampledFilter)]
+        if sample_rate < 1:
+            logger.addFilter(SampledFilter(sample_rate))
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+            logger.addHandler(handler)
@@ -0,0 +1,88 @@
+from collections.abc import Sequence
+import time
+
+import telemetry
+
+
+# Level trace langkah proses:
+#   off     - tidak ada pekerjaan trace sama sekali
+#   summary - hanya judul, deskripsi dan status setiap langkah
+#   full    - termasuk detail (contoh pixel, perhitungan, dsb.)
+TRACE_OFF = 'off'
+TRACE_SUMMARY = 'summary'
+TRACE_FULL = 'full'
+TRACE_LEVELS = (TRACE_OFF, TRACE_SUMMARY, TRACE_FULL)
+
+
+def resolve_trace_level(trace_level, return_steps):
+    # Kompatibel dengan API lama: return_steps=True berarti trace penuh
+    if trace_level is None:
+        return TRACE_FULL if return_steps else TRACE_OFF
+    if trace_level not in TRACE_LEVELS:
+        raise ValueError(
+            f"Trace level '{trace_level}' tidak dikenal! "
+            f"Pilihan: {', '.join(TRACE_LEVELS)}"
+        )
+    return trace_level
+
+
+class StepTrace(Sequence):
+    # Daftar langkah yang dibangun secara lazy: detail (boleh berupa callable)
+    # baru diformat saat langkah tersebut dibaca oleh pemanggil.
+
+    def __init__(self, level=TRACE_FULL):
+        self.level = level
+        self._entries = []
+        self._built = {}
+        # Waktu per tahap: selisih antar steps.add() (juga saat trace off),
+        # dicatat atas nama fungsi teratas yang sedang berjalan
+        self._function = telemetry.current_function()
+        self._mark = time.perf_counter() if self._function else None
+
+    @property
+    def enabled(self):
+        return self.level != TRACE_OFF
+
+    @property
+    def full(self):
+        return self.level == TRACE_FULL
+
+    def add(self, step, title, description, detail='', status='success'):
+        if self._function:
+            now = time.perf_counter()
+            telemetry.observe(telemetry.STAGE_SECONDS, now - self._mark, self._function, step, title)
+            self._mark = now
+        if self.level == TRACE_OFF:
+            return
+        self._entries.append((step, title, description, detail, status))
+
+    def _build(self, index):
+        if index not in self._built:
+            step, title, description, detail, status = self._entries[index]
+            if self.level == TRACE_FULL and callable(detail):
+                detail = detail()
+            elif self.level != TRACE_FULL:
+                detail = ''
+            self._built[index] = {
+                'step': step,
+                'title': title,
+                'description': description,
+                'detail': detail,
+                'status': status
+            }
+        return self._built[index]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._build(i) for i in range(len(self._entries))[index]]
+        if index < 0:
+            index += len(self._entries)
+        if not 0 <= index < len(self._entries):
+            raise IndexError('step index out of range')
+        return self._build(index)
+
+    def to_list(self):
+        return [self._build(i) for i in range(len(self._entries))]
@@ -1,53 +1,240 @@
 from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+import logging
+import math
+import struct
+import threading
 import numpy as np
 
+from tracing import StepTrace, resolve_trace_level
+from telemetry import timed
+from metrics import compare_images  # tetap tersedia lewat modul ini
 
-def add_visible_watermark(image, watermark_text, position='bottom-right', opacity=128, return_steps=False):
-    steps = []
+# Log bertingkat (level dan sampling diatur aplikasi); di bawah level log,
+# logger.info(...) langsung kembali tanpa memformat pesan
+logger = logging.getLogger(__name__)
 
-    # LANGKAH 1: Duplikasi gambar
-    img = image.copy()
-    width, height = img.size
-    steps.append({
-        'step': 1,
-        'title': 'Duplikasi Gambar Asli',
-        'description': 'Membuat salinan gambar untuk preserve gambar original',
-        'detail': f'Ukuran gambar: {width} x {height} pixel\nMode: {img.mode}',
-        'status': 'success'
-    })
-
-    # LANGKAH 2: Buat overlay transparan
-    overlay = Image.new('RGBA', img.size, (255, 255, 255, 0))
-    draw = ImageDraw.Draw(overlay)
-    steps.append({
-        'step': 2,
-        'title': 'Buat Layer Overlay Transparan',
-        'description': 'Membuat layer RGBA transparan untuk menampung watermark',
-        'detail': f'Layer RGBA dibuat dengan ukuran {width}x{height}\nAlpha channel = 0 (transparan penuh)',
-        'status': 'success'
-    })
 
-    # LANGKAH 3: Konfigurasi font
+@lru_cache(maxsize=64)
+def _load_font(font_size):
+    # Font hanya bergantung pada ukuran, jadi dimuat sekali per ukuran
     try:
-        font_size = int(min(width, height) * 0.05)
         font = ImageFont.truetype("arial.ttf", font_size)
         font_info = f"Font: Arial\nSize: {font_size}px (5% dari dimensi terkecil)"
     except:
         font = ImageFont.load_default()
         font_info = "Font: Default system font"
+    return font, font_info
 
-    steps.append({
-        'step': 3,
-        'title': 'Konfigurasi Font',
-        'description': 'Menentukan jenis dan ukuran font untuk watermark',
-        'detail': font_info,
-        'status': 'success'
-    })
 
-    # LANGKAH 4: Hitung posisi
-    bbox = draw.textbbox((0, 0), watermark_text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
+@lru_cache(maxsize=256)
+def _text_size(watermark_text, font_size):
+    font, _ = _load_font(font_size)
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), watermark_text, font=font)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+
+def _text_bbox(watermark_text, font_size, text_position):
+    # Kotak tinta teks (absolut) jika digambar pada text_position
+    font, _ = _load_font(font_size)
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox(text_position, watermark_text, font=font)
+    return (int(math.floor(bbox[0])), int(math.floor(bbox[1])), int(math.ceil(bbox[2])), int(math.ceil(bbox[3])))
+
+
+@lru_cache(maxsize=256)
+def _opacity_lut(opacity):
+    # Tabel alpha baru untuk setiap alpha lama (0-255), dihitung sekali per opacity
+    return tuple(int(p * (opacity / 255.0)) for p in range(256))
+
+
+def _prepare_logo(watermark_image, size, opacity):
+    # Resize logo, konversi ke RGBA dan kalikan alpha dengan opacity
+    watermark = watermark_image.resize(size, Image.Resampling.LANCZOS)
+    if watermark.mode != 'RGBA':
+        watermark = watermark.convert('RGBA')
+
+    alpha = watermark.split()[3]
+    alpha = alpha.point(_opacity_lut(opacity))
+    watermark.putalpha(alpha)
+    return watermark
+
+
+def logo_hash(watermark_image):
+    # Hash isi logo (mode, ukuran, pixel, palette) sebagai kunci cache
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{watermark_image.mode}:{watermark_image.size}'.encode())
+    digest.update(watermark_image.tobytes())
+    palette = watermark_image.getpalette() if watermark_image.mode in ('P', 'PA') else None
+    if palette:
+        digest.update(bytes(palette))
+    return digest.hexdigest()
+
+
+class PreparedLogoCache:
+    # LRU logo siap pakai (sudah resize + RGBA + opacity), dikunci dengan
+    # (hash isi logo, ukuran target, opacity) dan dibatasi total memori.
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=128):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, watermark_image, size, opacity):
+        # Kembalikan (logo, hit); logo disiapkan dan disimpan jika belum ada
+        key = (logo_hash(watermark_image), size, opacity)
+        with self._lock:
+            watermark = self._entries.get(key)
+            if watermark is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return watermark, True
+            self.misses += 1
+
+        watermark = _prepare_logo(watermark_image, size, opacity)
+        entry_bytes = size[0] * size[1] * 4
+        if entry_bytes > self.max_bytes:
+            return watermark, False
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = watermark
+                self._bytes += entry_bytes
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * 4
+                self.evictions += 1
+        return watermark, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# Cache bersama untuk semua pemanggilan add_visible_watermark_image
+logo_cache = PreparedLogoCache()
+
+
+def _working_copy(image):
+    # Salinan gambar untuk ditimpa watermark: RGB/RGBA dipertahankan,
+    # mode lain (L, P, CMYK, ...) dikonversi ke RGB
+    if image.mode in ('RGB', 'RGBA'):
+        return image.copy()
+    return image.convert('RGB')
+
+
+def _composite_region(img, overlay, offset):
+    # Alpha compositing overlay RGBA ke img hanya pada area yang tertutup overlay
+    # (dipotong ke batas gambar). Pixel di luar area tidak disentuh dan mode img tetap.
+    left, top = offset
+    box = (max(left, 0), max(top, 0),
+           min(left + overlay.width, img.width), min(top + overlay.height, img.height))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+
+    region = img.crop(box)
+    if region.mode != 'RGBA':
+        region = region.convert('RGBA')
+    stamp = overlay.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+    region = Image.alpha_composite(region, stamp)
+    img.paste(region if img.mode == 'RGBA' else region.convert(img.mode), box[:2])
+    return box
+
+
+def _paste_stamp(img, stamp, position):
+    # Paste stamp RGBA dengan alpha sebagai mask. Pada gambar RGBA, paste dengan
+    # mask ikut mencampur band alpha tujuan (255 → 191), jadi dipakai alpha
+    # compositing agar alpha gambar asli tetap utuh
+    if img.mode == 'RGBA':
+        _composite_region(img, stamp, position)
+    else:
+        img.paste(stamp, position, stamp)
+
+
+def _tile_pattern(stamp, spacing=None, rotation=30, fillcolor=(0, 0, 0, 0)):
+    # Stamp RGBA diputar sekali lalu ditempatkan pada tile kecil (2 baris,
+    # baris kedua digeser setengah tile) sehingga pola berulang secara diagonal
+    if stamp.width == 0 or stamp.height == 0:
+        raise ValueError("Watermark kosong! Teks atau logo untuk pola tiled tidak boleh kosong")
+    if spacing is not None and spacing < 0:
+        raise ValueError("Jarak (spacing) antar watermark tidak boleh negatif")
+    if rotation:
+        stamp = stamp.rotate(rotation, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=fillcolor)
+    if spacing is None:
+        spacing = max(stamp.width, stamp.height) // 2
+    tile_width, tile_height = stamp.width + spacing, stamp.height + spacing
+
+    stamp_array = np.asarray(stamp.convert('RGBA'))
+    tile = np.zeros((tile_height * 2, tile_width, 4), dtype=np.uint8)
+    tile[:stamp.height, :stamp.width] = stamp_array
+    tile[tile_height:tile_height + stamp.height, :stamp.width] = stamp_array
+    tile[tile_height:] = np.roll(tile[tile_height:], tile_width // 2, axis=1)
+
+    tile_info = {
+        'stamp_size': stamp.size,
+        'tile_size': (tile_width, tile_height),
+        'spacing': spacing,
+        'rotation': rotation
+    }
+    return tile, tile_info
+
+
+def _blend_tiled(img, tile):
+    # Tile dibentangkan sekali menjadi satu pita selebar gambar, lalu pita itu
+    # di-paste (dengan alpha sebagai mask) turun ke bawah secara in-place:
+    # biaya setara satu kali blend full-frame, memori tambahan hanya satu pita
+    width, height = img.size
+    repeat_x = -(-width // tile.shape[1])
+    strip = Image.fromarray(np.ascontiguousarray(np.tile(tile, (1, repeat_x, 1))[:, :width]), 'RGBA')
+    for top in range(0, height, strip.height):
+        _paste_stamp(img, strip, (0, top))
+    return img
+
+
+def _tile_count(tile_info, size):
+    # Perkiraan jumlah stamp yang tampil di gambar
+    tile_width, tile_height = tile_info['tile_size']
+    return -(-size[0] // tile_width) * -(-size[1] // tile_height)
+
+
+@timed
+def add_visible_watermark(image, watermark_text, position='bottom-right', opacity=128, return_steps=False,
+                          trace_level=None, spacing=None, rotation=30):
+    steps = StepTrace(resolve_trace_level(trace_level, return_steps))
+
+    # LANGKAH 1: Duplikasi gambar
+    original_mode = image.mode
+    img = _working_copy(image)
+    width, height = img.size
+    steps.add(
+        1, 'Duplikasi Gambar Asli',
+        'Membuat salinan gambar untuk preserve gambar original',
+        lambda: f'Ukuran gambar: {width} x {height} pixel\nMode: {original_mode}'
+    )
+
+    # Font dan posisi teks dihitung lebih dulu: overlay hanya seukuran area teks
+    # (font di-cache per ukuran, ukuran teks per teks dan ukuran font)
+    font_size = int(min(width, height) * 0.05)
+    font, font_info = _load_font(font_size)
+    text_width, text_height = _text_size(watermark_text, font_size)
 
     margin = 20
     positions = {
@@ -58,169 +245,189 @@ def add_visible_watermark(image, watermark_text, position='bottom-right', opacit
         'center': ((width - text_width) // 2, (height - text_height) // 2)
     }
 
+    # position='tiled': teks diulang diagonal di seluruh gambar (spacing, rotation)
+    tiled = position == 'tiled'
     text_position = positions.get(position, positions['bottom-right'])
-    # Hitung detail posisi untuk semua opsi
-    all_positions = []
-    for pos_name, pos_coord in positions.items():
-        marker = " ← DIPILIH" if pos_name == position else ""
-        all_positions.append(f"  {pos_name:15s} : {pos_coord}{marker}")
-
-    positions_detail = '\n'.join(all_positions)
-
-    steps.append({
-        'step': 4,
-        'title': 'Hitung Posisi Watermark',
-        'description': 'Menentukan koordinat penempatan watermark pada gambar',
-        'detail': f'Dimensi teks: {text_width} x {text_height} pixel\nMargin dari tepi: {margin}px\n\nPilihan posisi tersedia:\n{positions_detail}\n\nKoordinat final: {text_position}',
-        'status': 'success'
-    })
+    text_box = _text_bbox(watermark_text, font_size, text_position)
+
+    # LANGKAH 2: Buat overlay transparan seukuran area teks saja
+    overlay = Image.new('RGBA', (text_box[2] - text_box[0], text_box[3] - text_box[1]), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(overlay)
+    steps.add(
+        2, 'Buat Layer Overlay Transparan',
+        'Membuat layer RGBA transparan seukuran area teks untuk menampung watermark',
+        lambda: f'Layer RGBA dibuat dengan ukuran {overlay.width}x{overlay.height} pada {text_box[:2]}\nAlpha channel = 0 (transparan penuh)'
+    )
+
+    # LANGKAH 3: Konfigurasi font
+    steps.add(
+        3, 'Konfigurasi Font',
+        'Menentukan jenis dan ukuran font untuk watermark',
+        font_info
+    )
+
+    # LANGKAH 4: Hitung posisi
+    def position_detail():
+        # Hitung detail posisi untuk semua opsi
+        all_positions = []
+        for pos_name, pos_coord in positions.items():
+            marker = " ← DIPILIH" if pos_name == position else ""
+            all_positions.append(f"  {pos_name:15s} : {pos_coord}{marker}")
+
+        positions_detail = '\n'.join(all_positions)
+        final_position = 'tiled (diulang diagonal di seluruh gambar)' if tiled else text_position
+        return f'Dimensi teks: {text_width} x {text_height} pixel\nMargin dari tepi: {margin}px\n\nPilihan posisi tersedia:\n{positions_detail}\n\nKoordinat final: {final_position}'
+
+    steps.add(
+        4, 'Hitung Posisi Watermark',
+        'Menentukan koordinat penempatan watermark pada gambar',
+        position_detail
+    )
 
     # LANGKAH 5: Gambar teks
-    draw.text(text_position, watermark_text, fill=(255, 255, 255, opacity), font=font)
+    draw.text((text_position[0] - text_box[0], text_position[1] - text_box[1]), watermark_text,
+              fill=(255, 255, 255, opacity), font=font)
     opacity_percent = (opacity / 255) * 100
-    steps.append({
-        'step': 5,
-        'title': 'Gambar Teks Watermark',
-        'description': 'Menggambar teks pada layer overlay dengan opacity',
-        'detail': f'Teks: "{watermark_text}"\nWarna: Putih (RGB 255,255,255)\nOpacity: {opacity}/255 ({opacity_percent:.1f}%)',
-        'status': 'success'
-    })
-
-    # LANGKAH 6: Alpha compositing
-    if img.mode != 'RGBA':
-        img = img.convert('RGBA')
-
-    # Ambil sample pixel SEBELUM compositing
-    sample_x = text_position[0] + text_width // 2
-    sample_y = text_position[1] + text_height // 2
-
-    # Pastikan koordinat dalam bounds
-    sample_x = min(max(sample_x, 0), width - 1)
-    sample_y = min(max(sample_y, 0), height - 1)
-
-    before_pixel = img.getpixel((sample_x, sample_y))
-    overlay_pixel = overlay.getpixel((sample_x, sample_y))
-
-    watermarked = Image.alpha_composite(img, overlay)
-
-    # Ambil sample pixel SESUDAH compositing
-    after_pixel = watermarked.getpixel((sample_x, sample_y))
-
-    # Kalkulasi alpha blending dengan pixel REAL
-    alpha_normalized = opacity / 255.0
-    examples = []
-    examples.append(f"Perhitungan REAL pada koordinat ({sample_x}, {sample_y}):")
-    examples.append(f"")
-    examples.append(f"SEBELUM (Background):")
-    examples.append(f"  RGB({before_pixel[0]}, {before_pixel[1]}, {before_pixel[2]})")
-    examples.append(f"")
-    examples.append(f"WATERMARK (Foreground):")
-    examples.append(f"  RGB(255, 255, 255) dengan alpha={opacity}/255 ({opacity_percent:.1f}%)")
-    examples.append(f"")
-    examples.append(f"RUMUS: Result = Foreground × α + Background × (1-α)")
-    examples.append(f"")
-    examples.append(f"  R = 255 × {alpha_normalized:.3f} + {before_pixel[0]} × {1-alpha_normalized:.3f}")
-    examples.append(f"    = {255*alpha_normalized:.2f} + {before_pixel[0]*(1-alpha_normalized):.2f}")
-    examples.append(f"    = {255*alpha_normalized + before_pixel[0]*(1-alpha_normalized):.2f}")
-    examples.append(f"")
-    examples.append(f"  G = 255 × {alpha_normalized:.3f} + {before_pixel[1]} × {1-alpha_normalized:.3f}")
-    examples.append(f"    = {255*alpha_normalized:.2f} + {before_pixel[1]*(1-alpha_normalized):.2f}")
-    examples.append(f"    = {255*alpha_normalized + before_pixel[1]*(1-alpha_normalized):.2f}")
-    examples.append(f"")
-    examples.append(f"  B = 255 × {alpha_normalized:.3f} + {before_pixel[2]} × {1-alpha_normalized:.3f}")
-    examples.append(f"    = {255*alpha_normalized:.2f} + {before_pixel[2]*(1-alpha_normalized):.2f}")
-    examples.append(f"    = {255*alpha_normalized + before_pixel[2]*(1-alpha_normalized):.2f}")
-    examples.append(f"")
-    examples.append(f"SESUDAH (Hasil Alpha Compositing):")
-    examples.append(f"  Teoritis: RGB({int(255*alpha_normalized + before_pixel[0]*(1-alpha_normalized))}, {int(255*alpha_normalized + before_pixel[1]*(1-alpha_normalized))}, {int(255*alpha_normalized + before_pixel[2]*(1-alpha_normalized))})")
-    examples.append(f"  Aktual:   RGB({after_pixel[0]}, {after_pixel[1]}, {after_pixel[2]})")
-    examples.append(f"")
-    examples.append(f"Perubahan nilai:")
-    examples.append(f"  ΔR = {after_pixel[0]} - {before_pixel[0]} = {after_pixel[0] - before_pixel[0]:+d}")
-    examples.append(f"  ΔG = {after_pixel[1]} - {before_pixel[1]} = {after_pixel[1] - before_pixel[1]:+d}")
-    examples.append(f"  ΔB = {after_pixel[2]} - {before_pixel[2]} = {after_pixel[2] - before_pixel[2]:+d}")
-
-    example_text = '\n'.join(examples)
-
-    steps.append({
-        'step': 6,
-        'title': 'Alpha Compositing',
-        'description': 'Menggabungkan layer overlay dengan gambar base',
-        'detail': f'Formula per pixel: Result = Foreground × α + Background × (1-α)\n\n{example_text}\n\nLayer overlay berhasil digabungkan dengan gambar base',
-        'status': 'success'
-    })
-
-    # LANGKAH 7: Konversi ke RGB
-    result = watermarked.convert('RGB')
-    steps.append({
-        'step': 7,
-        'title': 'Konversi ke RGB',
-        'description': 'Mengkonversi hasil dari RGBA ke RGB untuk kompatibilitas',
-        'detail': f'Mode: RGBA → RGB\nGambar siap disimpan (size: {result.size})',
-        'status': 'success'
-    })
+    steps.add(
+        5, 'Gambar Teks Watermark',
+        'Menggambar teks pada layer overlay dengan opacity',
+        lambda: f'Teks: "{watermark_text}"\nWarna: Putih (RGB 255,255,255)\nOpacity: {opacity}/255 ({opacity_percent:.1f}%)'
+    )
+
+    # LANGKAH 6: Alpha compositing hanya pada area overlay (mode tiled: overlay
+    # diputar sekali menjadi tile lalu di-blend di seluruh gambar)
+    # Ambil sample pixel di tengah teks (hanya untuk trace penuh);
+    # compositing mengubah img, jadi pixel SEBELUM harus diambil sekarang
+    if tiled:
+        tile, tile_info = _tile_pattern(overlay, spacing, rotation, fillcolor=(255, 255, 255, 0))
+        sample_x = min(tile_info['stamp_size'][0] // 2, width - 1)
+        sample_y = min(tile_info['stamp_size'][1] // 2, height - 1)
+    else:
+        sample_x = min(max(text_position[0] + text_width // 2, 0), width - 1)
+        sample_y = min(max(text_position[1] + text_height // 2, 0), height - 1)
+    if steps.full:
+        before_pixel = img.getpixel((sample_x, sample_y))
+
+    if tiled:
+        img = _blend_tiled(img, tile)
+        composite_box = (0, 0, width, height)
+    else:
+        composite_box = _composite_region(img, overlay, text_box[:2])
+
+    if steps.full:
+        after_pixel = img.getpixel((sample_x, sample_y))
+
+    def compositing_detail():
+        # Kalkulasi alpha blending dengan pixel REAL
+        alpha_normalized = opacity / 255.0
+        examples = []
+        examples.append(f"Perhitungan REAL pada koordinat ({sample_x}, {sample_y}):")
+        examples.append(f"")
+        examples.append(f"SEBELUM (Background):")
+        examples.append(f"  RGB({before_pixel[0]}, {before_pixel[1]}, {before_pixel[2]})")
+        examples.append(f"")
+        examples.append(f"WATERMARK (Foreground):")
+        examples.append(f"  RGB(255, 255, 255) dengan alpha={opacity}/255 ({opacity_percent:.1f}%)")
+        examples.append(f"")
+        examples.append(f"RUMUS: Result = Foreground × α + Background × (1-α)")
+        examples.append(f"")
+        examples.append(f"  R = 255 × {alpha_normalized:.3f} + {before_pixel[0]} × {1-alpha_normalized:.3f}")
+        examples.append(f"    = {255*alpha_normalized:.2f} + {before_pixel[0]*(1-alpha_normalized):.2f}")
+        examples.append(f"    = {255*alpha_normalized + before_pixel[0]*(1-alpha_normalized):.2f}")
+        examples.append(f"")
+        examples.append(f"  G = 255 × {alpha_normalized:.3f} + {before_pixel[1]} × {1-alpha_normalized:.3f}")
+        examples.append(f"    = {255*alpha_normalized:.2f} + {before_pixel[1]*(1-alpha_normalized):.2f}")
+        examples.append(f"    = {255*alpha_normalized + before_pixel[1]*(1-alpha_normalized):.2f}")
+        examples.append(f"")
+        examples.append(f"  B = 255 × {alpha_normalized:.3f} + {before_pixel[2]} × {1-alpha_normalized:.3f}")
+        examples.append(f"    = {255*alpha_normalized:.2f} + {before_pixel[2]*(1-alpha_normalized):.2f}")
+        examples.append(f"    = {255*alpha_normalized + before_pixel[2]*(1-alpha_normalized):.2f}")
+        examples.append(f"")
+        examples.append(f"SESUDAH (Hasil Alpha Compositing):")
+        examples.append(f"  Teoritis: RGB({int(255*alpha_normalized + before_pixel[0]*(1-alpha_normalized))}, {int(255*alpha_normalized + before_pixel[1]*(1-alpha_normalized))}, {int(255*alpha_normalized + before_pixel[2]*(1-alpha_normalized))})")
+        examples.append(f"  Aktual:   RGB({after_pixel[0]}, {after_pixel[1]}, {after_pixel[2]})")
+        examples.append(f"")
+        examples.append(f"Perubahan nilai:")
+        examples.append(f"  ΔR = {after_pixel[0]} - {before_pixel[0]} = {after_pixel[0] - before_pixel[0]:+d}")
+        examples.append(f"  ΔG = {after_pixel[1]} - {before_pixel[1]} = {after_pixel[1] - before_pixel[1]:+d}")
+        examples.append(f"  ΔB = {after_pixel[2]} - {before_pixel[2]} = {after_pixel[2] - before_pixel[2]:+d}")
+
+        example_text = '\n'.join(examples)
+        tile_text = ''
+        if tiled:
+            tile_text = (f"\nTile: teks {tile_info['stamp_size'][0]}x{tile_info['stamp_size'][1]} diputar {tile_info['rotation']}°, "
+                         f"jarak {tile_info['spacing']}px, ±{_tile_count(tile_info, (width, height))} stamp")
+        return f'Formula per pixel: Result = Foreground × α + Background × (1-α)\n\n{example_text}\n\nLayer overlay berhasil digabungkan dengan gambar base\nArea yang diproses: {composite_box}{tile_text}'
+
+    steps.add(
+        6, 'Alpha Compositing',
+        'Menggabungkan layer overlay dengan gambar base (hanya area teks)',
+        compositing_detail
+    )
+
+    # LANGKAH 7: Hasil tetap dalam mode kerja (RGB/RGBA), tanpa konversi penuh
+    result = img
+    steps.add(
+        7, f'Hasil dalam Mode {result.mode}',
+        f'Gambar {result.mode} dipertahankan (RGBA tetap RGBA, mode lain menjadi RGB); '
+        'hanya area teks yang diubah, pixel lain tidak disentuh',
+        lambda: f'Mode: {original_mode} → {result.mode}\nGambar siap disimpan (size: {result.size})'
+    )
 
     if return_steps:
         return result, steps
     return result
 
 
+@timed
 def add_visible_watermark_image(base_image, watermark_image, position='bottom-right',
-                                 opacity=128, scale=0.2, return_steps=False):
-    steps = []
+                                 opacity=128, scale=0.2, return_steps=False, trace_level=None,
+                                 prepared_logos=None, spacing=None, rotation=30):
+    steps = StepTrace(resolve_trace_level(trace_level, return_steps))
 
     # LANGKAH 1: Duplikasi gambar base
-    img = base_image.copy()
+    original_mode = base_image.mode
+    img = _working_copy(base_image)
     width, height = img.size
-    steps.append({
-        'step': 1,
-        'title': 'Duplikasi Gambar Base',
-        'description': 'Membuat salinan gambar utama',
-        'detail': f'Ukuran gambar: {width} x {height} pixel\nMode: {img.mode}',
-        'status': 'success'
-    })
-
-    # LANGKAH 2-3: Resize logo
+    steps.add(
+        1, 'Duplikasi Gambar Base',
+        'Membuat salinan gambar utama',
+        lambda: f'Ukuran gambar: {width} x {height} pixel\nMode: {original_mode}'
+    )
+
+    # LANGKAH 2-5: Siapkan logo (resize, RGBA, opacity).
+    # Logo siap pakai diambil dari logo_cache (per isi logo, ukuran dan opacity);
+    # prepared_logos (opsional) menyimpan logo per ukuran untuk satu batch.
     wm_width = int(width * scale)
-    watermark = watermark_image.copy()
-    wm_aspect = watermark.width / watermark.height
+    wm_aspect = watermark_image.width / watermark_image.height
     wm_height = int(wm_width / wm_aspect)
-    watermark = watermark.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
-
-    scale_percent = scale * 100
-    steps.append({
-        'step': 2,
-        'title': 'Resize Logo dengan Aspect Ratio',
-        'description': 'Mengubah ukuran logo berdasarkan skala yang dipilih',
-        'detail': f'Ukuran original: {watermark_image.width} x {watermark_image.height}\nSkala: {scale_percent:.0f}% dari lebar gambar base\nUkuran baru: {wm_width} x {wm_height}\nAspect ratio: {wm_aspect:.2f}',
-        'status': 'success'
-    })
-
-    # LANGKAH 4: Konversi ke RGBA
-    if watermark.mode != 'RGBA':
-        watermark = watermark.convert('RGBA')
 
-    steps.append({
-        'step': 3,
-        'title': 'Konversi Logo ke RGBA',
-        'description': 'Memastikan logo memiliki alpha channel untuk transparansi',
-        'detail': f'Mode logo: {watermark.mode}\nAlpha channel siap untuk opacity adjustment',
-        'status': 'success'
-    })
-
-    # LANGKAH 5: Sesuaikan opacity
-    alpha = watermark.split()[3]
-    alpha = alpha.point(lambda p: int(p * (opacity / 255.0)))
-    watermark.putalpha(alpha)
+    logo_key = (wm_width, wm_height, opacity)
+    watermark = prepared_logos.get(logo_key) if prepared_logos is not None else None
+    cache_hit = watermark is not None
+    if watermark is None:
+        watermark, cache_hit = logo_cache.get(watermark_image, (wm_width, wm_height), opacity)
+        if prepared_logos is not None:
+            prepared_logos[logo_key] = watermark
+
+    steps.add(
+        2, 'Resize Logo dengan Aspect Ratio',
+        'Mengubah ukuran logo berdasarkan skala yang dipilih',
+        lambda: f'Ukuran original: {watermark_image.width} x {watermark_image.height}\nSkala: {scale * 100:.0f}% dari lebar gambar base\nUkuran baru: {wm_width} x {wm_height}\nAspect ratio: {wm_aspect:.2f}\nCache logo: {"hit (tanpa resize ulang)" if cache_hit else "miss"}'
+    )
+
+    steps.add(
+        3, 'Konversi Logo ke RGBA',
+        'Memastikan logo memiliki alpha channel untuk transparansi',
+        lambda: f'Mode logo: {watermark.mode}\nAlpha channel siap untuk opacity adjustment'
+    )
 
     opacity_percent = (opacity / 255) * 100
-    steps.append({
-        'step': 4,
-        'title': 'Sesuaikan Opacity Logo',
-        'description': 'Mengalikan alpha channel dengan faktor opacity',
-        'detail': f'Opacity: {opacity}/255 ({opacity_percent:.1f}%)\nFormula: new_alpha = original_alpha × ({opacity}/255)',
-        'status': 'success'
-    })
+    steps.add(
+        4, 'Sesuaikan Opacity Logo',
+        'Mengalikan alpha channel dengan faktor opacity',
+        lambda: f'Opacity: {opacity}/255 ({opacity_percent:.1f}%)\nFormula: new_alpha = original_alpha × ({opacity}/255)'
+    )
 
     # LANGKAH 6: Hitung posisi
     margin = 20
@@ -232,176 +439,405 @@ def add_visible_watermark_image(base_image, watermark_image, position='bottom-ri
         'center': ((width - wm_width) // 2, (height - wm_height) // 2)
     }
 
+    # position='tiled': logo diulang diagonal di seluruh gambar (spacing, rotation)
+    tiled = position == 'tiled'
     paste_position = positions.get(position, positions['bottom-right'])
-    # Hitung detail posisi untuk semua opsi
-    all_logo_positions = []
-    for pos_name, pos_coord in positions.items():
-        marker = " ← DIPILIH" if pos_name == position else ""
-        all_logo_positions.append(f"  {pos_name:15s} : {pos_coord}{marker}")
-
-    logo_positions_detail = '\n'.join(all_logo_positions)
-
-    steps.append({
-        'step': 5,
-        'title': 'Hitung Posisi Paste',
-        'description': 'Menentukan koordinat penempatan logo pada gambar',
-        'detail': f'Ukuran logo setelah resize: {wm_width} x {wm_height} pixel\nMargin dari tepi: {margin}px\n\nPilihan posisi tersedia:\n{logo_positions_detail}\n\nKoordinat final: {paste_position}',
-        'status': 'success'
-    })
-
-    # LANGKAH 7-8: Paste logo
-    if img.mode != 'RGBA':
-        img = img.convert('RGBA')
-
-    # Ambil sample pixel SEBELUM paste (di tengah area logo)
-    sample_logo_x = paste_position[0] + wm_width // 2
-    sample_logo_y = paste_position[1] + wm_height // 2
-
-    # Pastikan koordinat dalam bounds
-    sample_logo_x = min(max(sample_logo_x, 0), width - 1)
-    sample_logo_y = min(max(sample_logo_y, 0), height - 1)
-
-    before_logo_pixel = img.getpixel((sample_logo_x, sample_logo_y))
-
-    # Ambil pixel logo pada posisi yang sama (koordinat relatif)
-    logo_sample_x = sample_logo_x - paste_position[0]
-    logo_sample_y = sample_logo_y - paste_position[1]
-    logo_pixel = watermark.getpixel((logo_sample_x, logo_sample_y))
-
-    img.paste(watermark, paste_position, watermark)
-
-    # Ambil sample pixel SESUDAH paste
-    after_logo_pixel = img.getpixel((sample_logo_x, sample_logo_y))
-
-    # Kalkulasi alpha blending dengan pixel REAL dari logo
-    logo_alpha = logo_pixel[3] if len(logo_pixel) == 4 else 255
-    alpha_normalized = logo_alpha / 255.0
-
-    logo_examples = []
-    logo_examples.append(f"Perhitungan REAL pada koordinat ({sample_logo_x}, {sample_logo_y}):")
-    logo_examples.append(f"")
-    logo_examples.append(f"SEBELUM (Background):")
-    logo_examples.append(f"  RGB({before_logo_pixel[0]}, {before_logo_pixel[1]}, {before_logo_pixel[2]})")
-    logo_examples.append(f"")
-    logo_examples.append(f"LOGO (Foreground):")
-    logo_examples.append(f"  RGBA({logo_pixel[0]}, {logo_pixel[1]}, {logo_pixel[2]}, {logo_alpha})")
-    logo_examples.append(f"  Opacity setting: {opacity}/255 ({opacity_percent:.1f}%)")
-    logo_examples.append(f"  Alpha efektif: {logo_alpha}/255 ({logo_alpha/255*100:.1f}%)")
-    logo_examples.append(f"")
-    logo_examples.append(f"RUMUS: Result = Logo × α + Background × (1-α)")
-    logo_examples.append(f"")
-    logo_examples.append(f"  R = {logo_pixel[0]} × {alpha_normalized:.3f} + {before_logo_pixel[0]} × {1-alpha_normalized:.3f}")
-    logo_examples.append(f"    = {logo_pixel[0]*alpha_normalized:.2f} + {before_logo_pixel[0]*(1-alpha_normalized):.2f}")
-    logo_examples.append(f"    = {logo_pixel[0]*alpha_normalized + before_logo_pixel[0]*(1-alpha_normalized):.2f}")
-    logo_examples.append(f"")
-    logo_examples.append(f"  G = {logo_pixel[1]} × {alpha_normalized:.3f} + {before_logo_pixel[1]} × {1-alpha_normalized:.3f}")
-    logo_examples.append(f"    = {logo_pixel[1]*alpha_normalized:.2f} + {before_logo_pixel[1]*(1-alpha_normalized):.2f}")
-    logo_examples.append(f"    = {logo_pixel[1]*alpha_normalized + before_logo_pixel[1]*(1-alpha_normalized):.2f}")
-    logo_examples.append(f"")
-    logo_examples.append(f"  B = {logo_pixel[2]} × {alpha_normalized:.3f} + {before_logo_pixel[2]} × {1-alpha_normalized:.3f}")
-    logo_examples.append(f"    = {logo_pixel[2]*alpha_normalized:.2f} + {before_logo_pixel[2]*(1-alpha_normalized):.2f}")
-    logo_examples.append(f"    = {logo_pixel[2]*alpha_normalized + before_logo_pixel[2]*(1-alpha_normalized):.2f}")
-    logo_examples.append(f"")
-    logo_examples.append(f"SESUDAH (Hasil Alpha Blending):")
-    logo_examples.append(f"  Teoritis: RGB({int(logo_pixel[0]*alpha_normalized + before_logo_pixel[0]*(1-alpha_normalized))}, {int(logo_pixel[1]*alpha_normalized + before_logo_pixel[1]*(1-alpha_normalized))}, {int(logo_pixel[2]*alpha_normalized + before_logo_pixel[2]*(1-alpha_normalized))})")
-    logo_examples.append(f"  Aktual:   RGB({after_logo_pixel[0]}, {after_logo_pixel[1]}, {after_logo_pixel[2]})")
-    logo_examples.append(f"")
-    logo_examples.append(f"Perubahan nilai:")
-    logo_examples.append(f"  ΔR = {after_logo_pixel[0]} - {before_logo_pixel[0]} = {after_logo_pixel[0] - before_logo_pixel[0]:+d}")
-    logo_examples.append(f"  ΔG = {after_logo_pixel[1]} - {before_logo_pixel[1]} = {after_logo_pixel[1] - before_logo_pixel[1]:+d}")
-    logo_examples.append(f"  ΔB = {after_logo_pixel[2]} - {before_logo_pixel[2]} = {after_logo_pixel[2] - before_logo_pixel[2]:+d}")
-    logo_examples.append(f"")
-    logo_examples.append(f"Catatan:")
-    logo_examples.append(f"  - Pixel logo dengan alpha=0 (transparan) → background tetap terlihat")
-    logo_examples.append(f"  - Pixel logo dengan alpha=255 (opaque) → logo sepenuhnya terlihat")
-    logo_examples.append(f"  - Nilai alpha menengah → blending antara logo dan background")
-
-    logo_example_text = '\n'.join(logo_examples)
-
-    steps.append({
-        'step': 6,
-        'title': 'Paste Logo dengan Alpha Blending',
-        'description': 'Menempelkan logo pada gambar menggunakan alpha channel sebagai mask',
-        'detail': f'Logo di-paste pada koordinat {paste_position}\nUkuran area: {wm_width} x {wm_height} pixel\n\n{logo_example_text}',
-        'status': 'success'
-    })
-
-    # LANGKAH 9: Konversi ke RGB
-    result = img.convert('RGB')
-    steps.append({
-        'step': 7,
-        'title': 'Konversi ke RGB',
-        'description': 'Mengkonversi hasil dari RGBA ke RGB untuk kompatibilitas',
-        'detail': f'Mode: RGBA → RGB\nGambar siap disimpan (size: {result.size})',
-        'status': 'success'
-    })
+
+    def position_detail():
+        # Hitung detail posisi untuk semua opsi
+        all_logo_positions = []
+        for pos_name, pos_coord in positions.items():
+            marker = " ← DIPILIH" if pos_name == position else ""
+            all_logo_positions.append(f"  {pos_name:15s} : {pos_coord}{marker}")
+
+        logo_positions_detail = '\n'.join(all_logo_positions)
+        final_position = 'tiled (diulang diagonal di seluruh gambar)' if tiled else paste_position
+        return f'Ukuran logo setelah resize: {wm_width} x {wm_height} pixel\nMargin dari tepi: {margin}px\n\nPilihan posisi tersedia:\n{logo_positions_detail}\n\nKoordinat final: {final_position}'
+
+    steps.add(
+        5, 'Hitung Posisi Paste',
+        'Menentukan koordinat penempatan logo pada gambar',
+        position_detail
+    )
+
+    # LANGKAH 7-8: Paste logo; paste dengan mask hanya menyentuh area logo,
+    # jadi gambar RGB tidak perlu dikonversi ke RGBA. Mode tiled: logo diputar
+    # sekali menjadi tile lalu di-blend di seluruh gambar.
+    # Ambil sample pixel di tengah area logo (hanya untuk trace penuh);
+    # paste mengubah img, jadi pixel SEBELUM harus diambil sekarang
+    if tiled:
+        tile, tile_info = _tile_pattern(watermark, spacing, rotation)
+        sample_logo_x = min(tile_info['stamp_size'][0] // 2, width - 1)
+        sample_logo_y = min(tile_info['stamp_size'][1] // 2, height - 1)
+    else:
+        sample_logo_x = min(max(paste_position[0] + wm_width // 2, 0), width - 1)
+        sample_logo_y = min(max(paste_position[1] + wm_height // 2, 0), height - 1)
+    if steps.full:
+        before_logo_pixel = img.getpixel((sample_logo_x, sample_logo_y))
+
+        # Ambil pixel logo pada posisi yang sama (koordinat relatif)
+        if tiled:
+            logo_pixel = tuple(int(v) for v in tile[sample_logo_y % tile.shape[0], sample_logo_x % tile.shape[1]])
+        else:
+            logo_pixel = watermark.getpixel((sample_logo_x - paste_position[0],
+                                             sample_logo_y - paste_position[1]))
+
+    if tiled:
+        img = _blend_tiled(img, tile)
+    else:
+        _paste_stamp(img, watermark, paste_position)
+
+    if steps.full:
+        after_logo_pixel = img.getpixel((sample_logo_x, sample_logo_y))
+
+    def paste_detail():
+        # Kalkulasi alpha blending dengan pixel REAL dari logo
+        logo_alpha = logo_pixel[3] if len(logo_pixel) == 4 else 255
+        alpha_normalized = logo_alpha / 255.0
+
+        logo_examples = []
+        logo_examples.append(f"Perhitungan REAL pada koordinat ({sample_logo_x}, {sample_logo_y}):")
+        logo_examples.append(f"")
+        logo_examples.append(f"SEBELUM (Background):")
+        logo_examples.append(f"  RGB({before_logo_pixel[0]}, {before_logo_pixel[1]}, {before_logo_pixel[2]})")
+        logo_examples.append(f"")
+        logo_examples.append(f"LOGO (Foreground):")
+        logo_examples.append(f"  RGBA({logo_pixel[0]}, {logo_pixel[1]}, {logo_pixel[2]}, {logo_alpha})")
+        logo_examples.append(f"  Opacity setting: {opacity}/255 ({opacity_percent:.1f}%)")
+        logo_examples.append(f"  Alpha efektif: {logo_alpha}/255 ({logo_alpha/255*100:.1f}%)")
+        logo_examples.append(f"")
+        logo_examples.append(f"RUMUS: Result = Logo × α + Background × (1-α)")
+        logo_examples.append(f"")
+        logo_examples.append(f"  R = {logo_pixel[0]} × {alpha_normalized:.3f} + {before_logo_pixel[0]} × {1-alpha_normalized:.3f}")
+        logo_examples.append(f"    = {logo_pixel[0]*alpha_normalized:.2f} + {before_logo_pixel[0]*(1-alpha_normalized):.2f}")
+        logo_examples.append(f"    = {logo_pixel[0]*alpha_normalized + before_logo_pixel[0]*(1-alpha_normalized):.2f}")
+        logo_examples.append(f"")
+        logo_examples.append(f"  G = {logo_pixel[1]} × {alpha_normalized:.3f} + {before_logo_pixel[1]} × {1-alpha_normalized:.3f}")
+        logo_examples.append(f"    = {logo_pixel[1]*alpha_normalized:.2f} + {before_logo_pixel[1]*(1-alpha_normalized):.2f}")
+        logo_examples.append(f"    = {logo_pixel[1]*alpha_normalized + before_logo_pixel[1]*(1-alpha_normalized):.2f}")
+        logo_examples.append(f"")
+        logo_examples.append(f"  B = {logo_pixel[2]} × {alpha_normalized:.3f} + {before_logo_pixel[2]} × {1-alpha_normalized:.3f}")
+        logo_examples.append(f"    = {logo_pixel[2]*alpha_normalized:.2f} + {before_logo_pixel[2]*(1-alpha_normalized):.2f}")
+        logo_examples.append(f"    = {logo_pixel[2]*alpha_normalized + before_logo_pixel[2]*(1-alpha_normalized):.2f}")
+        logo_examples.append(f"")
+        logo_examples.append(f"SESUDAH (Hasil Alpha Blending):")
+        logo_examples.append(f"  Teoritis: RGB({int(logo_pixel[0]*alpha_normalized + before_logo_pixel[0]*(1-alpha_normalized))}, {int(logo_pixel[1]*alpha_normalized + before_logo_pixel[1]*(1-alpha_normalized))}, {int(logo_pixel[2]*alpha_normalized + before_logo_pixel[2]*(1-alpha_normalized))})")
+        logo_examples.append(f"  Aktual:   RGB({after_logo_pixel[0]}, {after_logo_pixel[1]}, {after_logo_pixel[2]})")
+        logo_examples.append(f"")
+        logo_examples.append(f"Perubahan nilai:")
+        logo_examples.append(f"  ΔR = {after_logo_pixel[0]} - {before_logo_pixel[0]} = {after_logo_pixel[0] - before_logo_pixel[0]:+d}")
+        logo_examples.append(f"  ΔG = {after_logo_pixel[1]} - {before_logo_pixel[1]} = {after_logo_pixel[1] - before_logo_pixel[1]:+d}")
+        logo_examples.append(f"  ΔB = {after_logo_pixel[2]} - {before_logo_pixel[2]} = {after_logo_pixel[2] - before_logo_pixel[2]:+d}")
+        logo_examples.append(f"")
+        logo_examples.append(f"Catatan:")
+        logo_examples.append(f"  - Pixel logo dengan alpha=0 (transparan) → background tetap terlihat")
+        logo_examples.append(f"  - Pixel logo dengan alpha=255 (opaque) → logo sepenuhnya terlihat")
+        logo_examples.append(f"  - Nilai alpha menengah → blending antara logo dan background")
+
+        logo_example_text = '\n'.join(logo_examples)
+        if tiled:
+            return (f"Logo diulang di seluruh gambar: diputar {tile_info['rotation']}°, jarak {tile_info['spacing']}px, "
+                    f"±{_tile_count(tile_info, (width, height))} stamp\nUkuran area: {width} x {height} pixel\n\n{logo_example_text}")
+        return f'Logo di-paste pada koordinat {paste_position}\nUkuran area: {wm_width} x {wm_height} pixel\n\n{logo_example_text}'
+
+    steps.add(
+        6, 'Paste Logo dengan Alpha Blending',
+        'Menempelkan logo pada gambar menggunakan alpha channel sebagai mask',
+        paste_detail
+    )
+
+    # LANGKAH 9: Hasil tetap dalam mode kerja (RGB/RGBA), tanpa konversi penuh
+    result = img
+    steps.add(
+        7, f'Hasil dalam Mode {result.mode}',
+        f'Logo di-blend langsung pada gambar {result.mode} (RGBA tetap RGBA, mode lain menjadi RGB); '
+        'pixel di luar area logo tidak disentuh',
+        lambda: f'Mode: {original_mode} → {result.mode}\nGambar siap disimpan (size: {result.size})'
+    )
 
     if return_steps:
         return result, steps
     return result
 
 
-def add_invisible_watermark(image, watermark_text):
-    print(f"[WATERMARK INVISIBLE] Menambahkan watermark: '{watermark_text}'")
+# Watermark invisible robust (domain frekuensi): bit disisipkan ke koefisien
+# mid-band DCT blok 8x8 dari luminance dengan QIM, sehingga tahan kompresi JPEG
+INVISIBLE_METHODS = ('lsb', 'dct')
+DCT_MAGIC = b'\x89D'
+DCT_STEP = 24                                  # langkah kuantisasi QIM
+DCT_BAND = ((0, 3), (1, 2), (2, 1), (3, 0))    # koefisien mid-band yang dipakai per blok
+DCT_MIN_COPIES = 3                             # salinan minimum setiap bit
+_DCT_HEADER = struct.Struct('>2sH')            # magic | panjang payload (byte)
+_DCT_HEADER_BITS = _DCT_HEADER.size * 8
+_DCT_HEADER_EVERY = 5                          # 1 dari 5 slot untuk salinan header
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _dct_matrix(size=8):
+    # Matriks DCT-II ortonormal: C = D @ B @ D.T dan B = D.T @ C @ D
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+# Basis DCT untuk koefisien mid-band saja (64 x jumlah koefisien): proyeksi semua
+# blok sekaligus cukup satu perkalian matriks, tanpa menghitung 60 koefisien lain
+_DCT = _dct_matrix()
+_DCT_BASIS = np.stack([np.outer(_DCT[row], _DCT[col]).reshape(64) for row, col in DCT_BAND],
+                      axis=1).astype(np.float32)
+
+
+def _dct_carrier(image):
+    # Gambar kerja (L / RGB / RGBA) beserta luminance float32-nya
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    pixels = np.asarray(image)
+    if image.mode == 'L':
+        luma = pixels.astype(np.float32)
+    else:
+        luma = pixels[..., :3].astype(np.float32) @ _LUMA
+    return image, pixels, luma
+
+
+def _dct_coefficients(luma):
+    # Semua blok 8x8 penuh (baris, kolom, 64) diproyeksikan ke basis mid-band
+    # dalam satu matmul batch -> koefisien (baris * kolom * len(DCT_BAND),)
+    rows, cols = luma.shape[0] // 8, luma.shape[1] // 8
+    blocks = luma[:rows * 8, :cols * 8].reshape(rows, 8, cols, 8).swapaxes(1, 2).reshape(rows * cols, 64)
+    return (blocks @ _DCT_BASIS).reshape(-1), (rows, cols)
+
+
+def _dct_layout(slot_count):
+    # Setiap slot ke-5 menyimpan salinan header, sisanya payload; keduanya berulang
+    # siklis sehingga salinan setiap bit tersebar ke seluruh gambar
+    is_header = np.arange(slot_count) % _DCT_HEADER_EVERY == 0
+    return is_header, int(np.count_nonzero(is_header)), slot_count - int(np.count_nonzero(is_header))
+
+
+def _dct_votes(coefficients, bit_count):
+    # Suara lunak per slot: +1 tepat di kisi bit 1 (+step/4), -1 di kisi bit 0 (-step/4),
+    # lalu dijumlahkan per bit (semua salinan)
+    soft = np.sin(2 * np.pi * coefficients / DCT_STEP)
+    return np.bincount(np.arange(len(soft)) % bit_count, weights=soft, minlength=bit_count)
+
+
+def _embed_dct(image, watermark_text, steps):
+    # LANGKAH 1: Luminance gambar
+    image, pixels, luma = _dct_carrier(image)
+    steps.add(
+        1, 'Konversi ke Luminance',
+        'Watermark disisipkan ke luminance (Y), channel yang dipertahankan kompresi JPEG',
+        lambda: f'Mode gambar: {image.mode}\nDimensi: {image.size[0]}x{image.size[1]}'
+    )
+
+    # LANGKAH 2: Susun bit header + payload (UTF-8)
+    payload = watermark_text.encode('utf-8')
+    if len(payload) > 0xFFFF:
+        raise ValueError("Watermark terlalu panjang! Maksimal 65535 byte")
+    header_bits = np.unpackbits(np.frombuffer(_DCT_HEADER.pack(DCT_MAGIC, len(payload)), dtype=np.uint8))
+    payload_bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+    steps.add(
+        2, 'Susun Bit Watermark',
+        'Header (magic + panjang) dan teks UTF-8 dikonversi ke bit',
+        lambda: f'Magic: {DCT_MAGIC!r}\nPanjang payload: {len(payload)} byte\nTotal bit: {_DCT_HEADER_BITS} header + {len(payload_bits)} payload'
+    )
+
+    # LANGKAH 3: DCT semua blok 8x8 sekaligus
+    coefficients, (rows, cols) = _dct_coefficients(luma)
+    steps.add(
+        3, 'DCT Blok 8x8',
+        'Koefisien mid-band semua blok dihitung dengan satu perkalian matriks',
+        lambda: f'Jumlah blok: {rows} x {cols} = {rows * cols}\nKoefisien per blok: {list(DCT_BAND)}\nTotal slot: {len(coefficients)}'
+    )
+
+    # LANGKAH 4: Validasi kapasitas (setiap bit minimal DCT_MIN_COPIES salinan)
+    # Header dan payload diperiksa terpisah, pesan error menyebut bagian yang kurang
+    is_header, header_slots, payload_slots = _dct_layout(len(coefficients))
+    header_needed = _DCT_HEADER_BITS * DCT_MIN_COPIES
+    needed = max(len(payload_bits), 1) * DCT_MIN_COPIES
+    shortage = None
+    if header_slots < header_needed:
+        shortage = f'Dibutuhkan {header_needed} slot header, tersedia {header_slots}'
+    elif payload_slots < needed:
+        shortage = f'Dibutuhkan {needed} slot payload, tersedia {payload_slots}'
+    if shortage is not None:
+        steps.add(
+            4, 'Validasi Kapasitas',
+            'Memeriksa apakah jumlah blok cukup untuk salinan setiap bit',
+            lambda: f'GAGAL! {shortage}',
+            status='error'
+        )
+        raise ValueError(f"Gambar terlalu kecil untuk watermark DCT! {shortage}")
+    copies = payload_slots // max(len(payload_bits), 1)
+    steps.add(
+        4, 'Validasi Kapasitas',
+        'Memeriksa apakah jumlah blok cukup untuk salinan setiap bit',
+        lambda: f'Slot header: {header_slots} ({header_slots // _DCT_HEADER_BITS}x salinan)\nSlot payload: {payload_slots} ({copies}x salinan per bit)'
+    )
+
+    # LANGKAH 5: QIM - geser setiap koefisien ke kisi bit-nya (±step/4)
+    bits = np.empty(len(coefficients), dtype=np.float32)
+    bits[is_header] = header_bits[np.arange(header_slots) % _DCT_HEADER_BITS]
+    if len(payload_bits):
+        bits[~is_header] = payload_bits[np.arange(payload_slots) % len(payload_bits)]
+    else:
+        bits[~is_header] = 0
+    dither = (bits - 0.5) * (DCT_STEP / 2)
+    delta = DCT_STEP * np.round((coefficients - dither) / DCT_STEP) + dither - coefficients
+    steps.add(
+        5, 'Kuantisasi QIM',
+        f'Setiap koefisien dibulatkan ke kisi bit 0 (-{DCT_STEP / 4:g}) atau bit 1 (+{DCT_STEP / 4:g}) dengan langkah {DCT_STEP}',
+        lambda: f'Rata-rata perubahan koefisien: {float(np.abs(delta).mean()):.2f}\nPerubahan maksimum: {float(np.abs(delta).max()):.2f}'
+    )
+
+    # LANGKAH 6: Inverse DCT perubahan (matmul batch) lalu tambahkan ke pixel;
+    # perubahan yang sama di R, G, B hanya menggeser luminance
+    offset = (delta.reshape(rows * cols, len(DCT_BAND)) @ _DCT_BASIS.T)
+    offset = offset.reshape(rows, cols, 8, 8).swapaxes(1, 2).reshape(rows * 8, cols * 8)
+    result = pixels.copy()
+    area = result[:rows * 8, :cols * 8]
+    if result.ndim == 2:
+        area[...] = np.clip(np.rint(area + offset), 0, 255)
+    else:
+        for channel in range(3):
+            area[..., channel] = np.clip(np.rint(area[..., channel] + offset), 0, 255)
+    watermarked = Image.fromarray(result, image.mode)
+    steps.add(
+        6, 'Inverse DCT ke Pixel',
+        'Perubahan koefisien dikembalikan ke domain pixel dan ditambahkan ke gambar',
+        lambda: f'Perubahan pixel maksimum: {float(np.abs(offset).max()):.2f}\nGambar hasil: {watermarked.mode} {watermarked.size}'
+    )
+    return watermarked
+
+
+def _extract_dct(image, steps):
+    # LANGKAH 1: Luminance dan koefisien mid-band semua blok
+    image, _pixels, luma = _dct_carrier(image)
+    coefficients, (rows, cols) = _dct_coefficients(luma)
+    is_header, header_slots, payload_slots = _dct_layout(len(coefficients))
+    steps.add(
+        1, 'DCT Blok 8x8',
+        'Koefisien mid-band semua blok luminance dihitung dengan satu perkalian matriks',
+        lambda: f'Jumlah blok: {rows} x {cols} = {rows * cols}\nTotal slot: {len(coefficients)}'
+    )
+    if header_slots < _DCT_HEADER_BITS * DCT_MIN_COPIES:
+        steps.add(2, 'Baca Header', 'Gambar terlalu kecil untuk watermark DCT', '', status='error')
+        return None
+
+    # LANGKAH 2: Header dari suara semua salinan
+    header_votes = _dct_votes(coefficients[is_header], _DCT_HEADER_BITS)
+    magic, length = _DCT_HEADER.unpack(np.packbits(header_votes > 0).tobytes())
+    confidence = float(np.abs(header_votes).sum() / header_slots)
+    if magic != DCT_MAGIC or max(length * 8, 1) * DCT_MIN_COPIES > payload_slots:
+        steps.add(
+            2, 'Baca Header',
+            'Memeriksa magic watermark DCT',
+            lambda: f'Magic: {magic!r} bukan magic watermark DCT {DCT_MAGIC!r}',
+            status='error'
+        )
+        return None
+    steps.add(
+        2, 'Baca Header',
+        'Header dibaca dari suara mayoritas semua salinan',
+        lambda: f'Magic: {magic!r}\nPanjang payload: {length} byte\nKeyakinan: {confidence:.2f}'
+    )
+
+    # LANGKAH 3: Payload
+    if length == 0:
+        return ''
+    payload_votes = _dct_votes(coefficients[~is_header], length * 8)
+    watermark = np.packbits(payload_votes > 0).tobytes().decode('utf-8', errors='replace')
+    steps.add(
+        3, 'Baca Payload',
+        'Setiap bit payload diputuskan dari suara semua salinannya',
+        lambda: f'Salinan per bit: {payload_slots // (length * 8)}\nWatermark: {watermark}'
+    )
+    return watermark
+
+
+@timed
+def add_invisible_watermark(image, watermark_text, return_steps=False, trace_level=None, message_bits=None,
+                            method='lsb'):
+    logger.info("[WATERMARK INVISIBLE] Menambahkan watermark: '%s'", watermark_text)
+
+    if method not in INVISIBLE_METHODS:
+        raise ValueError(f"Metode watermark invisible harus salah satu dari {INVISIBLE_METHODS}")
+    if method == 'dct':
+        steps = StepTrace(resolve_trace_level(trace_level, return_steps))
+        watermarked_image = _embed_dct(image, watermark_text, steps)
+        logger.info("[WATERMARK INVISIBLE] Watermark DCT berhasil disisipkan")
+        if return_steps:
+            return watermarked_image, steps
+        return watermarked_image
 
     # Import fungsi dari modul steganography
-    from steganography import encode_message_lsb
+    from steganography import encode_message_lsb, WATERMARK_MAGIC
 
-    # Tambahkan prefix "WM:" untuk identifikasi watermark
-    watermark_with_prefix = f"WM:{watermark_text}"
-    print(f"[WATERMARK INVISIBLE] Dengan prefix: '{watermark_with_prefix}'")
+    # Header dengan magic watermark menandai stream sebagai watermark
+    logger.debug("[WATERMARK INVISIBLE] Dengan magic header: %r", WATERMARK_MAGIC)
 
     # Gunakan metode LSB steganography untuk encoding
-    watermarked_image = encode_message_lsb(image, watermark_with_prefix)
+    watermarked_image, steps = encode_message_lsb(
+        image, watermark_text, return_steps=True, magic=WATERMARK_MAGIC, message_bits=message_bits,
+        trace_level=resolve_trace_level(trace_level, return_steps)
+    )
 
-    print("[WATERMARK INVISIBLE] Watermark berhasil disembunyikan")
+    logger.info("[WATERMARK INVISIBLE] Watermark berhasil disembunyikan")
+    if return_steps:
+        return watermarked_image, steps
     return watermarked_image
 
 
-def extract_invisible_watermark(image):
-    print("[WATERMARK INVISIBLE] Mengekstrak watermark dari gambar...")
+@timed
+def extract_invisible_watermark(image, return_steps=False, trace_level=None, method='auto'):
+    logger.debug("[WATERMARK INVISIBLE] Mengekstrak watermark dari gambar...")
 
     # Import fungsi dari modul steganography
-    from steganography import decode_message_lsb
-
-    # Decode pesan menggunakan LSB steganography
-    message = decode_message_lsb(image)
-
-    # Verifikasi apakah ada prefix "WM:"
-    if message.startswith("WM:"):
-        watermark = message[3:]  # Hapus prefix "WM:"
-        print(f"[WATERMARK INVISIBLE] Watermark ditemukan: '{watermark}'")
-        return watermark
+    from steganography import decode_message_lsb, read_header, WATERMARK_MAGIC
+
+    if method not in INVISIBLE_METHODS + ('auto',):
+        raise ValueError(f"Metode watermark invisible harus salah satu dari {INVISIBLE_METHODS + ('auto',)}")
+    trace_level = resolve_trace_level(trace_level, return_steps)
+
+    # Verifikasi magic pada header format v2; tanpa header LSB (mis. gambar
+    # hasil kompresi JPEG) dicoba watermark DCT sebelum format lama
+    header = read_header(image) if method != 'dct' else None
+    dct_watermark = None
+    if header is None and method != 'lsb':
+        steps = StepTrace(trace_level)
+        dct_watermark = _extract_dct(image, steps)
+
+    if dct_watermark is not None:
+        watermark = dct_watermark
+        logger.info("[WATERMARK INVISIBLE] Watermark DCT ditemukan: '%s'", watermark)
+    elif method == 'dct':
+        watermark = "No watermark found"
+        logger.info("[WATERMARK INVISIBLE] Tidak ditemukan watermark DCT")
+    elif header is not None and header['magic'] != WATERMARK_MAGIC:
+        logger.info("[WATERMARK INVISIBLE] Tidak ditemukan watermark (magic header bukan watermark)")
+        watermark, steps = "No watermark found", StepTrace(trace_level)
+        steps.add(
+            1, 'Baca Header',
+            'Memeriksa magic pada header format v2',
+            lambda: f"Magic: {header['magic']!r} bukan magic watermark {WATERMARK_MAGIC!r}",
+            status='error'
+        )
+    elif header is not None:
+        watermark, steps = decode_message_lsb(image, return_steps=True, trace_level=trace_level)
+        logger.info("[WATERMARK INVISIBLE] Watermark ditemukan: '%s'", watermark)
     else:
-        print("[WATERMARK INVISIBLE] Tidak ditemukan watermark (prefix 'WM:' tidak ada)")
-        return "No watermark found"
-
-
-def compare_images(original, watermarked):
-    # Konversi ke array
-    orig_array = np.array(original)
-    wm_array = np.array(watermarked)
-
-    # Hitung MSE (Mean Squared Error)
-    mse = np.mean((orig_array.astype(float) - wm_array.astype(float)) ** 2)
+        # Format lama: pesan dengan prefix "WM:" dan delimiter
+        message, steps = decode_message_lsb(image, return_steps=True, trace_level=trace_level)
+        if message.startswith("WM:"):
+            watermark = message[3:]  # Hapus prefix "WM:"
+            logger.info("[WATERMARK INVISIBLE] Watermark ditemukan: '%s'", watermark)
+        else:
+            watermark = "No watermark found"
+            logger.info("[WATERMARK INVISIBLE] Tidak ditemukan watermark (header dan prefix 'WM:' tidak ada)")
 
-    # Hitung PSNR (Peak Signal-to-Noise Ratio)
-    # PSNR tinggi = kualitas bagus (minimal perubahan)
-    if mse == 0:
-        psnr = float('inf')
-    else:
-        max_pixel = 255.0
-        psnr = 20 * np.log10(max_pixel / np.sqrt(mse))
-
-    # Hitung persentase pixel yang berbeda
-    diff_pixels = np.sum(orig_array != wm_array)
-    total_pixels = orig_array.size
-    diff_percentage = (diff_pixels / total_pixels) * 100
-
-    return {
-        'mse': mse,
-        'psnr': psnr,
-        'diff_pixels': diff_pixels,
-        'total_pixels': total_pixels,
-        'diff_percentage': diff_percentage
-    }
+    if return_steps:
+        return watermark, steps
+    return watermark
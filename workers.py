@@ -0,0 +1,421 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+import functools
+import hashlib
+import inspect
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from PIL import Image, ImageFile
+import io
+
+from output import DEFAULT_PROFILE, EncodedImage, encode_image
+import telemetry
+from metrics import compare_images
+from steganography import encode_message_lsb, decode_message_lsb
+from tracing import StepTrace
+from watermarking import (
+    add_visible_watermark,
+    add_visible_watermark_image,
+    add_invisible_watermark,
+    extract_invisible_watermark,
+    logo_cache
+)
+
+
+# Functions the routes may run on the pool (looked up by name in the worker)
+TASKS = {
+    'encode_message_lsb': encode_message_lsb,
+    'decode_message_lsb': decode_message_lsb,
+    'add_visible_watermark': add_visible_watermark,
+    'add_visible_watermark_image': add_visible_watermark_image,
+    'add_invisible_watermark': add_invisible_watermark,
+    'extract_invisible_watermark': extract_invisible_watermark,
+    'compare_images': compare_images
+}
+
+BACKENDS = ('process', 'thread', 'inline')
+LOGO_CACHE_COUNTERS = ('hits', 'misses', 'evictions')
+
+
+class PoolBusy(Exception):
+    # Raised when the queue is full; the route answers 503 + Retry-After
+    def __init__(self, retry_after):
+        super().__init__('Server busy, please retry later')
+        self.retry_after = retry_after
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class SharedImage:
+    # Picklable handle to an image whose pixels live in shared memory, so
+    # large buffers reach the worker processes without being pickled
+
+    def __init__(self, name, mode, size, length, palette=None):
+        self.name = name
+        self.mode = mode
+        self.size = size
+        self.length = length
+        self.palette = palette
+
+    @classmethod
+    def from_image(cls, image):
+        data = image.tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        shm.close()
+        palette = image.getpalette() if image.mode in ('P', 'PA') else None
+        return cls(shm.name, image.mode, image.size, len(data), palette)
+
+    def to_image(self):
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            image = Image.frombytes(self.mode, self.size, shm.buf[:self.length])
+        finally:
+            shm.close()
+        if self.palette is not None:
+            image.putpalette(self.palette)
+        return image
+
+    def unlink(self):
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+class EncodedFile:
+    # Picklable handle to a not-yet-decoded upload: the worker re-opens it
+    # lazily, so decoding (or decoding only the needed rows) happens there
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def from_image(cls, image):
+        # Only for images still lazy after Image.open (nothing decoded yet)
+        if not isinstance(image, ImageFile.ImageFile) or not image.tile or getattr(image, 'fp', None) is None:
+            return None
+        image.fp.seek(0)
+        return cls(image.fp.read())
+
+    def to_image(self):
+        return Image.open(io.BytesIO(self.data))
+
+
+def run_task(name, args, kwargs, profile=DEFAULT_PROFILE):
+    # Runs inside the worker: rebuild shared images, call the function and
+    # turn images/traces into plain picklable values (EncodedImage, step lists).
+    # Returns the result plus the job timings and the stage timings recorded
+    # meanwhile, so they reach the parent's /metrics from any backend
+    with telemetry.capture() as samples:
+        start = time.perf_counter()
+        args = [arg.to_image() if isinstance(arg, (SharedImage, EncodedFile)) else arg for arg in args]
+        decoded = time.perf_counter()
+        result = TASKS[name](*args, **kwargs)
+        processed = time.perf_counter()
+
+    values = result if isinstance(result, tuple) else (result,)
+    converted = []
+    encode = 0.0
+    for value in values:
+        if isinstance(value, Image.Image):
+            value = encode_image(value, profile)
+            encode += value.encode_ms / 1000
+        elif isinstance(value, StepTrace):
+            value = value.to_list()
+        converted.append(value)
+    # The logo cache lives in the process that ran the task; its counters travel
+    # back too, so the parent can report the caches of its process workers
+    timings = {'decode': decoded - start, 'process': processed - decoded, 'encode': encode, 'samples': samples,
+               'logo_cache': (os.getpid(), logo_cache.stats())}
+    return (tuple(converted) if isinstance(result, tuple) else converted[0]), timings
+
+
+def _job_finished(timings):
+    # In the calling thread: merge the worker's stage timings and report the
+    # job stages to the request running on this thread (if any)
+    telemetry.record(timings['samples'])
+    request_timer = telemetry.current_request()
+    if request_timer is not None:
+        request_timer.job_done(timings['decode'], timings['process'], timings['encode'])
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version():
+    # Cached results are only valid for the code that produced them: the key
+    # includes the source of the modules the tasks and the result encoding use
+    digest = hashlib.blake2b(digest_size=16)
+    modules = {function.__module__ for function in TASKS.values()} | {'steganography', 'output', 'tracing'}
+    for module in sorted(modules):
+        with open(sys.modules[module].__file__, 'rb') as source:
+            digest.update(source.read())
+    return digest.digest()
+
+
+@functools.lru_cache(maxsize=None)
+def _signature(name):
+    return inspect.signature(TASKS[name])
+
+
+def _feed(digest, value):
+    # Content of one argument into the hash; TypeError for values that can't be keyed
+    if isinstance(value, Image.Image):
+        fp = getattr(value, 'fp', None)
+        if isinstance(value, ImageFile.ImageFile) and value.tile and fp is not None:
+            # Still lazy: the encoded upload bytes identify it, nothing is decoded
+            position = fp.tell()
+            fp.seek(0)
+            data = fp.read()
+            fp.seek(position)
+            digest.update(b'file:%d:' % len(data))
+            digest.update(data)
+        else:
+            palette = value.getpalette() if value.mode in ('P', 'PA') else None
+            digest.update(f'image:{value.mode}:{value.size}:{palette}'.encode())
+            digest.update(value.tobytes())
+    elif isinstance(value, SharedImage):
+        shm = shared_memory.SharedMemory(name=value.name)
+        try:
+            digest.update(f'image:{value.mode}:{value.size}:{value.palette}'.encode())
+            digest.update(shm.buf[:value.length])
+        finally:
+            shm.close()
+    elif isinstance(value, EncodedFile):
+        digest.update(b'file:%d:' % len(value.data))
+        digest.update(value.data)
+    elif isinstance(value, (bytes, bytearray)):
+        digest.update(b'bytes:%d:' % len(value))
+        digest.update(value)
+    elif isinstance(value, np.ndarray):
+        digest.update(f'array:{value.dtype}:{value.shape}:'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        digest.update(f'{type(value).__name__}:{value!r};'.encode())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'seq:%d:' % len(value))
+        for item in value:
+            _feed(digest, item)
+    elif isinstance(value, dict):
+        digest.update(b'dict:%d:' % len(value))
+        for key in sorted(value):
+            _feed(digest, key)
+            _feed(digest, value[key])
+    elif hasattr(value, '__dict__'):
+        # Plain value objects such as steganography.Payload
+        digest.update(f'object:{type(value).__qualname__}:'.encode())
+        _feed(digest, vars(value))
+    else:
+        raise TypeError(f'Cannot key {type(value).__name__}')
+
+
+def cache_key(name, args, kwargs, profile):
+    # Hash of the input bytes plus the normalized parameters (positional and
+    # keyword arguments bound to the signature, defaults filled in).
+    # Returns (key, persist) or (None, False) if an argument can't be keyed;
+    # results of keyed payloads are kept in memory only, never on disk
+    try:
+        bound = _signature(name).bind(*args, **kwargs)
+    except TypeError:
+        return None, False
+    bound.apply_defaults()
+
+    digest = hashlib.blake2b(_code_version(), digest_size=20)
+    digest.update(f'{name}:{profile};'.encode())
+    try:
+        _feed(digest, dict(bound.arguments))
+    except TypeError:
+        return None, False
+    return digest.hexdigest(), bound.arguments.get('key') is None
+
+
+def _mark_cached(result):
+    # Encoded images from the cache were not encoded for this request: flag
+    # them and drop the encode time they were stored with
+    for value in (result if isinstance(result, tuple) else (result,)):
+        if isinstance(value, EncodedImage):
+            value.cached = True
+            value.encode_ms = 0.0
+    return result
+
+
+class WorkerPool:
+
+    def __init__(self, backend='process', workers=None, queue_size=16, job_timeout=60, retry_after=2,
+                 admission=None, cache=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown worker backend '{backend}', choose one of: {', '.join(BACKENDS)}")
+        self.backend = backend
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self.retry_after = retry_after
+        self.admission = admission
+        self.cache = cache
+        self._executor = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Latest logo cache stats per process worker, plus the counters of
+        # workers from a pool that was replaced (process backend only)
+        self._logo_caches = {}
+        self._retired_logo_counts = dict.fromkeys(LOGO_CACHE_COUNTERS, 0)
+        # Jobs running + waiting; beyond this we reject instead of queueing
+        self._slots = threading.BoundedSemaphore((workers or 1) + queue_size)
+
+    def _get_executor(self):
+        # Created lazily so importing the app does not fork workers
+        with self._lock:
+            if self._executor is None:
+                if self.backend == 'process':
+                    # Start the shared memory tracker before forking, so workers
+                    # share it instead of each tracking (and "leaking") segments
+                    resource_tracker.ensure_running()
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                elif self.backend == 'thread':
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def run(self, name, *args, block=False, profile=DEFAULT_PROFILE, **kwargs):
+        # block=True waits up to job_timeout for a free slot (used by batch
+        # routes); otherwise a full queue fails fast with PoolBusy.
+        # Result images are encoded in the worker with the given output profile.
+        # Identical requests (same input bytes and normalized parameters) are
+        # answered from the result cache, without admission or a worker.
+        request_timer = telemetry.current_request()
+        if request_timer is not None:
+            request_timer.lap('decode')  # upload read + header parse in the route
+
+        self._local.cache_hit = False
+        key, persist = cache_key(name, args, kwargs, profile) if self.cache is not None else (None, False)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._local.cache_hit = True
+                if request_timer is not None:
+                    request_timer.lap('cache')
+                return _mark_cached(cached)
+
+        start = time.perf_counter()
+        result = self._run(name, args, kwargs, block, profile)
+        if key is not None:
+            self.cache.put(key, result, time.perf_counter() - start, persist=persist)
+        return result
+
+    def cache_hit(self):
+        # Whether the last run() on this thread was answered from the result cache
+        return getattr(self._local, 'cache_hit', False)
+
+    def _run(self, name, args, kwargs, block, profile):
+        # Admission (if configured) checks the estimated cost from the image
+        # headers first, before anything is decoded.
+        cost = None
+        if self.admission is not None:
+            cost = self.admission.admit(name, args, kwargs, timeout=self.job_timeout if block else None)
+
+        if block:
+            acquired = self._slots.acquire(timeout=self.job_timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            if cost is not None:
+                self.admission.release(cost)
+            raise PoolBusy(self.retry_after)
+
+        if self.backend == 'inline':
+            try:
+                result, timings = run_task(name, args, kwargs, profile)
+                _job_finished(timings)
+                return result
+            finally:
+                self._slots.release()
+                if cost is not None:
+                    self.admission.release(cost)
+
+        owned = []
+
+        def finished(_future):
+            # The slot, budget and shared memory are held until the worker is really done
+            for shared in owned:
+                shared.unlink()
+            self._slots.release()
+            if cost is not None:
+                self.admission.release(cost)
+
+        try:
+            # Process workers get lazy uploads as their encoded bytes (decoded in
+            # the worker); already decoded pixel buffers go through shared memory
+            if self.backend == 'process':
+                converted = []
+                for arg in args:
+                    if isinstance(arg, Image.Image):
+                        encoded = EncodedFile.from_image(arg)
+                        if encoded is not None:
+                            arg = encoded
+                        else:
+                            arg = SharedImage.from_image(arg)
+                            owned.append(arg)
+                    converted.append(arg)
+                args = converted
+
+            future = self._get_executor().submit(run_task, name, args, kwargs, profile)
+        except Exception:
+            finished(None)
+            raise
+        future.add_done_callback(finished)
+
+        try:
+            result, timings = future.result(timeout=self.job_timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise JobTimeout(f'Job exceeded {self.job_timeout}s timeout')
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool next time
+            with self._lock:
+                self._executor = None
+                self._retire_logo_caches()
+            raise
+        _job_finished(timings)
+        if self.backend == 'process':
+            pid, cache_stats = timings['logo_cache']
+            with self._lock:
+                self._logo_caches[pid] = cache_stats
+        return result
+
+    def _retire_logo_caches(self):
+        # Caller holds the lock: the workers are gone, their counters stay
+        for cache_stats in self._logo_caches.values():
+            for counter in LOGO_CACHE_COUNTERS:
+                self._retired_logo_counts[counter] += cache_stats[counter]
+        self._logo_caches.clear()
+
+    def logo_cache_stats(self):
+        # Prepared logo cache usage wherever the tasks run: this process for the
+        # thread/inline backends, otherwise the sum over the process workers (as
+        # of each worker's last job)
+        if self.backend != 'process':
+            return logo_cache.stats()
+        with self._lock:
+            workers = list(self._logo_caches.values())
+            total = dict(self._retired_logo_counts)
+        for counter in LOGO_CACHE_COUNTERS:
+            total[counter] += sum(cache_stats[counter] for cache_stats in workers)
+        total['entries'] = sum(cache_stats['entries'] for cache_stats in workers)
+        total['bytes'] = sum(cache_stats['bytes'] for cache_stats in workers)
+        total['max_bytes'] = logo_cache.max_bytes * (self.workers or os.cpu_count() or 1)
+        total['workers'] = len(workers)
+        return total
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._retire_logo_caches()